@@ -0,0 +1,116 @@
+import collections
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It provides an Aho-Corasick automaton for matching many dictionary keys against a text in a single pass.
+
+create_automaton returns a pyahocorasick Automaton (pip install pyahocorasick) if it is installed, and otherwise the
+pure-Python AhoCorasickAutomaton below, which implements the subset of the pyahocorasick interface used by this
+pipeline: add_word, make_automaton and iter.
+"""
+
+class AhoCorasickAutomaton(object):
+    """
+    Pure-Python Aho-Corasick automaton.
+
+    States are numbered from 0 (the root).  Each state has a dict of character transitions, a failure link to the state
+    of its longest proper suffix, the value of the key ending at the state (if any), and an output link to the next
+    state along the failure chain that ends a key.
+    """
+
+    def __init__(self):
+        self.transitions = [{}]
+        self.values = [None]
+        self.has_value = [False]
+        self.fail = None
+        self.output = None
+
+    def add_word(self, key, value):
+        """
+        :param key (str): string to match
+        :param value: returned by iter for every match of key.  A key added again replaces its value.
+        :return (bool): True if key was new
+        """
+        if self.fail is not None:
+            raise ValueError("Words cannot be added after make_automaton.")
+
+        state = 0
+        for char in key:
+            next_state = self.transitions[state].get(char)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions[state][char] = next_state
+                self.transitions.append({})
+                self.values.append(None)
+                self.has_value.append(False)
+            state = next_state
+
+        is_new = not self.has_value[state]
+        self.values[state] = value
+        self.has_value[state] = True
+        return is_new
+
+    def __len__(self):
+        return sum(self.has_value)
+
+    def make_automaton(self):
+        """
+        Compute failure and output links with a breadth-first pass over the trie.
+        """
+        n_states = len(self.transitions)
+        self.fail = [0] * n_states
+        self.output = [-1] * n_states
+
+        queue = collections.deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.transitions[state].items():
+                fail_state = self.fail[state]
+                while fail_state and char not in self.transitions[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.transitions[fail_state].get(char, 0)
+
+                suffix_state = self.fail[next_state]
+                self.output[next_state] = suffix_state if self.has_value[suffix_state] else self.output[suffix_state]
+                queue.append(next_state)
+
+    def iter(self, text):
+        """
+        Find every occurrence of every key in text, including overlapping ones.
+
+        :param text (str): text to search
+        :return: generator of (end index, value) tuples, as pyahocorasick's Automaton.iter.  end index is the position
+                 of the last character of the match.
+        """
+        if self.fail is None:
+            raise ValueError("make_automaton must be called before iter.")
+
+        transitions = self.transitions
+        fail = self.fail
+        output = self.output
+        has_value = self.has_value
+        values = self.values
+
+        state = 0
+        for end_index, char in enumerate(text):
+            next_state = transitions[state].get(char)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = transitions[state].get(char)
+            state = next_state or 0
+
+            match_state = state if has_value[state] else output[state]
+            while match_state > 0:
+                yield end_index, values[match_state]
+                match_state = output[match_state]
+
+def create_automaton():
+    """
+    :return automaton: empty pyahocorasick Automaton if pyahocorasick is installed, otherwise an AhoCorasickAutomaton
+    """
+    try:
+        import ahocorasick
+    except ImportError:
+        return AhoCorasickAutomaton()
+    return ahocorasick.Automaton()
@@ -0,0 +1,368 @@
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import re
+import time
+
+from aho_corasick import create_automaton
+from pubmed_xml_reader import iter_pubmed_articles, list_pubmed_batch_files
+
+"""
+This script is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+Shared Task specifications:
+https://drive.google.com/file/d/1G0po_xlRjQCZ-qxuA_4PLdipXU6rtYTp/view
+
+This script annotates biomedical texts with the entity dictionaries generated by generate_bacteria_taxid_dict.py
+(microorganisms) and extract_obo_category_nodes.py (habitats, phenotypes).  Matches are written as BioNLP .a1-style
+annotation files: a T line per entity span and an N line per dictionary ID the span normalizes to.
+
+Ex:
+    T1	Microorganism 52 73	Staphylococcus aureus
+    T2	Habitat 88 92	skin
+    N1	NCBI_Taxonomy Annotation:T1 Referent:1280
+    N2	OntoBiotope Annotation:T2 Referent:OBT:000325
+
+All dictionary keys are compiled into one Aho-Corasick automaton (see aho_corasick.py), so each text is scanned in a
+single pass whatever the number of keys.  Keys and texts are matched case-insensitively, with every whitespace character
+(including the \xa0 in abbreviations such as "S.\xa0aureus") read as a space and runs of whitespace collapsed.  Only
+whole-word matches are kept, and by default only the longest of overlapping matches.
+
+    python annotate_texts_with_entity_dictionaries.py texts/ annotations/ \
+        --dictionary Microorganism=microorganism_taxid_dict.json \
+        --dictionary Habitat=microbial_habitat.json --dictionary Phenotype=phenotype.json
+
+Dictionaries may also be compact dictionary files (see compact_dictionary.py).
+
+With --pubmed_xml, the input directory holds PubMed XML batch files from easy_pubmed_batch_downloads.R.  They are
+streamed one article at a time (see pubmed_xml_reader.py), and the merged title and abstract of each article is written
+to <PMID>.txt next to its <PMID>.a1, so annotation offsets refer to that text.
+"""
+
+# Every whitespace character other than ' ' (tabs, newlines, \xa0, thin spaces, ...) is read as a space
+WHITESPACE_TRANSLATION = {i: ' ' for i in range(0x3001) if chr(i).isspace() and chr(i) != ' '}
+
+MULTIPLE_SPACES_PATTERN = re.compile(r'  +')
+
+def normalize_text(text):
+    """
+    Lower-case text, read every whitespace character as a space and collapse runs of spaces.
+
+    :param text (str): text to normalize
+    :return (tuple): (normalized text, offsets), where offsets[i] is the position in text of normalized character i, or
+                     None if every character kept its position
+    """
+    normalized = text.translate(WHITESPACE_TRANSLATION)
+    lowered = normalized.lower()
+    if len(lowered) != len(normalized):
+        # A few characters lower-case to several (ex: 'İ').  They are kept as they are, so positions still line up.
+        lowered = ''.join(char.lower() if len(char.lower()) == 1 else char for char in normalized)
+
+    if '  ' not in lowered:
+        return lowered, None
+
+    pieces = []
+    offsets = []
+    piece_start = 0
+    for match in MULTIPLE_SPACES_PATTERN.finditer(lowered):
+        pieces.append(lowered[piece_start:match.start() + 1])
+        offsets.extend(range(piece_start, match.start() + 1))
+        piece_start = match.end()
+    pieces.append(lowered[piece_start:])
+    offsets.extend(range(piece_start, len(lowered)))
+
+    return ''.join(pieces), offsets
+
+def normalize_key(key):
+    """
+    :param key (str): dictionary key (entity name)
+    :return (str): key normalized as normalize_text normalizes texts, without leading or trailing spaces
+    """
+    return normalize_text(key)[0].strip()
+
+def iter_dictionary_entries(entity_dict):
+    """
+    Read the entries of a taxid dict (generate_bacteria_taxid_dict.py) or an obo category dict (extract_obo_category_nodes.py).
+
+    :param entity_dict (dict): {name : {'taxid': taxid, ...}} or {name : {'id': obo term id, ...}}
+    :return: generator of (name, normalization type, list of referent ID strings) tuples
+    """
+    for name, entry in entity_dict.items():
+        if 'taxid' in entry:
+            normalization_type = 'NCBI_Taxonomy'
+            referents = entry['taxid']
+        else:
+            normalization_type = 'OntoBiotope'
+            referents = entry.get('id')
+
+        # Manual entries hold the list of taxids returned by get_name_translator
+        if referents is None:
+            referents = []
+        elif not isinstance(referents, list):
+            referents = [referents]
+
+        yield name, normalization_type, [str(referent) for referent in referents]
+
+def iter_dictionary_file_entries(dictionary_path):
+    """
+    :param dictionary_path (str): path to a dictionary json or compact dictionary (see compact_dictionary.py)
+    :return: generator of (name, normalization type, list of referent ID strings) tuples, as iter_dictionary_entries
+    """
+    from compact_dictionary import CompactDictionary, is_compact_dictionary
+
+    if is_compact_dictionary(dictionary_path):
+        with CompactDictionary(dictionary_path) as entity_dict:
+            for entry in iter_dictionary_entries(entity_dict):
+                yield entry
+    else:
+        with open(dictionary_path) as f:
+            entity_dict = json.load(f)
+        for entry in iter_dictionary_entries(entity_dict):
+            yield entry
+
+class EntityDictionaryAnnotator(object):
+    """
+    Dictionary-based entity annotator.  Dictionaries are added with add_dictionary, compiled with make_automaton, and
+    texts are then annotated with find_matches or annotate.
+    """
+
+    def __init__(self):
+        self.automaton = create_automaton()
+        # {normalized key : [(label, normalization type, referent ID or None)]}
+        self.key_entries = {}
+
+    def add_dictionary(self, entity_dict, label):
+        """
+        :param entity_dict (dict): taxid dict or obo category dict (see iter_dictionary_entries)
+        :param label (str): BioNLP entity label of the dictionary's entries, ex: 'Microorganism', 'Habitat', 'Phenotype'
+        """
+        self.add_entries(iter_dictionary_entries(entity_dict), label)
+
+    def add_entries(self, entries, label):
+        """
+        :param entries (iterable): (name, normalization type, list of referent IDs) tuples, ex: from iter_dictionary_entries
+        :param label (str): BioNLP entity label of the entries
+        """
+        for name, normalization_type, referents in entries:
+            key = normalize_key(name)
+            if not key:
+                continue
+
+            entries = self.key_entries.setdefault(key, [])
+            for referent in referents or [None]:
+                entry = (label, normalization_type, referent)
+                if entry not in entries:
+                    entries.append(entry)
+
+    def make_automaton(self):
+        """
+        Compile all keys added so far into the automaton.
+        """
+        for key, entries in self.key_entries.items():
+            self.automaton.add_word(key, (len(key), tuple(entries)))
+        self.automaton.make_automaton()
+
+    def find_matches(self, text, longest_only=True):
+        """
+        :param text (str): text to annotate
+        :param longest_only (bool): keep only the leftmost-longest of overlapping matches, otherwise keep every match
+        :return matches (list): (start, end, entries) tuples, with start and end positions in text, ordered by start
+        """
+        normalized, offsets = normalize_text(text)
+        n_chars = len(normalized)
+
+        matches = []
+        for end_index, (key_length, entries) in self.automaton.iter(normalized):
+            start = end_index - key_length + 1
+            end = end_index + 1
+
+            # Whole words only, ex: 'soil' must not match inside 'soils'
+            if start > 0 and normalized[start].isalnum() and normalized[start - 1].isalnum():
+                continue
+            if end < n_chars and normalized[end - 1].isalnum() and normalized[end].isalnum():
+                continue
+
+            matches.append((start, end, entries))
+
+        matches.sort(key=lambda match: (match[0], -match[1]))
+
+        if longest_only:
+            longest_matches = []
+            last_end = 0
+            for match in matches:
+                if match[0] >= last_end:
+                    longest_matches.append(match)
+                    last_end = match[1]
+            matches = longest_matches
+
+        if offsets is not None:
+            matches = [(offsets[start], offsets[end - 1] + 1, entries) for start, end, entries in matches]
+
+        return matches
+
+    def annotate(self, text, longest_only=True):
+        """
+        :param text (str): text to annotate
+        :param longest_only (bool): keep only the leftmost-longest of overlapping matches
+        :return (list): BioNLP annotation lines, T lines followed by N lines
+        """
+        t_lines = []
+        n_lines = []
+        for start, end, entries in self.find_matches(text, longest_only=longest_only):
+            # A key may be listed in several dictionaries, ex: a name that is both a genus and a habitat
+            label_entries = collections.OrderedDict()
+            for label, normalization_type, referent in entries:
+                label_entries.setdefault(label, []).append((normalization_type, referent))
+
+            span_text = text[start:end].translate(WHITESPACE_TRANSLATION)
+            for label, normalizations in label_entries.items():
+                t_id = 'T%d' % (len(t_lines) + 1)
+                t_lines.append('%s\t%s %d %d\t%s\n' % (t_id, label, start, end, span_text))
+                for normalization_type, referent in normalizations:
+                    if referent is not None:
+                        n_lines.append('N%d\t%s Annotation:%s Referent:%s\n' % (
+                            len(n_lines) + 1, normalization_type, t_id, referent))
+
+        return t_lines + n_lines
+
+def load_annotator(dictionary_specs):
+    """
+    :param dictionary_specs (list): (label, path to dictionary json or compact dictionary) tuples
+    :return annotator (EntityDictionaryAnnotator): annotator with every dictionary compiled
+    """
+    annotator = EntityDictionaryAnnotator()
+    for label, dictionary_path in dictionary_specs:
+        annotator.add_entries(iter_dictionary_file_entries(dictionary_path), label)
+    annotator.make_automaton()
+    return annotator
+
+def iter_text_documents(text_dir):
+    """
+    :param text_dir (str): directory of .txt files, one document per file
+    :return: generator of (document id, text) tuples, in file name order
+    """
+    file_names = sorted(dir_entry.name for dir_entry in os.scandir(text_dir)
+                        if dir_entry.is_file() and dir_entry.name.endswith('.txt'))
+    for file_name in file_names:
+        with open(os.path.join(text_dir, file_name), encoding='utf-8') as f:
+            yield file_name[:-len('.txt')], f.read()
+
+def iter_pubmed_documents(batch_dir, out_dir):
+    """
+    Stream the articles of PubMed XML batch files, writing each article's passage text to <PMID>.txt in out_dir.
+
+    :param batch_dir (str): directory of PubMed XML batch files
+    :param out_dir (str): directory to write passage texts to
+    :return: generator of (PMID, merged title and abstract) tuples
+    """
+    for pmid, passage_text, _ in iter_pubmed_articles(list_pubmed_batch_files(batch_dir)):
+        with open(os.path.join(out_dir, '%s.txt' % pmid), 'w', encoding='utf-8') as f:
+            f.write(passage_text)
+        yield pmid, passage_text
+
+# Annotator of an annotation worker process, set by init_annotation_worker
+worker_annotator = None
+worker_longest_only = True
+
+def init_annotation_worker(annotator, longest_only):
+    """
+    Process pool initializer.  With the fork start method the compiled annotator is shared with workers, not copied.
+
+    :param annotator (EntityDictionaryAnnotator): compiled annotator
+    :param longest_only (bool): see EntityDictionaryAnnotator.annotate
+    """
+    global worker_annotator, worker_longest_only
+    worker_annotator = annotator
+    worker_longest_only = longest_only
+
+def annotate_document(document):
+    """
+    :param document (tuple): (document id, text)
+    :return (tuple): (document id, annotation lines, number of characters annotated)
+    """
+    doc_id, text = document
+    return doc_id, worker_annotator.annotate(text, longest_only=worker_longest_only), len(text)
+
+def iter_annotated_documents(documents, annotator, longest_only=True, workers=1, chunksize=64):
+    """
+    :param documents (iterable): (document id, text) tuples
+    :param annotator (EntityDictionaryAnnotator): compiled annotator
+    :param longest_only (bool): see EntityDictionaryAnnotator.annotate
+    :param workers (int): number of worker processes.  1 annotates in this process.
+    :param chunksize (int): number of documents sent to a worker at a time
+    :return: generator of (document id, annotation lines, number of characters) tuples, in the order of documents
+    """
+    init_annotation_worker(annotator, longest_only)
+    if workers <= 1:
+        for document in documents:
+            yield annotate_document(document)
+        return
+
+    pool = multiprocessing.Pool(workers, initializer=init_annotation_worker, initargs=(annotator, longest_only))
+    try:
+        for annotated_document in pool.imap(annotate_document, documents, chunksize=chunksize):
+            yield annotated_document
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def parse_dictionary_spec(dictionary_spec):
+    """
+    :param dictionary_spec (str): ex: 'Habitat=microbial_habitat.json'
+    :return (tuple): (label, path)
+    """
+    label, separator, path = dictionary_spec.partition('=')
+    if not separator or not label or not path:
+        raise argparse.ArgumentTypeError("Expected LABEL=PATH, ex: Habitat=microbial_habitat.json, got '%s'." %
+                                         dictionary_spec)
+    return label, path
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Annotate texts with entity dictionaries and write BioNLP .a1-style annotation files.")
+    parser.add_argument('text_dir', help='Directory of .txt files to annotate, one document per file.')
+    parser.add_argument('out_dir', help='Directory to write one <document>.a1 annotation file per document to.')
+    parser.add_argument('--dictionary', type=parse_dictionary_spec, action='append', required=True,
+                        help='LABEL=PATH of an entity dictionary json or compact dictionary, ex: Microorganism=taxid_dict.json.  Repeat for each dictionary.')
+    parser.add_argument('--pubmed_xml', action='store_true',
+                        help='text_dir holds PubMed XML batch files (.xml/.txt, optionally gzipped).  Article texts are written to out_dir.')
+    parser.add_argument('--all_matches', action='store_true',
+                        help='Keep overlapping matches.  By default only the longest of overlapping matches is kept.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes annotating documents.')
+    parser.add_argument('--chunksize', type=int, default=64, help='Number of documents sent to a worker at a time.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    annotator = load_annotator(args.dictionary)
+    print("Compiled %d dictionary keys into %s in %.1fs." % (
+        len(annotator.key_entries), type(annotator.automaton).__name__, time.perf_counter() - start))
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    start = time.perf_counter()
+    n_documents = 0
+    n_chars = 0
+    n_entities = 0
+    if args.pubmed_xml:
+        documents = iter_pubmed_documents(args.text_dir, args.out_dir)
+    else:
+        documents = iter_text_documents(args.text_dir)
+    for doc_id, lines, doc_chars in iter_annotated_documents(documents, annotator, longest_only=not args.all_matches,
+                                                             workers=args.workers, chunksize=args.chunksize):
+        with open(os.path.join(args.out_dir, '%s.a1' % doc_id), 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        n_documents += 1
+        n_chars += doc_chars
+        n_entities += sum(1 for line in lines if line.startswith('T'))
+    elapsed = time.perf_counter() - start
+
+    print("Annotated %d entities in %d documents in %.1fs (%.1f documents/sec, %.2f MB/sec)." % (
+        n_entities, n_documents, elapsed, n_documents / elapsed if elapsed else 0,
+        n_chars / 1e6 / elapsed if elapsed else 0))
+
+if __name__ == "__main__":
+    main()
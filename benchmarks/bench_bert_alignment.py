@@ -0,0 +1,183 @@
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import convert_bionlp_ner_train_to_bert_ner_train as converter
+
+"""
+Benchmark of convert_bionlp_abstract_to_bert_train_format against the previous implementation, which looked up sentence
+breaks in a list for every word and aligned entities by their token text.
+
+Passages are either read from BB-norm+ner-F-* (.txt, .a2) files in a BioNLP directory, or generated: long synthetic
+passages with a contiguous entity every few words.  Sentence breaks come from a regex stub, so no spacy model is needed.
+On inputs without discontinuous or overlapping entities both implementations must produce identical lines.
+
+Usage:
+    python benchmarks/bench_bert_alignment.py --bionlp_dir BioNLP-OST-2019_BB-norm+ner_train/
+    python benchmarks/bench_bert_alignment.py --n_words 20000 --n_passages 20
+"""
+
+def legacy_convert_bionlp_abstract_to_bert_train_format(passage_text, ent_lines, sentence_break_indices):
+    """
+    Previous convert_bionlp_abstract_to_bert_train_format.
+    """
+    label_dict = {
+        'Microorganism': 'MORG',
+        'Habitat': 'HAB',
+        'Phenotype': 'PHE'
+    }
+
+    ent_dict = {}
+    for ent_line in ent_lines:
+        label_start_end = ent_line.split('\t')[1].split(' ')
+        label = label_start_end[0]
+        start = label_start_end[1]
+        end = label_start_end[-1]
+        bert_label = label_dict[label]
+
+        start = int(start)
+        end = int(end)
+
+        ent_line = ent_line.replace(u'\xa0', ' ')
+
+        ent_tokens = ent_line.split('\t')[2].split(' ')
+
+        ent_dict[start] = {
+            'end': end,
+            'token': ent_tokens[0],
+            'label': 'B-%s' % bert_label
+        }
+        idx = start + len(ent_tokens[0]) + 1
+
+        for token in ent_tokens[1:]:
+            ent_dict[idx] = {
+                'end': idx + len(token),
+                'token': token,
+                'label': 'I-%s' % bert_label
+            }
+            idx += len(token) + 1
+
+    out_lines = []
+    abstract_idx = 0
+
+    for word in passage_text.split(' '):
+        if word:
+            ent = ent_dict.get(abstract_idx)
+            end = abstract_idx + len(word) + 1
+
+            if ent:
+                out_label = ent['label']
+            else:
+                out_label = 'O'
+
+            if word[-1] == '.' and end in sentence_break_indices:
+                out_lines.append('%s\t%s\n' % (word[:-1], out_label))
+                out_lines.append('%s\tO\n' % (word[-1]))
+            else:
+                out_lines.append('%s\t%s\n' % (word, out_label))
+
+            abstract_idx += len(word) + 1
+            if abstract_idx in sentence_break_indices:
+                out_lines.append('\n')
+
+    return out_lines
+
+def stub_sentence_break_indices(passage_text):
+    """
+    Sentence breaks after every '. ', computed the same way as get_sentence_break_indices.
+    """
+    sentence_break_indices = []
+    idx = 0
+    for sentence in re.split(r'(?<=\.) ', passage_text):
+        idx += len(sentence) + 1
+        sentence_break_indices.append(idx)
+    return sentence_break_indices
+
+def generate_passage(n_words, entity_every=8, sentence_every=20, seed=0):
+    """
+    :return (tuple): (passage text, entity annotation lines) with one contiguous 1-3 word entity every entity_every words
+    """
+    rng = random.Random(seed)
+    labels = sorted(converter.BERT_LABELS)
+    words = []
+    ent_lines = []
+    idx = 0
+    i = 0
+    while i < n_words:
+        if i % entity_every == 0:
+            ent_words = ['ent%d' % rng.randint(0, 999) for _ in range(rng.randint(1, 3))]
+            ent_text = ' '.join(ent_words)
+            ent_lines.append('T%d\t%s %d %d\t%s' % (len(ent_lines) + 1, rng.choice(labels), idx, idx + len(ent_text), ent_text))
+        else:
+            ent_words = ['word%d' % rng.randint(0, 999)]
+
+        for word in ent_words:
+            i += 1
+            if i % sentence_every == 0:
+                word += '.'
+            words.append(word)
+            idx += len(word) + 1
+
+    return ' '.join(words), ent_lines
+
+def read_bionlp_passages(bionlp_dir):
+    """
+    :return passages (list): (passage text, entity annotation lines) of BB-norm+ner-F-* passages in bionlp_dir
+    """
+    passages = []
+    for txt_file in sorted(glob.glob(os.path.join(bionlp_dir, 'BB-norm+ner-F-*.txt'))):
+        ann_file = '%s.a2' % txt_file[:-len('.txt')]
+        if os.path.exists(ann_file):
+            passage_text, bionlp_lines = converter.read_passage_file_pair(txt_file, ann_file)
+            ent_lines = [i for i in converter.extract_ent_lines(bionlp_lines)
+                         if converter.parse_ent_line(i) and converter.parse_ent_line(i)[0] in converter.BERT_LABELS]
+            passages.append((passage_text.replace(u'\xa0', ' '), ent_lines))
+    return passages
+
+def time_conversion(convert_function, passages, repeat):
+    """
+    :return (tuple): (fastest total seconds over repeat runs, lines of the last run)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out_lines = [convert_function(text, ent_lines, breaks) for text, ent_lines, breaks in passages]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out_lines
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BioNLP -> BERT NER token/label alignment.")
+    parser.add_argument('--bionlp_dir', help='Directory containing BB-norm+ner-F-* .txt/.a2 passage files.')
+    parser.add_argument('--n_words', type=int, default=20000, help='Words per synthetic passage.')
+    parser.add_argument('--n_passages', type=int, default=10, help='Number of synthetic passages.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs.  The fastest run is reported.')
+    args = parser.parse_args()
+
+    if args.bionlp_dir:
+        passages = read_bionlp_passages(args.bionlp_dir)
+    else:
+        passages = [generate_passage(args.n_words, seed=i) for i in range(args.n_passages)]
+    passages = [(text, ent_lines, stub_sentence_break_indices(text)) for text, ent_lines in passages]
+
+    n_words = sum(len(text.split()) for text, _, _ in passages)
+    print("%d passages, %d words, %d entities" % (len(passages), n_words, sum(len(i[1]) for i in passages)))
+
+    results = {}
+    for name, convert_function in [('legacy', legacy_convert_bionlp_abstract_to_bert_train_format),
+                                   ('offset-indexed', converter.convert_bionlp_abstract_to_bert_train_format)]:
+        elapsed, out_lines = time_conversion(convert_function, passages, args.repeat)
+        results[name] = out_lines
+        print("%-15s %10.3fs %14.0f words/sec" % (name, elapsed, n_words / elapsed))
+
+    if results['legacy'] != results['offset-indexed']:
+        # Expected only for passages with discontinuous or overlapping entities
+        n_differing = sum(1 for a, b in zip(results['legacy'], results['offset-indexed']) if a != b)
+        print("Outputs differ for %d passages." % n_differing)
+    else:
+        print("Outputs identical.")
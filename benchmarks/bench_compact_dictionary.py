@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from compact_dictionary import CompactDictionary, write_compact_dictionary
+
+"""
+Benchmark of the compact dictionary format against json: file size, load time and peak memory of a fresh process
+opening the dict, and lookup throughput.
+
+A taxid dict of --n_keys generated names is written in both formats.  Loads are timed in fresh interpreters, so peak RSS
+includes the interpreter itself (see the 'baseline' row).
+
+Usage:
+    python benchmarks/bench_compact_dictionary.py --n_keys 2000000
+"""
+
+LOAD_SNIPPETS = {
+    'baseline': 'import json, resource, sys, time; sys.path.insert(0, %(repo)r); '
+                'import compact_dictionary; start = time.perf_counter(); d = {}',
+    'json': 'import json, resource, sys, time; sys.path.insert(0, %(repo)r); '
+            'import compact_dictionary; start = time.perf_counter(); d = json.load(open(%(json_path)r))',
+    'compact': 'import json, resource, sys, time; sys.path.insert(0, %(repo)r); '
+               'import compact_dictionary; start = time.perf_counter(); '
+               'd = compact_dictionary.CompactDictionary(%(compact_path)r); d.get("x")'
+}
+
+def generate_taxid_dict(n_keys, rng):
+    """
+    :return (dict): {name : {'taxid', 'corrected_name', 'rank'}} with n_keys species and abbreviated species names
+    """
+    taxid_dict = {}
+    while len(taxid_dict) < n_keys:
+        species = 'Genus%d species%d' % (rng.randint(0, n_keys // 20), rng.randint(0, 1000))
+        entry = {'taxid': len(taxid_dict), 'corrected_name': species, 'rank': 'species'}
+        taxid_dict[species] = entry
+        taxid_dict['G. ' + species.split(' ', 1)[1] + ' %d' % len(taxid_dict)] = dict(entry)
+    return taxid_dict
+
+def time_load(method, json_path, compact_path):
+    """
+    :return (tuple): (load seconds, peak RSS MB) of a fresh interpreter loading the dict
+    """
+    # ru_maxrss is carried over from the parent process across exec on Linux, so VmHWM is read there instead
+    code = LOAD_SNIPPETS[method] % {'repo': REPO_DIR, 'json_path': json_path, 'compact_path': compact_path} + \
+        '; print(time.perf_counter() - start, ' \
+        'next((int(line.split()[1]) for line in open("/proc/self/status") if line.startswith("VmHWM:")), 0) ' \
+        'if sys.platform.startswith("linux") else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024)'
+    output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True).split()
+    return float(output[0]), int(output[1]) / 1e3
+
+def time_lookups(entity_dict, names):
+    """
+    :return (float): lookups per second of entity_dict.get over names
+    """
+    start = time.perf_counter()
+    for name in names:
+        entity_dict.get(name)
+    return len(names) / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compact dictionaries against json dicts.")
+    parser.add_argument('--n_keys', type=int, default=500000, help='Number of dict entries.')
+    parser.add_argument('--n_lookups', type=int, default=200000, help='Number of lookups, half of them misses.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    taxid_dict = generate_taxid_dict(args.n_keys, rng)
+    keys = list(taxid_dict)
+    names = [rng.choice(keys) if i % 2 else 'missing %d' % i for i in range(args.n_lookups)]
+
+    tmp_dir = tempfile.mkdtemp()
+    json_path = os.path.join(tmp_dir, 'taxid_dict.json')
+    compact_path = os.path.join(tmp_dir, 'taxid_dict.dict')
+    with open(json_path, 'w') as f:
+        json.dump(taxid_dict, f)
+
+    start = time.perf_counter()
+    write_compact_dictionary(taxid_dict, compact_path)
+    print("%d entries.  Wrote compact dictionary in %.1fs." % (len(taxid_dict), time.perf_counter() - start))
+
+    print("%-10s %10s %10s %12s %14s" % ('format', 'file MB', 'load s', 'peak RSS MB', 'lookups/sec'))
+    baseline_seconds, baseline_mb = time_load('baseline', json_path, compact_path)
+    print("%-10s %10s %10.3f %12.1f %14s" % ('baseline', '-', baseline_seconds, baseline_mb, '-'))
+
+    with CompactDictionary(compact_path) as compact_dict:
+        for method, path, entity_dict in [('json', json_path, taxid_dict), ('compact', compact_path, compact_dict)]:
+            load_seconds, peak_mb = time_load(method, json_path, compact_path)
+            print("%-10s %10.1f %10.3f %12.1f %14.0f" % (method, os.path.getsize(path) / 1e6, load_seconds, peak_mb,
+                                                         time_lookups(entity_dict, names)))
+
+    os.remove(json_path)
+    os.remove(compact_path)
+    os.rmdir(tmp_dir)
@@ -0,0 +1,110 @@
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aho_corasick
+import annotate_texts_with_entity_dictionaries as annotator_script
+
+"""
+Throughput benchmark of dictionary annotation: the Aho-Corasick annotator (pyahocorasick if installed, and the pure-Python
+automaton) against scanning each text with one compiled regex per dictionary key.
+
+Dictionaries and abstracts are generated: keys are 1-3 word names, and abstracts mix random words with dictionary keys.
+The regex scan only uses the first --regex_keys keys, and its time is scaled up to the full dictionary.
+
+Usage:
+    python benchmarks/bench_dictionary_annotator.py --n_keys 200000 --n_docs 2000
+"""
+
+def generate_dictionary(n_keys, rng):
+    """
+    :return (dict): taxid-style dictionary {name : {'taxid': int}} with n_keys 1-3 word names
+    """
+    entity_dict = {}
+    while len(entity_dict) < n_keys:
+        name = ' '.join('%s%d' % (rng.choice(['bac', 'lacto', 'strepto', 'soil', 'gut']), rng.randint(0, n_keys))
+                        for _ in range(rng.randint(1, 3)))
+        entity_dict[name] = {'taxid': len(entity_dict)}
+    return entity_dict
+
+def generate_documents(n_docs, keys, rng, n_words=250, key_every=15):
+    """
+    :return (list): (document id, text) tuples of n_words words, with a dictionary key every key_every words
+    """
+    documents = []
+    for i in range(n_docs):
+        words = []
+        for j in range(n_words):
+            words.append(rng.choice(keys) if j % key_every == 0 else 'word%d' % rng.randint(0, 5000))
+        documents.append(('doc%d' % i, ' '.join(words)))
+    return documents
+
+def time_annotator(annotator, documents):
+    """
+    :return (tuple): (seconds, total number of matches)
+    """
+    start = time.perf_counter()
+    n_matches = sum(len(annotator.find_matches(text)) for _, text in documents)
+    return time.perf_counter() - start, n_matches
+
+def time_regex_scan(keys, documents):
+    """
+    :return (float): seconds to scan every document with one case-insensitive whole-word regex per key
+    """
+    patterns = [re.compile(r'\b%s\b' % re.escape(key), re.IGNORECASE) for key in keys]
+    start = time.perf_counter()
+    for _, text in documents:
+        for pattern in patterns:
+            for _ in pattern.finditer(text):
+                pass
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Aho-Corasick dictionary annotation against per-key regexes.")
+    parser.add_argument('--n_keys', type=int, default=100000, help='Number of dictionary keys.')
+    parser.add_argument('--n_docs', type=int, default=1000, help='Number of abstracts.')
+    parser.add_argument('--regex_keys', type=int, default=1000,
+                        help='Number of keys the regex scan is timed with.  Its time is scaled to --n_keys.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    entity_dict = generate_dictionary(args.n_keys, rng)
+    keys = sorted(entity_dict)
+    documents = generate_documents(args.n_docs, keys, rng)
+    n_mb = sum(len(text) for _, text in documents) / 1e6
+    print("%d keys, %d documents, %.1f MB" % (len(keys), len(documents), n_mb))
+    print("%-20s %10s %10s %14s %10s" % ('method', 'build s', 'scan s', 'documents/sec', 'matches'))
+
+    automata = [('pure-python', aho_corasick.AhoCorasickAutomaton)]
+    try:
+        import ahocorasick
+        automata.insert(0, ('pyahocorasick', ahocorasick.Automaton))
+    except ImportError:
+        print("pyahocorasick is not installed, only the pure-Python automaton is timed.")
+
+    results = {}
+    for name, automaton_class in automata:
+        annotator = annotator_script.EntityDictionaryAnnotator()
+        annotator.automaton = automaton_class()
+        start = time.perf_counter()
+        annotator.add_dictionary(entity_dict, 'Microorganism')
+        annotator.make_automaton()
+        build_seconds = time.perf_counter() - start
+
+        scan_seconds, n_matches = time_annotator(annotator, documents)
+        results[name] = n_matches
+        print("%-20s %10.2f %10.2f %14.0f %10d" % (name, build_seconds, scan_seconds, len(documents) / scan_seconds,
+                                                   n_matches))
+
+    regex_keys = keys[:args.regex_keys]
+    regex_seconds = time_regex_scan(regex_keys, documents) * len(keys) / len(regex_keys)
+    print("%-20s %10s %10.2f %14.0f %10s" % ('regex per key (est.)', '-', regex_seconds,
+                                             len(documents) / regex_seconds, '-'))
+
+    if len(set(results.values())) > 1:
+        print("Automata found different numbers of matches: %s" % results)
@@ -0,0 +1,108 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+"""
+Startup cost benchmark of the pipeline scripts.
+
+Each script module is imported in a fresh interpreter with python -X importtime, and its own cumulative import time and
+heaviest dependencies are reported.  Wall time of '<script> --help' is measured the same way, which includes interpreter
+startup.  Heavy dependencies (spacy, scispacy, pandas, numpy, networkx, ete3) are expected to be imported on first use,
+not at module import, so they should not show up here.
+
+Usage:
+    python benchmarks/bench_import_time.py --repeat 5
+    python benchmarks/bench_import_time.py --max_import_ms 200
+"""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT_MODULES = ['convert_bionlp_ner_train_to_bert_ner_train', 'extract_obo_category_nodes',
+                  'generate_bacteria_taxid_dict']
+
+def parse_importtime(stderr):
+    """
+    Parse -X importtime output.
+
+    Ex:
+        import time: self [us] | cumulative | imported package
+        import time:       284 |        284 |   _io
+
+    :param stderr (str): stderr of a python -X importtime run
+    :return (list): (module name, nesting depth, self microseconds, cumulative microseconds) tuples
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        # Names are indented by 2 spaces per nesting level after the separator's own space
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(fields[0]), int(fields[1])))
+    return imports
+
+def time_module_import(module_name):
+    """
+    :param module_name (str): module importable from the repo root
+    :return (tuple): (cumulative microseconds of the module import, {imported module : cumulative microseconds})
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module_name], cwd=REPO_DIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        raise RuntimeError("Importing %s failed:\n%s" % (module_name, result.stderr))
+
+    imports = parse_importtime(result.stderr)
+    module_us = next(cumulative for name, depth, _, cumulative in imports if name == module_name and depth == 0)
+
+    # -X importtime lists a module after its own imports, so the depth-1 entries between the previous top-level entry and
+    # the module are its direct dependencies
+    dependencies = {}
+    for name, depth, _, cumulative in reversed(imports):
+        if depth == 0 and name != module_name:
+            break
+        if depth == 1:
+            dependencies[name] = cumulative
+
+    return module_us, dependencies
+
+def time_help(module_name):
+    """
+    :param module_name (str): script module in the repo root
+    :return (float): wall seconds of 'python <script>.py --help'
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, '%s.py' % module_name), '--help'],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark import time and --help startup of the pipeline scripts.")
+    parser.add_argument('--modules', nargs='+', default=SCRIPT_MODULES, help='Modules to import.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per module.  The fastest run is reported.')
+    parser.add_argument('--top', type=int, default=5, help='Number of heaviest direct dependencies to list per module.')
+    parser.add_argument('--max_import_ms', type=float,
+                        help='Exit with status 1 if any module takes longer than this to import.')
+    args = parser.parse_args()
+
+    print("%-45s %12s %12s" % ('module', 'import ms', '--help ms'))
+    slow_modules = []
+    for module_name in args.modules:
+        runs = [time_module_import(module_name) for _ in range(args.repeat)]
+        module_us, dependencies = min(runs, key=lambda run: run[0])
+        help_seconds = min(time_help(module_name) for _ in range(args.repeat))
+
+        print("%-45s %12.1f %12.1f" % (module_name, module_us / 1e3, help_seconds * 1e3))
+        for name, cumulative in sorted(dependencies.items(), key=lambda i: -i[1])[:args.top]:
+            print("    %-41s %12.1f" % (name, cumulative / 1e3))
+
+        if args.max_import_ms is not None and module_us / 1e3 > args.max_import_ms:
+            slow_modules.append(module_name)
+
+    if slow_modules:
+        print("Import time above %.1f ms: %s" % (args.max_import_ms, ', '.join(slow_modules)))
+        sys.exit(1)
@@ -0,0 +1,98 @@
+import argparse
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotate_texts_with_entity_dictionaries import iter_dictionary_file_entries, normalize_key, parse_dictionary_spec
+from bionlp_corpus_index import load_corpus_manifest
+from normalize_entity_mentions import load_normalizers, read_document_mentions
+
+"""
+Benchmark of mention normalization on a BioNLP corpus with reference normalizations, ex: the BB-norm dev set.
+
+For each dictionary label, the normalizer is compared with exact lookup of the dict key (the only normalization the
+dicts supported before), on accuracy (a mention counts as correct if one of its top matches is a reference referent),
+coverage (mentions with at least one match), and batch lookup time per mention.
+
+Usage:
+    python benchmarks/bench_normalization.py BioNLP-OST-2019_BB-norm_dev \
+        --dictionary Microorganism=microorganism_taxid_dict.json --dictionary Habitat=microbial_habitat.dict
+"""
+
+def get_exact_referents(dictionary_path):
+    """
+    :return (dict): {normalize_key(name) : set of referent IDs}, the exact dict lookup baseline
+    """
+    exact_referents = collections.defaultdict(set)
+    for name, _, referents in iter_dictionary_file_entries(dictionary_path):
+        exact_referents[normalize_key(name)].update(referents)
+    return exact_referents
+
+def time_lookup_batch(normalizer, mentions, repeat):
+    """
+    :return (tuple): (list of matches per mention, best seconds per mention over repeat batch lookups)
+    """
+    best_seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        batch_matches = normalizer.lookup_batch(mentions)
+        seconds = time.perf_counter() - start
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+    return batch_matches, best_seconds / max(len(mentions), 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark mention normalization against exact dict lookup.")
+    parser.add_argument('corpus_dir', help='BioNLP corpus directory with .a1/.a2 files, ex: BB-norm dev.')
+    parser.add_argument('--dictionary', type=parse_dictionary_spec, action='append', required=True,
+                        help='LABEL=PATH of an entity dictionary json or compact dictionary.  Repeat for each dictionary.')
+    parser.add_argument('--max_edits', type=int, default=2, help='Largest edit distance of fuzzy matches.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed batch lookups, the best one is reported.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    normalizers = load_normalizers(args.dictionary, max_edits=args.max_edits)
+    print("Indexed %s in %.1fs." % (', '.join('%d %s names' % (len(normalizer), label)
+                                              for label, normalizer in normalizers.items()), time.perf_counter() - start))
+
+    exact_referents = {}
+    for label, dictionary_path in args.dictionary:
+        label_referents = exact_referents.setdefault(label, collections.defaultdict(set))
+        for key, referents in get_exact_referents(dictionary_path).items():
+            label_referents[key].update(referents)
+
+    documents, _ = load_corpus_manifest(args.corpus_dir)
+    label_mentions = collections.defaultdict(list)
+    for document in documents:
+        for label, text, gold_referents in read_document_mentions(document, labels=normalizers):
+            # Mentions without reference normalizations cannot be scored
+            if gold_referents:
+                label_mentions[label].append((text, gold_referents))
+
+    print("%-16s %9s %12s %12s %12s %12s %10s  %s" % ('label', 'mentions', 'exact acc', 'exact cov', 'norm acc',
+                                                      'norm cov', 'us/mention', 'match types'))
+    for label, normalizer in normalizers.items():
+        mentions = label_mentions.get(label, [])
+        if not mentions:
+            print("%-16s %9d  (no mentions with reference normalizations)" % (label, 0))
+            continue
+
+        batch_matches, seconds_per_mention = time_lookup_batch(normalizer, [text for text, _ in mentions], args.repeat)
+
+        n_exact_correct = n_exact_covered = n_correct = n_covered = 0
+        match_types = collections.Counter()
+        for (text, gold_referents), matches in zip(mentions, batch_matches):
+            referents = exact_referents[label].get(normalize_key(text), set())
+            n_exact_covered += bool(referents)
+            n_exact_correct += bool(referents & gold_referents)
+
+            n_covered += bool(matches)
+            n_correct += any(match.referent in gold_referents for match in matches)
+            match_types[matches[0].match_type if matches else 'none'] += 1
+
+        n_mentions = len(mentions)
+        print("%-16s %9d %12.3f %12.3f %12.3f %12.3f %10.1f  %s" % (
+            label, n_mentions, n_exact_correct / n_mentions, n_exact_covered / n_mentions, n_correct / n_mentions,
+            n_covered / n_mentions, seconds_per_mention * 1e6,
+            ', '.join('%s %d' % i for i in match_types.most_common())))
@@ -0,0 +1,133 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import time
+
+import networkx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import extract_obo_category_nodes
+
+"""
+Throughput benchmark of the streaming obo parser (extract_obo_category_nodes.parse_obo_file_to_graph) against the
+previous implementation, which read the whole file into memory and parsed every stanza before adding any edges.
+
+Each run is made in a fresh child process so that peak RSS of one parser does not hide the other's.
+
+Usage:
+    python benchmarks/bench_obo_parser.py OntoBiotope_BioNLP-OST-2019.obo --repeat 3
+"""
+
+def legacy_parse_obo_entry(entry_lines):
+    """
+    Previous parse_obo_entry: compiles the line pattern for every stanza and matches through re.match.
+    """
+    entry_type = next(entry_lines)
+    entry_lines = list(entry_lines)
+    entry = dict()
+
+    obo_entry_line_pattern = re.compile(
+        r'^(?P<key>.+?): *(?P<value>.+?) ?(?P<trailing_modifier>(?<!\\)\{.*?(?<!\\)\})? ?(?P<comment>(?<!\\)!.*?)?$')
+
+    if entry_type.startswith('[Term]'):
+        for line in entry_lines:
+            if line.startswith('!'):
+                continue
+            regex_match = re.match(obo_entry_line_pattern, line)
+            key = regex_match.group('key')
+            value = regex_match.group('value')
+            entry.setdefault(key, []).append(value)
+
+    return entry
+
+def legacy_parse_obo_file_to_graph(obo_path):
+    """
+    Previous parse_obo_file_to_graph: reads the file with f.read().splitlines() and builds every term before any edge.
+    """
+    graph = networkx.MultiDiGraph()
+    edge_tuples = []
+
+    with open(obo_path) as f:
+        obo_lines = f.read().splitlines()
+
+    entries = itertools.groupby(obo_lines, lambda line: line.strip() == '')
+    parsed_terms = []
+    for is_blank, entry_lines in entries:
+        if is_blank:
+            continue
+        parsed_term = legacy_parse_obo_entry(entry_lines)
+        parsed_terms.append(parsed_term)
+
+    for term in parsed_terms:
+        if term:
+            term_id = term.pop('id')[0]
+            graph.add_node(term_id, attr_dict=term)
+            for target_term in term.pop('is_a', []):
+                edge_tuple = term_id, 'is_a', target_term
+                edge_tuples.append(edge_tuple)
+
+    for origin_term, typedef, dest_term in edge_tuples:
+        graph.add_edge(origin_term, dest_term, key=typedef)
+
+    return graph
+
+PARSERS = {
+    'legacy': legacy_parse_obo_file_to_graph,
+    'streaming': extract_obo_category_nodes.parse_obo_file_to_graph
+}
+
+def count_stanzas(obo_path):
+    """
+    :param obo_path (string): path to .obo file
+    :return n_stanzas (int): number of [Term]/[Typedef]/[Instance] stanzas in the file
+    """
+    with open(obo_path) as f:
+        return sum(1 for line in f if line.startswith('['))
+
+def run_parser(parser_name, obo_path, queue):
+    """
+    Parse an obo file in the current (child) process and report elapsed time and peak RSS.
+
+    :param parser_name (string): key of PARSERS
+    :param obo_path (string): path to .obo file
+    :param queue (multiprocessing.Queue): receives (elapsed seconds, peak RSS bytes, peak RSS before parsing in bytes, n nodes)
+    """
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit
+    start = time.perf_counter()
+    graph = PARSERS[parser_name](obo_path)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit
+
+    queue.put((elapsed, peak_rss, start_rss, graph.number_of_nodes()))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark streaming vs. legacy obo parsing (stanzas/sec and peak RSS).")
+    parser.add_argument('obo_file_path', help='Path to .obo format file')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per parser.  The fastest run is reported.')
+    parser.add_argument('--parsers', nargs='+', default=sorted(PARSERS), choices=sorted(PARSERS),
+                        help='Parsers to benchmark.')
+    args = parser.parse_args()
+
+    n_stanzas = count_stanzas(args.obo_file_path)
+    print("%s: %d stanzas, %.1f MB" % (args.obo_file_path, n_stanzas, os.path.getsize(args.obo_file_path) / 1e6))
+    print("%-10s %10s %14s %14s %14s %8s" % ('parser', 'seconds', 'stanzas/sec', 'peak RSS MB', 'RSS delta MB', 'nodes'))
+
+    for parser_name in args.parsers:
+        results = []
+        for _ in range(args.repeat):
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_parser, args=(parser_name, args.obo_file_path, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+
+        elapsed, peak_rss, start_rss, n_nodes = min(results)
+        print("%-10s %10.3f %14.0f %14.1f %14.1f %8d" % (
+            parser_name, elapsed, n_stanzas / elapsed, peak_rss / 1e6, (peak_rss - start_rss) / 1e6, n_nodes))
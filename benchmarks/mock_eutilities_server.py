@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sys
+import time
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_inputs
+
+"""
+Local stand-in for the E-utilities esearch and efetch endpoints used by pubmed_batch_download/download_pubmed_batches.py,
+so the downloader can be run and timed offline.
+
+Every query matches --n_articles synthetic articles, PMIDs 1 to n_articles, served as PubMed XML in retstart/retmax
+slices of the history server result.  Faults can be injected at random, with a seeded generator:
+    --error_rate: fraction of requests answered with HTTP 503 (or 429 with Retry-After, one in two)
+    --truncate_rate: fraction of efetch responses cut off before </PubmedArticleSet>
+    --max_requests_per_second: requests beyond this rate in a one second window get HTTP 429, as E-utilities does
+    --latency_seconds: delay before each response
+
+On shutdown, it prints the number of requests, faults, the most requests in one second and the most at a time.
+
+Usage:
+    python benchmarks/mock_eutilities_server.py --port 8765 --n_articles 20000 --error_rate 0.1 --truncate_rate 0.05
+    python pubmed_batch_download/download_pubmed_batches.py config.R --base_url http://localhost:8765/
+"""
+
+WEBENV = 'MCID_MOCK'
+
+class MockEutilities(object):
+    """
+    aiohttp handlers of the mock esearch and efetch endpoints, and their request statistics.
+    """
+
+    def __init__(self, n_articles, error_rate=0.0, truncate_rate=0.0, max_requests_per_second=None, latency_seconds=0.0,
+                 seed=0):
+        self.n_articles = n_articles
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.latency_seconds = latency_seconds
+        self.rng = random.Random(seed)
+        self.request_times = collections.deque()
+        self.stats = collections.Counter()
+        self.active_requests = 0
+
+    def get_article_xml(self, pmid):
+        rng = random.Random(pmid)
+        title = ' '.join(synthetic_inputs.make_word(rng) for _ in range(8)).capitalize()
+        abstract = ' '.join(synthetic_inputs.make_word(rng) for _ in range(120))
+        return ('<PubmedArticle><MedlineCitation Status="MEDLINE" Owner="NLM"><PMID Version="1">%d</PMID>'
+                '<Article><ArticleTitle>%s.</ArticleTitle><Abstract><AbstractText>%s.</AbstractText></Abstract>'
+                '</Article></MedlineCitation></PubmedArticle>\n' % (pmid, escape(title), escape(abstract)))
+
+    async def get_fault_response(self):
+        """
+        :return (aiohttp.web.Response): rate limit or injected error response, or None to answer the request
+        """
+        from aiohttp import web
+
+        self.stats['requests'] += 1
+        now = time.monotonic()
+        self.request_times.append(now)
+        while self.request_times[0] < now - 1:
+            self.request_times.popleft()
+        self.stats['max_requests_per_second'] = max(self.stats['max_requests_per_second'], len(self.request_times))
+
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+
+        if self.max_requests_per_second and len(self.request_times) > self.max_requests_per_second:
+            self.stats['rate_limited'] += 1
+            return web.json_response({'error': 'API rate limit exceeded'}, status=429, headers={'Retry-After': '1'})
+        if self.rng.random() < self.error_rate:
+            self.stats['errors'] += 1
+            if self.rng.random() < 0.5:
+                return web.Response(status=429, headers={'Retry-After': '1'})
+            return web.Response(status=503, text='Service unavailable')
+        return None
+
+    async def esearch(self, request):
+        from aiohttp import web
+
+        self.active_requests += 1
+        self.stats['max_active_requests'] = max(self.stats['max_active_requests'], self.active_requests)
+        try:
+            fault_response = await self.get_fault_response()
+            if fault_response is not None:
+                return fault_response
+            params = dict(request.query)
+            params.update(await request.post())
+            if not params.get('term'):
+                return web.json_response({'esearchresult': {'ERROR': 'Empty term and query_key - nothing todo'}})
+            return web.json_response({'esearchresult': {'count': str(self.n_articles), 'retmax': '0', 'retstart': '0',
+                                                        'querykey': '1', 'webenv': WEBENV, 'idlist': []}})
+        finally:
+            self.active_requests -= 1
+
+    async def efetch(self, request):
+        from aiohttp import web
+
+        self.active_requests += 1
+        self.stats['max_active_requests'] = max(self.stats['max_active_requests'], self.active_requests)
+        try:
+            fault_response = await self.get_fault_response()
+            if fault_response is not None:
+                return fault_response
+            if request.query.get('WebEnv') != WEBENV:
+                return web.Response(text='<?xml version="1.0" ?>\n<eFetchResult>\n\t<ERROR>Unable to obtain query '
+                                         '#1</ERROR>\n</eFetchResult>\n', content_type='text/xml')
+
+            retstart = int(request.query.get('retstart', 0))
+            retmax = int(request.query.get('retmax', 20))
+            body = '<?xml version="1.0" ?>\n<PubmedArticleSet>\n%s</PubmedArticleSet>\n' % ''.join(
+                self.get_article_xml(pmid) for pmid in range(retstart + 1, min(retstart + retmax, self.n_articles) + 1))
+            if self.rng.random() < self.truncate_rate:
+                self.stats['truncated'] += 1
+                body = body[:len(body) // 2]
+            return web.Response(text=body, content_type='text/xml')
+        finally:
+            self.active_requests -= 1
+
+def make_app(mock_eutilities):
+    """
+    :param mock_eutilities (MockEutilities): handlers
+    :return (aiohttp.web.Application): app serving <base url>/esearch.fcgi and <base url>/efetch.fcgi
+    """
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_route('*', '/esearch.fcgi', mock_eutilities.esearch)
+    app.router.add_route('*', '/efetch.fcgi', mock_eutilities.efetch)
+    return app
+
+def main():
+    from aiohttp import web
+
+    parser = argparse.ArgumentParser(description="Serve mock E-utilities esearch and efetch endpoints.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--n_articles', type=int, default=10000, help='Number of articles every query matches.')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of requests answered with 503 or 429.')
+    parser.add_argument('--truncate_rate', type=float, default=0.0, help='Fraction of efetch responses cut off.')
+    parser.add_argument('--max_requests_per_second', type=int, help='Requests beyond this rate get HTTP 429.')
+    parser.add_argument('--latency_seconds', type=float, default=0.0, help='Delay before each response.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mock_eutilities = MockEutilities(args.n_articles, error_rate=args.error_rate, truncate_rate=args.truncate_rate,
+                                     max_requests_per_second=args.max_requests_per_second,
+                                     latency_seconds=args.latency_seconds, seed=args.seed)
+    try:
+        web.run_app(make_app(mock_eutilities), port=args.port)
+    finally:
+        print("Mock E-utilities: %s" % ', '.join('%s %d' % i for i in sorted(mock_eutilities.stats.items())))
+
+if __name__ == "__main__":
+    main()
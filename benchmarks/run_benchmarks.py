@@ -0,0 +1,393 @@
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_inputs
+
+"""
+Benchmark harness of the pipeline scripts on synthetic inputs, with a json history to catch regressions between commits.
+
+Inputs are generated by synthetic_inputs.py at the chosen scale (an obo ontology, an ncbi-lineages csv and a BioNLP
+corpus directory) and timed stage by stage:
+    -obo: parse_obo_file_to_graph, get_nodes_by_category, convert_node_list_to_dict
+    -taxid: load_bacteria_lineages, generate_taxid_dict (ranks come from the generator, not the NCBI database)
+    -bert: convert_bionlp_abstract_to_bert_train_format, with sentence breaks from StubSentenceModel instead of scispacy
+
+Each group of cases runs in a fresh interpreter, so peak memory of one group does not carry over to the next.  On Linux
+the peak RSS of each case is measured on its own (the high-water mark is reset before it), elsewhere it is the peak of
+the process so far.  Nothing is downloaded, so the harness runs offline.
+
+Every run is appended to --history_file with the git commit it ran on.  Cases are compared with the latest earlier run
+of another commit at the same scale (or of --baseline), and flagged as regressions if they got slower or used more memory
+beyond the thresholds.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scale small
+    python benchmarks/run_benchmarks.py --scale medium --data_dir /tmp/bench_inputs --repeat 3 --fail_on_regression
+"""
+
+SCALES = {
+    'small': {'n_terms': 20000, 'obo_depth': 12, 'n_lineages': 200000, 'n_documents': 200, 'n_words': 250},
+    'medium': {'n_terms': 200000, 'obo_depth': 12, 'n_lineages': 2000000, 'n_documents': 2000, 'n_words': 250},
+    'large': {'n_terms': 1000000, 'obo_depth': 16, 'n_lineages': 10000000, 'n_documents': 10000, 'n_words': 250}
+}
+
+CASE_GROUPS = collections.OrderedDict([
+    ('obo', ['parse_obo_file_to_graph', 'get_nodes_by_category', 'convert_node_list_to_dict']),
+    ('taxid', ['load_bacteria_lineages', 'generate_taxid_dict']),
+    ('bert', ['convert_bionlp_abstract_to_bert_train_format'])
+])
+
+STOPWORDS_PATH = os.path.join(REPO_DIR, 'resources', 'bionlp_bb_stopwords.txt')
+
+StubDoc = collections.namedtuple('StubDoc', ['sents'])
+
+class StubSentenceModel(object):
+    """
+    Stand-in for the scispacy sentence model: a sentence ends at every '. '.  Supports nlp(text) and nlp.pipe(texts),
+    which is all convert_bionlp_ner_train_to_bert_ner_train.py uses.
+    """
+
+    def __call__(self, text):
+        return StubDoc(re.split(r'(?<=\.) ', text))
+
+    def pipe(self, texts, batch_size=64, n_process=1):
+        for text in texts:
+            yield self(text)
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of this process to its current RSS, on Linux 4.0+.
+
+    :return (bool): True if the peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def get_peak_rss_mb():
+    """
+    :return (float): peak RSS of this process in MB, since the last reset_peak_rss on Linux
+    """
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1e3
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / 1e6
+
+def time_case(function, *args):
+    """
+    :return (tuple): (return value of function(*args), {'seconds', 'peak_rss_mb', 'peak_rss_scope'})
+    """
+    peak_rss_scope = 'case' if reset_peak_rss() else 'process'
+    start = time.perf_counter()
+    value = function(*args)
+    seconds = time.perf_counter() - start
+    return value, {'seconds': seconds, 'peak_rss_mb': get_peak_rss_mb(), 'peak_rss_scope': peak_rss_scope}
+
+def run_obo_cases(inputs):
+    import extract_obo_category_nodes as obo
+
+    graph, parse_stats = time_case(obo.parse_obo_file_to_graph, inputs['obo_path'])
+    node_list, category_stats = time_case(obo.get_nodes_by_category, graph, 'microbial habitat')
+    node_dict, dict_stats = time_case(obo.convert_node_list_to_dict, graph, node_list, 'microbial_habitat')
+
+    n_terms = graph.number_of_nodes()
+    return {
+        'parse_obo_file_to_graph': dict(parse_stats, n_items=n_terms, unit='terms'),
+        'get_nodes_by_category': dict(category_stats, n_items=n_terms, unit='terms'),
+        'convert_node_list_to_dict': dict(dict_stats, n_items=len(node_list), unit='nodes')
+    }
+
+def run_taxid_cases(inputs):
+    import generate_bacteria_taxid_dict as taxid_script
+
+    valid_taxids = set(taxid for taxid in range(2, inputs['n_lineages'] + 2)
+                       if synthetic_inputs.is_synthetic_valid_taxid(taxid))
+    with open(STOPWORDS_PATH) as f:
+        stopwords = [line.rstrip('\n') for line in f]
+
+    (lineage_df, lineage_counts), load_stats = time_case(taxid_script.load_bacteria_lineages, inputs['lineage_path'],
+                                                         valid_taxids)
+    taxid_ranks = {taxid: synthetic_inputs.get_synthetic_rank(taxid) for taxid in lineage_df['tax_id'].tolist()}
+    taxid_dict, dict_stats = time_case(taxid_script.generate_taxid_dict, lineage_df, taxid_ranks, stopwords)
+
+    return {
+        'load_bacteria_lineages': dict(load_stats, n_items=lineage_counts['total'], unit='rows'),
+        'generate_taxid_dict': dict(dict_stats, n_items=len(lineage_df), unit='lineages')
+    }
+
+def run_bert_cases(inputs):
+    import convert_bionlp_ner_train_to_bert_ner_train as converter
+    from bionlp_corpus_index import load_corpus_manifest
+
+    documents, _ = load_corpus_manifest(inputs['corpus_dir'])
+    articles = list(converter.iter_articles(
+        [(i.text_file, i.ann_file) for i in documents if i.kind == 'abstract'],
+        [(i.text_file, i.ann_file) for i in documents if i.kind == 'passage']))
+    sentence_breaks = converter.iter_sentence_break_indices([text for _, text, _ in articles], StubSentenceModel())
+
+    # Same inputs generate_article_train_lines passes on
+    passages = [(text.replace(u'\xa0', ' '), converter.extract_ent_lines(bionlp_lines), breaks)
+                for (_, text, bionlp_lines), breaks in zip(articles, sentence_breaks)]
+
+    def convert_passages():
+        return [converter.convert_bionlp_abstract_to_bert_train_format(*passage) for passage in passages]
+
+    _, convert_stats = time_case(convert_passages)
+    n_words = sum(len(text.split()) for text, _, _ in passages)
+    return {
+        'convert_bionlp_abstract_to_bert_train_format': dict(convert_stats, n_items=n_words, unit='words')
+    }
+
+CASE_GROUP_RUNNERS = {
+    'obo': run_obo_cases,
+    'taxid': run_taxid_cases,
+    'bert': run_bert_cases
+}
+
+def prepare_inputs(data_dir, scale, groups):
+    """
+    Generate the synthetic inputs of the case groups, unless data_dir already has them for this scale.
+
+    :param data_dir (string): directory to keep generated inputs in
+    :param scale (dict): generator parameters, see SCALES
+    :param groups (list): case groups to generate inputs for
+    :return inputs (dict): paths and sizes passed to the case group runners
+    """
+    seed = scale['seed']
+    inputs = {
+        'obo_path': os.path.join(data_dir, 'synthetic_%d_terms_depth_%d_seed_%d.obo' % (
+            scale['n_terms'], scale['obo_depth'], seed)),
+        'lineage_path': os.path.join(data_dir, 'synthetic_%d_lineages_seed_%d.csv' % (scale['n_lineages'], seed)),
+        'corpus_dir': os.path.join(data_dir, 'synthetic_bionlp_%d_documents_%d_words_seed_%d' % (
+            scale['n_documents'], scale['n_words'], seed)),
+        'n_lineages': scale['n_lineages']
+    }
+
+    # Inputs are written under a temporary name and renamed, so an interrupted run does not leave a partial input
+    generators = [
+        ('obo', 'obo_path', lambda path: synthetic_inputs.write_obo_file(path, scale['n_terms'], depth=scale['obo_depth'],
+                                                                         seed=seed)),
+        ('taxid', 'lineage_path', lambda path: synthetic_inputs.write_lineage_csv(path, scale['n_lineages'], seed=seed)),
+        ('bert', 'corpus_dir', lambda path: synthetic_inputs.write_bionlp_corpus(path, scale['n_documents'],
+                                                                                 n_words=scale['n_words'], seed=seed))
+    ]
+    for group, input_name, generate in generators:
+        path = inputs[input_name]
+        if group not in groups or os.path.exists(path):
+            continue
+
+        print("Generating %s..." % path)
+        start = time.perf_counter()
+        tmp_path = '%s.tmp%d' % (path, os.getpid())
+        generate(tmp_path)
+        os.rename(tmp_path, path)
+        print("Generated in %.1fs." % (time.perf_counter() - start))
+
+    return inputs
+
+def run_case_group(group, inputs):
+    """
+    Run a case group in a fresh interpreter.
+
+    :return (dict): {case : {'seconds', 'peak_rss_mb', 'peak_rss_scope', 'n_items', 'unit'}}
+    """
+    result_fd, result_path = tempfile.mkstemp(suffix='.json')
+    os.close(result_fd)
+    try:
+        subprocess.check_call([sys.executable, os.path.abspath(__file__), '--run_group', group,
+                               '--inputs', json.dumps(inputs), '--result_file', result_path])
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        os.remove(result_path)
+
+def get_git_commit():
+    """
+    :return (string): short commit hash of the repository, with a '-dirty' suffix if tracked files have uncommitted
+                      changes, or 'unknown' outside a git checkout
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                         stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=REPO_DIR, stderr=subprocess.DEVNULL) != 0
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + '-dirty' if dirty else commit
+
+def find_baseline(history, run, baseline_commit=None):
+    """
+    :param history (list): earlier runs, oldest first
+    :param run (dict): current run
+    :param baseline_commit (string): commit (prefix) to compare with, or None for the latest run of another commit
+    :return (dict): latest earlier run at the same scale to compare with, or None
+    """
+    for earlier_run in reversed(history):
+        if earlier_run['scale'] != run['scale']:
+            continue
+        if baseline_commit is not None:
+            if earlier_run['commit'].startswith(baseline_commit):
+                return earlier_run
+        elif earlier_run['commit'] != run['commit']:
+            return earlier_run
+    return None
+
+def compare_runs(baseline, run, time_threshold, memory_threshold, min_seconds=0.05, min_memory_mb=5):
+    """
+    :param time_threshold (float): fractional slowdown flagged as a regression, ex: 0.1 for 10%
+    :param memory_threshold (float): fractional peak RSS increase flagged as a regression
+    :param min_seconds (float): smallest slowdown in seconds flagged, so timer noise of short cases is not
+    :param min_memory_mb (float): smallest peak RSS increase in MB flagged
+    :return comparisons (dict): {case : {'seconds_change', 'peak_rss_change', 'regressions'}} of cases in both runs
+    """
+    comparisons = {}
+    for case, stats in run['cases'].items():
+        baseline_stats = baseline['cases'].get(case)
+        if not baseline_stats:
+            continue
+
+        regressions = []
+        seconds_change = stats['seconds'] / baseline_stats['seconds'] - 1 if baseline_stats['seconds'] else 0
+        if seconds_change > time_threshold and stats['seconds'] - baseline_stats['seconds'] >= min_seconds:
+            regressions.append('time')
+
+        peak_rss_change = stats['peak_rss_mb'] / baseline_stats['peak_rss_mb'] - 1 if baseline_stats['peak_rss_mb'] \
+            else 0
+        if peak_rss_change > memory_threshold and stats['peak_rss_mb'] - baseline_stats['peak_rss_mb'] >= min_memory_mb:
+            regressions.append('memory')
+
+        comparisons[case] = {'seconds_change': seconds_change, 'peak_rss_change': peak_rss_change,
+                             'regressions': regressions}
+    return comparisons
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline scripts on synthetic inputs and flag regressions.")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='Input sizes, see SCALES.')
+    parser.add_argument('--n_terms', type=int, help='Number of obo terms, overriding --scale.')
+    parser.add_argument('--obo_depth', type=int, help='Number of is_a levels of the obo file, overriding --scale.')
+    parser.add_argument('--n_lineages', type=int, help='Number of lineage csv rows, overriding --scale.')
+    parser.add_argument('--n_documents', type=int, help='Number of BioNLP documents, overriding --scale.')
+    parser.add_argument('--n_words', type=int, help='Words per BioNLP document, overriding --scale.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--groups', nargs='+', choices=list(CASE_GROUPS), default=list(CASE_GROUPS),
+                        help='Case groups to run.')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of runs of each case group.  The fastest time and lowest peak RSS are kept.')
+    parser.add_argument('--data_dir',
+                        help='Directory to keep generated inputs in and reuse them from.  Defaults to a temporary directory.')
+    parser.add_argument('--history_file', default='benchmark_history.json',
+                        help='Json file of earlier runs.  This run is appended to it.')
+    parser.add_argument('--baseline', help='Commit (prefix) to compare with, instead of the latest run of another commit.')
+    parser.add_argument('--time_threshold', type=float, default=0.1,
+                        help='Fractional slowdown flagged as a regression.')
+    parser.add_argument('--memory_threshold', type=float, default=0.1,
+                        help='Fractional peak RSS increase flagged as a regression.')
+    parser.add_argument('--fail_on_regression', action='store_true', help='Exit with status 1 if a regression is flagged.')
+    parser.add_argument('--run_group', help=argparse.SUPPRESS)
+    parser.add_argument('--inputs', help=argparse.SUPPRESS)
+    parser.add_argument('--result_file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process of run_case_group
+    if args.run_group:
+        results = CASE_GROUP_RUNNERS[args.run_group](json.loads(args.inputs))
+        with open(args.result_file, 'w') as f:
+            json.dump(results, f)
+        return
+
+    scale = dict(SCALES[args.scale], seed=args.seed)
+    for name in ['n_terms', 'obo_depth', 'n_lineages', 'n_documents', 'n_words']:
+        if getattr(args, name) is not None:
+            scale[name] = getattr(args, name)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='bionlp_bench_')
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    try:
+        inputs = prepare_inputs(data_dir, scale, args.groups)
+
+        run = {
+            'commit': get_git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': scale,
+            'repeat': args.repeat,
+            'cases': {}
+        }
+        for group in args.groups:
+            print("Running %s cases..." % group)
+            for _ in range(args.repeat):
+                for case, stats in run_case_group(group, inputs).items():
+                    best = run['cases'].setdefault(case, stats)
+                    best['seconds'] = min(best['seconds'], stats['seconds'])
+                    best['peak_rss_mb'] = min(best['peak_rss_mb'], stats['peak_rss_mb'])
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir)
+
+    history = []
+    if os.path.exists(args.history_file):
+        with open(args.history_file) as f:
+            history = json.load(f)
+
+    baseline = find_baseline(history, run, args.baseline)
+    comparisons = {}
+    if baseline is not None:
+        comparisons = compare_runs(baseline, run, args.time_threshold, args.memory_threshold)
+        print("Comparing commit %s with %s (%s)." % (run['commit'], baseline['commit'], baseline['timestamp']))
+    else:
+        print("No earlier run at this scale to compare commit %s with." % run['commit'])
+
+    print("%-46s %10s %21s %12s %10s %10s" % ('case', 'seconds', 'items/sec', 'peak RSS MB', 'time', 'memory'))
+    regressions = []
+    for case in [case for group in args.groups for case in CASE_GROUPS[group]]:
+        stats = run['cases'][case]
+        stats['items_per_second'] = stats['n_items'] / stats['seconds'] if stats['seconds'] else 0
+
+        comparison = comparisons.get(case)
+        if comparison:
+            changes = ('%+9.1f%%' % (comparison['seconds_change'] * 100), '%+9.1f%%' % (comparison['peak_rss_change'] * 100))
+            flags = ', '.join('%s REGRESSION' % i for i in comparison['regressions'])
+            regressions += ['%s %s' % (case, i) for i in comparison['regressions']]
+        else:
+            changes, flags = ('-', '-'), ''
+
+        print("%-46s %10.3f %12.0f %-8s %12.1f %10s %10s  %s" % (
+            case, stats['seconds'], stats['items_per_second'], stats['unit'], stats['peak_rss_mb'], changes[0],
+            changes[1], flags))
+
+    history.append(run)
+    with open(args.history_file, 'w') as f:
+        json.dump(history, f, indent=1)
+    print("Appended run to %s." % args.history_file)
+
+    if regressions:
+        print("Regressions: %s" % ', '.join(regressions))
+        if args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
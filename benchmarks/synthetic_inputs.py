@@ -0,0 +1,264 @@
+import argparse
+import os
+import random
+
+"""
+Generators of synthetic pipeline inputs at configurable scale, for benchmarks that must run offline:
+    -OBO ontologies with n terms in an is_a DAG of a given depth, with synonyms and part_of relationships
+    -ncbi-lineages style csv files with millions of rows
+    -BioNLP corpus directories of BB-norm+ner-*.a1/.a2 (title/abstract) and BB-norm+ner-F-*.txt/.a2 (passage) documents
+
+Every generator is deterministic for a given seed.  Ranks and the BioNLP taxid list of generated lineages are functions
+of the taxid (get_synthetic_rank, is_synthetic_valid_taxid), so they do not have to be stored next to the csv.
+
+Usage:
+    python benchmarks/synthetic_inputs.py synthetic/ --n_terms 200000 --n_lineages 2000000 --n_documents 2000
+"""
+
+SYLLABLES = ['ba', 'cil', 'lus', 'strep', 'to', 'coc', 'cus', 'my', 'co', 'bac', 'te', 'ri', 'um', 'sta', 'phy', 'lo',
+             'pseu', 'do', 'mo', 'nas', 'ae', 'ru', 'gi', 'no', 'sa', 'ar', 'chae', 'lac', 'ti', 'vi', 'brio', 'sal',
+             'nel', 'la', 'ther', 'mus', 'fla', 'vo', 'soil', 'gut', 'root', 'sed', 'i', 'ment']
+
+# Category nodes of generated ontologies, children of the root term
+OBO_CATEGORIES = ['microbial habitat', 'phenotype', 'geographical location']
+
+LINEAGE_HEADER = ['tax_id', 'superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species', 'subspecies',
+                  'varietas']
+
+BIONLP_LABELS = ['Microorganism', 'Habitat', 'Phenotype']
+
+def make_word(rng, min_syllables=2, max_syllables=4):
+    """
+    :return (str): lower case word of random syllables
+    """
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(min_syllables, max_syllables)))
+
+def format_term_id(term_idx):
+    return 'OBT:%06d' % term_idx
+
+def write_obo_file(obo_path, n_terms, depth=12, multi_parent_rate=0.2, synonym_rate=0.5, seed=0):
+    """
+    Write an OntoBiotope-like obo file.
+
+    Terms below the category nodes are spread over depth levels.  Each term is_a a term of the level above it, and some
+    also a term of any higher level (possibly of another category), so the is_a graph is a DAG rather than a tree.
+
+    :param obo_path (string): path of the .obo file to write
+    :param n_terms (int): number of [Term] stanzas, including the root and category terms
+    :param depth (int): number of levels below the category terms
+    :param multi_parent_rate (float): fraction of terms with a second is_a parent
+    :param synonym_rate (float): fraction of terms with synonyms
+    :param seed (int): random seed
+    :return (dict): {category name : id of its term}
+    """
+    rng = random.Random(seed)
+    names = set(OBO_CATEGORIES)
+    category_ids = {category: format_term_id(i + 2) for i, category in enumerate(OBO_CATEGORIES)}
+
+    # levels[0] holds the category terms, levels[i] the ids of terms i levels below them
+    levels = [list(category_ids.values())] + [[] for _ in range(depth)]
+
+    with open(obo_path, 'w') as f:
+        f.write('format-version: 1.2\nontology: obt\n\n')
+        f.write('[Term]\nid: %s\nname: root\n\n' % format_term_id(1))
+        for category, category_id in category_ids.items():
+            f.write('[Term]\nid: %s\nname: %s\nis_a: %s ! root\n\n' % (category_id, category, format_term_id(1)))
+
+        for term_idx in range(len(category_ids) + 2, n_terms + 1):
+            # The first terms fill every level once, so each level has a parent to pick from
+            level = term_idx - len(category_ids) - 1 if term_idx - len(category_ids) - 1 <= depth else \
+                rng.randint(1, depth)
+
+            name = ' '.join(make_word(rng) for _ in range(rng.randint(1, 3)))
+            while name in names:
+                name = '%s %s' % (name, make_word(rng, 1, 2))
+            names.add(name)
+
+            lines = ['[Term]', 'id: %s' % format_term_id(term_idx), 'name: %s' % name]
+            if rng.random() < synonym_rate:
+                for _ in range(rng.randint(1, 2)):
+                    synonym = '-'.join(make_word(rng) for _ in range(rng.randint(1, 2)))
+                    lines.append('synonym: "%s" %s []' % (synonym, rng.choice(['EXACT', 'EXACT', 'RELATED'])))
+
+            parents = [rng.choice(levels[level - 1])]
+            if rng.random() < multi_parent_rate:
+                parents.append(rng.choice(levels[rng.randint(0, level - 1)]))
+            for parent in sorted(set(parents)):
+                lines.append('is_a: %s' % parent)
+            if rng.random() < 0.05:
+                lines.append('relationship: part_of %s' % rng.choice(levels[rng.randint(0, level - 1)]))
+
+            f.write('\n'.join(lines) + '\n\n')
+            levels[level].append(format_term_id(term_idx))
+
+        f.write('[Typedef]\nid: part_of\nname: part of\nis_transitive: true\n')
+
+    return category_ids
+
+def get_synthetic_rank(taxid):
+    """
+    :return (str): NCBI rank of a generated lineage taxid
+    """
+    bucket = taxid * 2654435761 % 100
+    if bucket < 10:
+        return 'genus'
+    if bucket < 80:
+        return 'species'
+    if bucket < 90:
+        return 'subspecies'
+    if bucket < 95:
+        return 'varietas'
+    return 'no rank'
+
+def is_synthetic_valid_taxid(taxid):
+    """
+    :return (bool): True if a generated lineage taxid is in the synthetic BioNLP taxid list
+    """
+    return taxid * 7919 % 100 < 60
+
+def write_lineage_csv(lineage_path, n_rows, seed=0):
+    """
+    Write an ncbi-lineages style csv of n_rows lineages with taxids 2..n_rows+1.  About 3/4 of the lineages are
+    bacterial, and a few names contain BioNLP stopwords (ex: 'uncultured bacterium').
+
+    :param lineage_path (string): path of the csv to write
+    :param n_rows (int): number of lineages
+    :param seed (int): random seed
+    :return (tuple): (set of valid taxids, {taxid : rank}) of the written lineages
+    """
+    rng = random.Random(seed)
+    genera = sorted(set(make_word(rng, 2, 4).capitalize() for _ in range(max(100, n_rows // 50))))
+
+    valid_taxids = set()
+    taxid_ranks = {}
+    with open(lineage_path, 'w') as f:
+        f.write(','.join(LINEAGE_HEADER) + '\n')
+        for taxid in range(2, n_rows + 2):
+            rank = get_synthetic_rank(taxid)
+            superkingdom = 'Bacteria' if taxid * 40503 % 100 < 75 else rng.choice(['Archaea', 'Eukaryota'])
+            genus = rng.choice(genera)
+
+            epithet = rng.choice(['sp. %d' % taxid, 'uncultured bacterium']) if rng.random() < 0.05 else \
+                make_word(rng, 2, 3)
+            species = subspecies = varietas = ''
+            if rank != 'genus':
+                species = '%s %s' % (genus, epithet)
+            if rank == 'subspecies':
+                subspecies = '%s subsp. %s' % (species, make_word(rng, 2, 3))
+            elif rank == 'varietas':
+                varietas = '%s var. %s' % (species, make_word(rng, 2, 3))
+
+            f.write(','.join([str(taxid), superkingdom, 'Phylum%d' % (taxid % 30), 'Class%d' % (taxid % 100),
+                              'Order%d' % (taxid % 300), 'Family%d' % (taxid % 1000), genus, species, subspecies,
+                              varietas]) + '\n')
+
+            if is_synthetic_valid_taxid(taxid):
+                valid_taxids.add(taxid)
+            taxid_ranks[taxid] = rank
+
+    return valid_taxids, taxid_ranks
+
+def generate_annotated_text(rng, n_words, entity_every=8, sentence_every=20, first_t_id=1):
+    """
+    :return (tuple): (text, entity annotation lines, normalization annotation lines), with one contiguous 1-3 word
+                     entity every entity_every words and sentences of sentence_every words
+    """
+    words = []
+    ent_lines = []
+    norm_lines = []
+    idx = 0
+    i = 0
+    while i < n_words:
+        is_entity = i % entity_every == 0
+        if is_entity:
+            label = rng.choice(BIONLP_LABELS)
+            ent_words = [make_word(rng) for _ in range(rng.randint(1, 3))]
+            ent_text = ' '.join(ent_words)
+            t_id = first_t_id + len(ent_lines)
+            ent_lines.append('T%d\t%s %d %d\t%s' % (t_id, label, idx, idx + len(ent_text), ent_text))
+            if label == 'Microorganism':
+                norm_lines.append('N%d\tNCBI_Taxonomy Annotation:T%d Referent:%d' % (
+                    len(norm_lines) + 1, t_id, rng.randint(2, 100000)))
+            else:
+                norm_lines.append('N%d\tOntoBiotope Annotation:T%d Referent:%s' % (
+                    len(norm_lines) + 1, t_id, format_term_id(rng.randint(5, 10000))))
+        else:
+            ent_words = [make_word(rng, 1, 4)]
+
+        for word in ent_words:
+            i += 1
+            # Sentences only end on words outside entities
+            if i % sentence_every == 0 and not is_entity:
+                word += '.'
+            words.append(word)
+            idx += len(word) + 1
+
+    return ' '.join(words), ent_lines, norm_lines
+
+def write_bionlp_corpus(corpus_dir, n_documents, n_words=250, seed=0):
+    """
+    Write a BioNLP BB-norm+ner corpus directory.  Even documents are titles/abstracts (.a1 with Title and Paragraph
+    lines, .a2 with entities), odd documents are body passages (.txt, .a2).
+
+    :param corpus_dir (string): directory to write the documents to, created if missing
+    :param n_documents (int): number of documents
+    :param n_words (int): words per document
+    :param seed (int): random seed
+    :return (int): total number of words written
+    """
+    rng = random.Random(seed)
+    if not os.path.isdir(corpus_dir):
+        os.makedirs(corpus_dir)
+
+    n_total_words = 0
+    for doc_idx in range(n_documents):
+        pmid = 10000000 + doc_idx // 2
+        if doc_idx % 2 == 0:
+            text, ent_lines, norm_lines = generate_annotated_text(rng, n_words, first_t_id=3)
+
+            # The title is the first sentence, and the paragraph the rest of the text
+            title_end = text.find('. ') + 1 if '. ' in text else len(text)
+            text_lines = ['T1\tTitle 0 %d\t%s' % (title_end, text[:title_end]),
+                          'T2\tParagraph %d %d\t%s' % (title_end + 1, len(text), text[title_end + 1:])]
+            text_path = os.path.join(corpus_dir, 'BB-norm+ner-%d.a1' % pmid)
+        else:
+            text, ent_lines, norm_lines = generate_annotated_text(rng, n_words)
+            text_lines = [text]
+            text_path = os.path.join(corpus_dir, 'BB-norm+ner-F-%d-%03d.txt' % (pmid, doc_idx % 1000))
+
+        with open(text_path, 'w') as f:
+            f.write('\n'.join(text_lines) + '\n')
+        with open('%s.a2' % os.path.splitext(text_path)[0], 'w') as f:
+            f.write('\n'.join(ent_lines + norm_lines) + '\n')
+        n_total_words += n_words
+
+    return n_total_words
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic obo, ncbi lineage and BioNLP corpus inputs.")
+    parser.add_argument('out_dir', help='Directory to write synthetic.obo, synthetic_lineages.csv and bionlp/ to.')
+    parser.add_argument('--n_terms', type=int, default=100000, help='Number of obo terms.')
+    parser.add_argument('--obo_depth', type=int, default=12, help='Number of is_a levels below the category terms.')
+    parser.add_argument('--n_lineages', type=int, default=1000000, help='Number of lineage csv rows.')
+    parser.add_argument('--n_documents', type=int, default=1000, help='Number of BioNLP documents.')
+    parser.add_argument('--n_words', type=int, default=250, help='Words per BioNLP document.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    obo_path = os.path.join(args.out_dir, 'synthetic.obo')
+    write_obo_file(obo_path, args.n_terms, depth=args.obo_depth, seed=args.seed)
+    print("Wrote %d terms to %s." % (args.n_terms, obo_path))
+
+    lineage_path = os.path.join(args.out_dir, 'synthetic_lineages.csv')
+    valid_taxids, _ = write_lineage_csv(lineage_path, args.n_lineages, seed=args.seed)
+    print("Wrote %d lineages (%d valid taxids) to %s." % (args.n_lineages, len(valid_taxids), lineage_path))
+
+    corpus_dir = os.path.join(args.out_dir, 'bionlp')
+    n_words = write_bionlp_corpus(corpus_dir, args.n_documents, n_words=args.n_words, seed=args.seed)
+    print("Wrote %d documents (%d words) to %s." % (args.n_documents, n_words, corpus_dir))
+
+if __name__ == "__main__":
+    main()
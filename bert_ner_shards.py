@@ -0,0 +1,271 @@
+import argparse
+import collections
+import json
+import os
+import re
+import shutil
+from array import array
+
+import numpy as np
+
+import pipeline_metrics
+from convert_bionlp_ner_train_to_bert_ner_train import BERT_LABELS
+from wordpiece_tokenizer import CLS_TOKEN, PAD_TOKEN, SEP_TOKEN, WordpieceTokenizer, load_vocab
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It writes a BERT NER train file from convert_bionlp_ner_train_to_bert_ner_train.py (word<TAB>label lines, sentences
+separated by empty lines) as pre-tokenized NumPy shards, so training and evaluation load arrays instead of re-reading the
+file and re-running WordPiece tokenization and label alignment.
+
+Each sentence is tokenized with the vocab of the model (see wordpiece_tokenizer.py) and becomes one example:
+[CLS] pieces [SEP].  The first piece of each word gets the word's label ID, other pieces, [CLS], [SEP] and padding get
+IGNORE_LABEL_ID (the default ignore_index of torch CrossEntropyLoss).  Sentences with more than max_seq_length - 2
+pieces are split at word boundaries into several examples.
+
+Examples are sorted by length and cut into shards of shard_size examples, each padded to its longest example, so little
+of a shard is padding.  Shuffle the shard order and the rows within a shard to train on them.
+
+Shard layout:
+    <shard_dir>/shards.json                     manifest: tokenizer settings and the shards with their sizes
+    <shard_dir>/label_map.json                  {label : label ID}
+    <shard_dir>/shard_00000/input_ids.npy       int32 [n_examples, seq_length], padded with the [PAD] ID
+    <shard_dir>/shard_00000/attention_mask.npy  int8 [n_examples, seq_length], 1 for tokens, 0 for padding
+    <shard_dir>/shard_00000/label_ids.npy       int16 [n_examples, seq_length]
+    <shard_dir>/shard_00000/sentence_ids.npy    int32 [n_examples], sentence number of the example in the train file
+    <shard_dir>/shard_00000/word_offsets.npy    int32 [n_examples], number of words of the sentence before the example
+
+load_shard memory-maps the arrays of a shard, ex:
+    for shard in iter_shards('bert_train_shards'):
+        batch = torch.from_numpy(shard['input_ids'][:32])
+
+Token type IDs are all 0 for single-sentence NER, so they are not stored.
+"""
+
+IGNORE_LABEL_ID = -100
+
+# Shard directory names, ex: shard_00000
+SHARD_NAME_PATTERN = re.compile(r'shard_\d+$')
+
+ARRAY_DTYPES = collections.OrderedDict([
+    ('input_ids', np.int32),
+    ('attention_mask', np.int8),
+    ('label_ids', np.int16),
+    ('sentence_ids', np.int32),
+    ('word_offsets', np.int32)
+])
+
+def get_label_map():
+    """
+    :return label_map (OrderedDict): {BERT NER label : label ID}, 'O' first, then B- and I- of each BERT_LABELS label
+    """
+    labels = ['O'] + ['%s-%s' % (prefix, label) for label in BERT_LABELS.values() for prefix in 'BI']
+    return collections.OrderedDict((label, label_id) for label_id, label in enumerate(labels))
+
+def iter_train_file_sentences(train_path):
+    """
+    :param train_path (str): BERT NER train file, word<TAB>label lines with sentences separated by empty lines
+    :return: generator of sentences, lists of (word, label) tuples
+    """
+    sentence = []
+    with open(train_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                if sentence:
+                    yield sentence
+                    sentence = []
+                continue
+            word, _, label = line.rpartition('\t')
+            sentence.append((word, label))
+    if sentence:
+        yield sentence
+
+def encode_sentence(sentence, tokenizer, label_map, max_pieces):
+    """
+    :param sentence (list): (word, label) tuples
+    :param tokenizer (WordpieceTokenizer): tokenizer of the model vocab
+    :param label_map (dict): {label : label ID}
+    :param max_pieces (int): most pieces per example, max_seq_length - 2
+    :return examples (list): (word offset, piece IDs, label IDs) of each example the sentence is split into
+    """
+    examples = []
+    word_offset = 0
+    piece_ids = []
+    label_ids = []
+    for word_idx, (word, label) in enumerate(sentence):
+        if label not in label_map:
+            raise ValueError("Label '%s' of word '%s' is not one of %s." % (label, word, ', '.join(label_map)))
+
+        # A word of control characters has no pieces, keep it as [UNK] so every word has a labeled piece
+        word_piece_ids = tokenizer.tokenize_word_ids(word) or [tokenizer.unk_id]
+        if len(word_piece_ids) > max_pieces:
+            pipeline_metrics.count('truncated_words')
+            word_piece_ids = word_piece_ids[:max_pieces]
+
+        if len(piece_ids) + len(word_piece_ids) > max_pieces:
+            examples.append((word_offset, piece_ids, label_ids))
+            word_offset = word_idx
+            piece_ids = []
+            label_ids = []
+
+        piece_ids.extend(word_piece_ids)
+        label_ids.append(label_map[label])
+        label_ids.extend([IGNORE_LABEL_ID] * (len(word_piece_ids) - 1))
+
+    if piece_ids:
+        examples.append((word_offset, piece_ids, label_ids))
+    return examples
+
+def remove_shards(shard_dir):
+    """
+    Remove the shards of an earlier write_bert_ner_shards to shard_dir, so none of them is left over.
+
+    Shard directories of an interrupted write, which its manifest never listed, are removed too.
+    """
+    manifest_path = os.path.join(shard_dir, 'shards.json')
+    shard_names = set(name for name in os.listdir(shard_dir)
+                      if SHARD_NAME_PATTERN.match(name) and os.path.isdir(os.path.join(shard_dir, name)))
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        os.remove(manifest_path)
+        shard_names.update(shard['name'] for shard in manifest['shards'])
+    for shard_name in sorted(shard_names):
+        shutil.rmtree(os.path.join(shard_dir, shard_name), ignore_errors=True)
+
+def write_bert_ner_shards(train_path, vocab_path, shard_dir, max_seq_length=128, shard_size=4096, do_lower_case=False):
+    """
+    Tokenize a BERT NER train file and write it as length-sorted shards of NumPy arrays, see the module docstring.
+
+    :param train_path (str): BERT NER train file, from convert_bionlp_ner_train_to_bert_ner_train.py
+    :param vocab_path (str): BERT vocab file of the model to train
+    :param shard_dir (str): directory to write shards, label_map.json and shards.json to
+    :param max_seq_length (int): most tokens per example, including [CLS] and [SEP]
+    :param shard_size (int): number of examples per shard
+    :param do_lower_case (bool): lower-case words, for uncased vocabs
+    :return manifest (dict): contents of shards.json
+    """
+    vocab = load_vocab(vocab_path)
+    tokenizer = WordpieceTokenizer(vocab, do_lower_case=do_lower_case)
+    label_map = get_label_map()
+
+    # Pieces and labels of all examples, concatenated
+    all_piece_ids = array('i')
+    all_label_ids = array('h')
+    lengths = array('i')
+    sentence_ids = array('i')
+    word_offsets = array('i')
+    n_sentences = 0
+    with pipeline_metrics.stage('tokenize_wordpiece'):
+        for sentence_id, sentence in enumerate(iter_train_file_sentences(train_path)):
+            n_sentences += 1
+            for word_offset, piece_ids, label_ids in encode_sentence(sentence, tokenizer, label_map, max_seq_length - 2):
+                all_piece_ids.extend(piece_ids)
+                all_label_ids.extend(label_ids)
+                lengths.append(len(piece_ids))
+                sentence_ids.append(sentence_id)
+                word_offsets.append(word_offset)
+
+    lengths = np.frombuffer(lengths, dtype=np.intc)
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    all_piece_ids = np.frombuffer(all_piece_ids, dtype=np.intc)
+    all_label_ids = np.frombuffer(all_label_ids, dtype=np.short)
+    sentence_ids = np.frombuffer(sentence_ids, dtype=np.intc)
+    word_offsets = np.frombuffer(word_offsets, dtype=np.intc)
+
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+    remove_shards(shard_dir)
+
+    shards = []
+    order = np.argsort(lengths, kind='stable')
+    with pipeline_metrics.stage('write_shards'):
+        for shard_start in range(0, len(order), shard_size):
+            rows = order[shard_start:shard_start + shard_size]
+            seq_length = int(lengths[rows[-1]]) + 2
+            arrays = {
+                'input_ids': np.full((len(rows), seq_length), vocab[PAD_TOKEN], dtype=ARRAY_DTYPES['input_ids']),
+                'attention_mask': np.zeros((len(rows), seq_length), dtype=ARRAY_DTYPES['attention_mask']),
+                'label_ids': np.full((len(rows), seq_length), IGNORE_LABEL_ID, dtype=ARRAY_DTYPES['label_ids']),
+                'sentence_ids': sentence_ids[rows].astype(ARRAY_DTYPES['sentence_ids']),
+                'word_offsets': word_offsets[rows].astype(ARRAY_DTYPES['word_offsets'])
+            }
+            input_ids = arrays['input_ids']
+            label_ids = arrays['label_ids']
+            for i, row in enumerate(rows):
+                start = starts[row]
+                length = lengths[row]
+                input_ids[i, 0] = vocab[CLS_TOKEN]
+                input_ids[i, 1:length + 1] = all_piece_ids[start:start + length]
+                input_ids[i, length + 1] = vocab[SEP_TOKEN]
+                label_ids[i, 1:length + 1] = all_label_ids[start:start + length]
+                arrays['attention_mask'][i, :length + 2] = 1
+
+            shard = {'name': 'shard_%05d' % len(shards), 'n_examples': len(rows), 'seq_length': seq_length}
+            os.makedirs(os.path.join(shard_dir, shard['name']))
+            for array_name in ARRAY_DTYPES:
+                np.save(os.path.join(shard_dir, shard['name'], '%s.npy' % array_name), arrays[array_name])
+            shards.append(shard)
+
+    pipeline_metrics.count('shard_examples', len(lengths))
+    pipeline_metrics.count('subword_tokens', len(all_piece_ids))
+
+    with open(os.path.join(shard_dir, 'label_map.json'), 'w') as f:
+        json.dump(label_map, f, indent=1)
+
+    # The manifest is written last, so shards of an interrupted write are never listed
+    manifest = {
+        'train_file': os.path.abspath(train_path),
+        'vocab_file': os.path.abspath(vocab_path),
+        'vocab_size': max(vocab.values()) + 1,
+        'do_lower_case': do_lower_case,
+        'max_seq_length': max_seq_length,
+        'ignore_label_id': IGNORE_LABEL_ID,
+        'n_sentences': n_sentences,
+        'n_examples': len(lengths),
+        'shards': shards
+    }
+    with open(os.path.join(shard_dir, 'shards.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+def load_shard(shard_path):
+    """
+    :param shard_path (str): shard directory, ex: <shard_dir>/shard_00000
+    :return (dict): {array name : memory-mapped array}, see ARRAY_DTYPES
+    """
+    return {array_name: np.load(os.path.join(shard_path, '%s.npy' % array_name), mmap_mode='r')
+            for array_name in ARRAY_DTYPES}
+
+def iter_shards(shard_dir):
+    """
+    :param shard_dir (str): directory written by write_bert_ner_shards
+    :return: generator of shards from load_shard, shortest examples first
+    """
+    with open(os.path.join(shard_dir, 'shards.json')) as f:
+        manifest = json.load(f)
+    for shard in manifest['shards']:
+        yield load_shard(os.path.join(shard_dir, shard['name']))
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a BERT NER train file as pre-tokenized, length-sorted NumPy shards.")
+    parser.add_argument('bert_train_file', help='BERT NER train file, from convert_bionlp_ner_train_to_bert_ner_train.py.')
+    parser.add_argument('vocab_file', help='BERT vocab file of the model to train, ex: biobert_v1.1_pubmed/vocab.txt.')
+    parser.add_argument('shard_dir', help='Directory to write shards, label_map.json and shards.json to.')
+    parser.add_argument('--max_seq_length', type=int, default=128,
+                        help='Most tokens per example, including [CLS] and [SEP].  Longer sentences are split.')
+    parser.add_argument('--shard_size', type=int, default=4096, help='Number of examples per shard.')
+    parser.add_argument('--do_lower_case', action='store_true', help='Lower-case words, for uncased vocabs.')
+    args = parser.parse_args()
+
+    manifest = write_bert_ner_shards(args.bert_train_file, args.vocab_file, args.shard_dir,
+                                     max_seq_length=args.max_seq_length, shard_size=args.shard_size,
+                                     do_lower_case=args.do_lower_case)
+    print("Wrote %d examples of %d sentences to %d shards in %s." % (
+        manifest['n_examples'], manifest['n_sentences'], len(manifest['shards']), args.shard_dir))
+
+if __name__ == "__main__":
+    main()
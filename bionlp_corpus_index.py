@@ -0,0 +1,122 @@
+import collections
+import json
+import os
+import re
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It indexes a BioNLP corpus directory into a manifest of documents, pairing each document's text file with its entity
+annotation file by document ID rather than by position in a sorted file list.
+
+BioNLP documents exist in 2 formats:
+
+    Format 1 (title/abstract):
+        BB-norm+ner-<PMID>.a1 - Title and Paragraph lines containing the text
+        BB-norm+ner-<PMID>.a2 - entity annotations
+    Format 2 (body passage):
+        BB-norm+ner-F-<PMID>-<NNN>.txt - text passage
+        BB-norm+ner-F-<PMID>-<NNN>.a2 - entity annotations
+
+The directory is scanned once with os.scandir.  Documents missing a text or annotation file, and files that do not
+follow the BioNLP naming scheme, are reported as orphans instead of shifting every later pair.
+"""
+
+BIONLP_FILE_PATTERN = re.compile(
+    r'^(?P<task>BB-[A-Za-z+]+)-(?:F-(?P<passage_pmid>\w+)-(?P<passage>\d+)|(?P<pmid>\w+))\.(?P<extension>a1|a2|txt)$')
+
+BioNLPDocument = collections.namedtuple('BioNLPDocument', ['doc_id', 'task', 'pmid', 'passage', 'kind', 'text_file',
+                                                           'ann_file'])
+BioNLPDocument.__doc__ = """
+    A BioNLP document and its files.
+
+    doc_id (str): file name without extension, ex: BB-norm+ner-F-25036636-000
+    task (str): ex: BB-norm+ner
+    pmid (str): PubMed ID of the article
+    passage (str): passage number for body passages (Format 2), None for titles/abstracts (Format 1)
+    kind (str): 'abstract' or 'passage'
+    text_file (str): path to the .a1 (abstract) or .txt (passage) file containing the text
+    ann_file (str): path to the .a2 file containing entity annotations
+"""
+
+BioNLPOrphan = collections.namedtuple('BioNLPOrphan', ['name', 'reason'])
+
+def build_corpus_manifest(corpus_dir):
+    """
+    Scan a BioNLP corpus directory and pair up the files of each document.
+
+    :param corpus_dir (str): directory containing BioNLP .a1/.a2/.txt files
+    :return (tuple): (list of BioNLPDocument sorted by doc_id, list of BioNLPOrphan)
+    """
+    doc_files = collections.defaultdict(dict)
+    doc_fields = {}
+    orphans = []
+
+    for dir_entry in os.scandir(corpus_dir):
+        if not dir_entry.is_file():
+            continue
+
+        name_match = BIONLP_FILE_PATTERN.match(dir_entry.name)
+        if not name_match:
+            if dir_entry.name.endswith(('.a1', '.a2', '.txt')):
+                orphans.append(BioNLPOrphan(dir_entry.name, 'unrecognized file name'))
+            continue
+
+        doc_id = dir_entry.name[:-len(name_match.group('extension')) - 1]
+        doc_files[doc_id][name_match.group('extension')] = dir_entry.path
+        doc_fields[doc_id] = (name_match.group('task'), name_match.group('passage_pmid') or name_match.group('pmid'),
+                              name_match.group('passage'))
+
+    documents = []
+    for doc_id in sorted(doc_files):
+        task, pmid, passage = doc_fields[doc_id]
+        files = doc_files[doc_id]
+
+        kind = 'abstract' if passage is None else 'passage'
+        text_extension = 'a1' if kind == 'abstract' else 'txt'
+
+        missing = [extension for extension in (text_extension, 'a2') if extension not in files]
+        if missing:
+            orphans.append(BioNLPOrphan(doc_id, 'missing %s' % ', '.join('.%s' % i for i in missing)))
+            continue
+
+        documents.append(BioNLPDocument(doc_id, task, pmid, passage, kind, files[text_extension], files['a2']))
+
+    return documents, sorted(orphans)
+
+def load_corpus_manifest(corpus_dir, cache_path=None):
+    """
+    Return the manifest of a corpus directory, from a json cache if the directory has not changed since it was written.
+
+    Adding, removing or renaming files changes the directory's mtime, which invalidates the cache.
+
+    :param corpus_dir (str): directory containing BioNLP .a1/.a2/.txt files
+    :param cache_path (str): path to json manifest cache, or None to always scan
+    :return (tuple): (list of BioNLPDocument, list of BioNLPOrphan)
+    """
+    dir_key = os.path.abspath(corpus_dir)
+    dir_mtime_ns = os.stat(corpus_dir).st_mtime_ns
+
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+        cached_manifest = cache.get(dir_key)
+        if cached_manifest and cached_manifest['mtime_ns'] == dir_mtime_ns:
+            return ([BioNLPDocument(*i) for i in cached_manifest['documents']],
+                    [BioNLPOrphan(*i) for i in cached_manifest['orphans']])
+    else:
+        cache = {}
+
+    # Absolute paths keep cached manifests valid from any working directory
+    documents, orphans = build_corpus_manifest(dir_key)
+
+    if cache_path:
+        cache[dir_key] = {
+            'mtime_ns': dir_mtime_ns,
+            'documents': documents,
+            'orphans': orphans
+        }
+        with open(cache_path, 'w') as f:
+            json.dump(cache, f)
+
+    return documents, orphans
@@ -0,0 +1,383 @@
+import argparse
+import collections
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It provides a compact, memory-mappable file format for the entity dicts written by generate_bacteria_taxid_dict.py
+({name : {'taxid', 'corrected_name', 'rank'}}) and extract_obo_category_nodes.py ({name : {'id', 'entity_class'}}),
+with a reader that looks names up without loading the whole dict.  Every process opening the same file shares one copy
+of it through the page cache.
+
+File layout (little-endian):
+    MAGIC, uint32 header length, json header, then 8-byte aligned sections:
+    -string_offsets: int64[n_strings + 1], string i is strings[string_offsets[i]:string_offsets[i + 1]]
+    -records: one fixed-width record per key, a packed numpy structured array with one column per entry field
+    -strings: UTF-8 blob of interned strings.  Strings 0..n_records-1 are the keys, sorted, so key i belongs to record i.
+     Other strings (ex: corrected names that are not keys) follow.
+    -hash_slots: int32 open addressing table of record indexes (-1 for empty slots), at most half full.  A key is looked
+     up by linear probing from slot crc32(UTF-8 key) % n_slots, so a lookup compares ~1.5 keys on average.
+
+Field columns are int64 ('int' fields, ex: taxid), int32 indexes into the string table ('string' fields, ex:
+corrected_name) or int16 codes into a list of values kept in the header ('enum' fields, ex: rank).  Missing fields and
+None values have reserved codes.  Values that do not fit their column, such as the list of taxids of a manual entry, are
+kept in the header, so a converted dict reads back equal to the original.
+
+Usage:
+    python compact_dictionary.py microorganism_taxid_dict.json microorganism_taxid_dict.dict
+    python compact_dictionary.py combined_categories.json microbial_habitat.dict --category microbial_habitat
+"""
+
+MAGIC = b'BBDICT\x00\x01'
+FORMAT_VERSION = 1
+
+HEADER_PREFIX = struct.Struct('<8sI')
+
+# String fields with at most this many distinct values are stored as enum codes
+ENUM_MAX_VALUES = 1024
+
+FIELD_DTYPES = {'int': '<i8', 'string': '<i4', 'enum': '<i2'}
+
+# Reserved codes of int fields, and of string and enum fields
+INT_NONE, INT_MISSING, INT_OVERFLOW = -2 ** 63, -2 ** 63 + 1, -2 ** 63 + 2
+INDEX_NONE, INDEX_MISSING, INDEX_OVERFLOW = -1, -2, -3
+INT_MAX = 2 ** 63 - 1
+
+# Value of fields an entry does not have
+MISSING = object()
+
+def align(offset, alignment=8):
+    """
+    :return (int): offset rounded up to a multiple of alignment
+    """
+    return (offset + alignment - 1) // alignment * alignment
+
+def get_field_layout(entries):
+    """
+    Choose a column type for every field of a dict's entries: 'int' if most values are ints, otherwise 'enum' if there
+    are few distinct strings, otherwise 'string'.
+
+    :param entries (iterable): entry dicts, ex: {'taxid': 1280, 'corrected_name': 'Staphylococcus aureus', 'rank': 'species'}
+    :return fields (list): [{'name', 'kind', ('values' for enum fields)}] in order of first appearance
+    """
+    n_ints = collections.OrderedDict()
+    n_strings = {}
+    distinct_strings = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError("Dict entries must be dicts, got %r." % (entry,))
+
+        for name, value in entry.items():
+            if name not in n_ints:
+                n_ints[name] = n_strings[name] = 0
+                distinct_strings[name] = set()
+
+            # type() rather than isinstance() leaves out bools, and is faster over millions of values
+            value_type = type(value)
+            if value_type is int:
+                n_ints[name] += 1
+            elif value_type is str:
+                n_strings[name] += 1
+                if len(distinct_strings[name]) <= ENUM_MAX_VALUES:
+                    distinct_strings[name].add(value)
+
+    fields = []
+    for name in n_ints:
+        if n_ints[name] >= n_strings[name]:
+            fields.append({'name': name, 'kind': 'int'})
+        elif len(distinct_strings[name]) <= ENUM_MAX_VALUES:
+            fields.append({'name': name, 'kind': 'enum', 'values': sorted(distinct_strings[name])})
+        else:
+            fields.append({'name': name, 'kind': 'string'})
+    return fields
+
+def get_n_hash_slots(n_records):
+    """
+    :return (int): smallest power of 2 at least twice n_records
+    """
+    n_slots = 1
+    while n_slots < 2 * n_records:
+        n_slots *= 2
+    return n_slots
+
+def build_hash_slots(encoded_keys):
+    """
+    :param encoded_keys (list): UTF-8 encoded keys, in record order
+    :return hash_slots (ndarray): int32 linear probing table of record indexes, -1 for empty slots
+    """
+    n_slots = get_n_hash_slots(len(encoded_keys))
+    slot_mask = n_slots - 1
+    hash_slots = [-1] * n_slots
+    for record_idx, encoded_key in enumerate(encoded_keys):
+        slot = zlib.crc32(encoded_key) & slot_mask
+        while hash_slots[slot] >= 0:
+            slot = (slot + 1) & slot_mask
+        hash_slots[slot] = record_idx
+    return np.array(hash_slots, dtype='<i4')
+
+def get_record_dtype(fields):
+    """
+    :param fields (list): from get_field_layout
+    :return (dtype): packed structured dtype of a record
+    """
+    return np.dtype([(field['name'], FIELD_DTYPES[field['kind']]) for field in fields])
+
+def write_compact_dictionary(entity_dict, out_path):
+    """
+    Write an entity dict in the compact format.  The file is written to a temporary file and renamed into place, so
+    readers never map a partially written file.
+
+    :param entity_dict (dict): {name : {field : value}}, ex: a taxid dict or an obo category dict
+    :param out_path (string): path of the file to write
+    """
+    keys = sorted(entity_dict)
+    entries = [entity_dict[key] for key in keys]
+    fields = get_field_layout(entries)
+
+    # Keys take the first string ids, so record i and string i belong to the same key
+    strings = list(keys)
+    string_ids = {key: i for i, key in enumerate(keys)}
+
+    def intern_string(string):
+        string_id = string_ids.get(string)
+        if string_id is None:
+            string_id = string_ids[string] = len(strings)
+            strings.append(string)
+        return string_id
+
+    records = np.zeros(len(keys), dtype=get_record_dtype(fields))
+    overflow = {}
+    for field in fields:
+        name, kind = field['name'], field['kind']
+        enum_codes = {value: code for code, value in enumerate(field.get('values', []))}
+        missing_code, none_code, overflow_code = (INT_MISSING, INT_NONE, INT_OVERFLOW) if kind == 'int' else \
+            (INDEX_MISSING, INDEX_NONE, INDEX_OVERFLOW)
+        field_overflow = {}
+
+        column = []
+        for i, entry in enumerate(entries):
+            value = entry.get(name, MISSING)
+            value_type = type(value)
+            if kind == 'int' and value_type is int and INT_OVERFLOW < value <= INT_MAX:
+                column.append(value)
+            elif kind == 'enum' and value_type is str and value in enum_codes:
+                column.append(enum_codes[value])
+            elif kind == 'string' and value_type is str:
+                column.append(intern_string(value))
+            elif value is None:
+                column.append(none_code)
+            elif value is MISSING:
+                column.append(missing_code)
+            else:
+                field_overflow[str(i)] = value
+                column.append(overflow_code)
+
+        records[name] = column
+        if field_overflow:
+            overflow[name] = field_overflow
+
+    encoded_strings = [string.encode('utf-8') for string in strings]
+    string_offsets = np.zeros(len(encoded_strings) + 1, dtype='<i8')
+    np.cumsum([len(i) for i in encoded_strings], out=string_offsets[1:])
+    hash_slots = build_hash_slots(encoded_strings[:len(keys)])
+
+    # Section offsets are relative to the end of the header
+    sections = collections.OrderedDict()
+    offset = 0
+    for section_name, section_size in [('string_offsets', string_offsets.nbytes), ('records', records.nbytes),
+                                       ('strings', int(string_offsets[-1])), ('hash_slots', hash_slots.nbytes)]:
+        sections[section_name] = offset
+        offset = align(offset + section_size)
+
+    header = json.dumps({
+        'format_version': FORMAT_VERSION,
+        'n_records': len(keys),
+        'n_strings': len(strings),
+        'n_hash_slots': len(hash_slots),
+        'fields': fields,
+        'overflow': overflow,
+        'sections': sections
+    }).encode('utf-8')
+    data_start = align(HEADER_PREFIX.size + len(header))
+
+    tmp_path = '%s.tmp%d' % (out_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER_PREFIX.pack(MAGIC, len(header)))
+            f.write(header)
+            for section_name, section_bytes in [('string_offsets', string_offsets.tobytes()),
+                                                ('records', records.tobytes()),
+                                                ('strings', b''.join(encoded_strings)),
+                                                ('hash_slots', hash_slots.tobytes())]:
+                f.write(b'\0' * (data_start + sections[section_name] - f.tell()))
+                f.write(section_bytes)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def is_compact_dictionary(path):
+    """
+    :param path (string): path to a file
+    :return (bool): True if the file starts with the compact dictionary magic bytes
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class CompactDictionary(object):
+    """
+    Read-only, memory-mapped view of a dict written by write_compact_dictionary.
+
+    Supports len(), 'name in d', d[name], d.get(name), and iteration over keys() and items() in sorted key order, so it
+    can stand in for the json-loaded dict in code that only reads it.  Entries are decoded into new dicts on access.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_length = HEADER_PREFIX.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError("%s is not a compact dictionary file." % path)
+
+        header = json.loads(self._mmap[HEADER_PREFIX.size:HEADER_PREFIX.size + header_length].decode('utf-8'))
+        if header['format_version'] != FORMAT_VERSION:
+            self._mmap.close()
+            raise ValueError("%s has format version %s, expected %s." % (path, header['format_version'],
+                                                                          FORMAT_VERSION))
+
+        self.fields = header['fields']
+        self._overflow = header['overflow']
+        self._n_records = header['n_records']
+
+        data_start = align(HEADER_PREFIX.size + header_length)
+        sections = header['sections']
+        self._string_offsets = np.frombuffer(self._mmap, dtype='<i8', count=header['n_strings'] + 1,
+                                             offset=data_start + sections['string_offsets'])
+        self._records = np.frombuffer(self._mmap, dtype=get_record_dtype(self.fields), count=self._n_records,
+                                      offset=data_start + sections['records'])
+        self._strings_start = data_start + sections['strings']
+        self._hash_slots = np.frombuffer(self._mmap, dtype='<i4', count=header['n_hash_slots'],
+                                         offset=data_start + sections['hash_slots'])
+        self._slot_mask = header['n_hash_slots'] - 1
+
+    def close(self):
+        # Arrays viewing the map must be released before it can be closed
+        self._string_offsets = self._records = self._hash_slots = None
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._n_records
+
+    def _get_string_bytes(self, string_id):
+        start = self._strings_start + int(self._string_offsets[string_id])
+        end = self._strings_start + int(self._string_offsets[string_id + 1])
+        return self._mmap[start:end]
+
+    def _get_string(self, string_id):
+        return self._get_string_bytes(string_id).decode('utf-8')
+
+    def find(self, key):
+        """
+        :param key (str): dict key
+        :return (int): record index of key, or -1 if it is not in the dict
+        """
+        target = key.encode('utf-8')
+        slot = zlib.crc32(target) & self._slot_mask
+        while True:
+            record_idx = int(self._hash_slots[slot])
+            if record_idx < 0 or self._get_string_bytes(record_idx) == target:
+                return record_idx
+            slot = (slot + 1) & self._slot_mask
+
+    def get_entry(self, record_idx):
+        """
+        :param record_idx (int): record index, ex: from find
+        :return entry (dict): the entry of the key at record_idx, as it was in the written dict
+        """
+        entry = {}
+        for field, code in zip(self.fields, self._records[record_idx].tolist()):
+            name, kind = field['name'], field['kind']
+            if kind == 'int':
+                if code == INT_MISSING:
+                    continue
+                entry[name] = None if code == INT_NONE else \
+                    self._overflow[name][str(record_idx)] if code == INT_OVERFLOW else code
+            else:
+                if code == INDEX_MISSING:
+                    continue
+                entry[name] = None if code == INDEX_NONE else \
+                    self._overflow[name][str(record_idx)] if code == INDEX_OVERFLOW else \
+                    field['values'][code] if kind == 'enum' else self._get_string(code)
+        return entry
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __getitem__(self, key):
+        record_idx = self.find(key)
+        if record_idx < 0:
+            raise KeyError(key)
+        return self.get_entry(record_idx)
+
+    def get(self, key, default=None):
+        record_idx = self.find(key)
+        if record_idx < 0:
+            return default
+        return self.get_entry(record_idx)
+
+    def keys(self):
+        return (self._get_string(i) for i in range(self._n_records))
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        return ((self._get_string(i), self.get_entry(i)) for i in range(self._n_records))
+
+def convert_json_to_compact_dictionary(json_path, out_path, category=None):
+    """
+    :param json_path (string): path to a dict json written by generate_bacteria_taxid_dict.py or
+                               extract_obo_category_nodes.py
+    :param out_path (string): path of the compact dictionary to write
+    :param category (string): category to convert from a combined category json ({category : {name : {...}}})
+    :return (int): number of entries written
+    """
+    with open(json_path) as f:
+        entity_dict = json.load(f)
+    if category is not None:
+        entity_dict = entity_dict[category]
+
+    write_compact_dictionary(entity_dict, out_path)
+    return len(entity_dict)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert an entity dict json to a compact, memory-mappable dictionary.")
+    parser.add_argument('json_file', help='Path to taxid dict or obo category dict json.')
+    parser.add_argument('out_file', help='Path to write the compact dictionary to.')
+    parser.add_argument('--category',
+                        help='Category to convert, if json_file is a combined category dict (--combined_out_file).')
+    args = parser.parse_args()
+
+    n_entries = convert_json_to_compact_dictionary(args.json_file, args.out_file, category=args.category)
+    print("Wrote %d entries to %s (%.1f MB, json %.1f MB)." % (n_entries, args.out_file,
+                                                              os.path.getsize(args.out_file) / 1e6,
+                                                              os.path.getsize(args.json_file) / 1e6))
+
+if __name__ == "__main__":
+    main()
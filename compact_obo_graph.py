@@ -0,0 +1,276 @@
+import array
+import sys
+
+import numpy as np
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It provides a compact, array-backed alternative to the networkx MultiDiGraph built by
+extract_obo_category_nodes.parse_obo_file_to_graph.  Terms are numbered 0..N-1, is_a links are stored as CSR-style
+parent and child adjacency arrays, and names and synonyms are kept in interned string tables.  Only is_a links are
+stored; other relationship types are dropped.
+
+CompactOboGraph exposes the subset of the networkx graph interface used by extract_obo_category_nodes
+(graph.nodes(), graph.nodes.get(node_id), graph.out_edges(node_id, keys=True)), so get_nodes_by_category and
+convert_node_list_to_dict run on it unchanged.
+"""
+
+class CompactNodeView(object):
+    """
+    Adapter mimicking the networkx NodeView of a graph: iterating yields term ids, and get() returns a node dict of the
+    form {'attr_dict': {'name': [name], 'synonym': [raw synonym, ...]}}.  Nodes only referenced as is_a targets return an
+    empty dict, as they would in networkx.
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __call__(self):
+        return self
+
+    def __iter__(self):
+        return iter(self._graph.term_ids)
+
+    def __len__(self):
+        return len(self._graph.term_ids)
+
+    def __contains__(self, node_id):
+        return node_id in self._graph.term_index
+
+    def __getitem__(self, node_id):
+        return self._graph.get_node_dict(self._graph.term_index[node_id])
+
+    def get(self, node_id, default=None):
+        term_idx = self._graph.term_index.get(node_id)
+        if term_idx is None:
+            return default
+        return self._graph.get_node_dict(term_idx)
+
+class CompactOboGraph(object):
+    """
+    Ontology is_a graph stored in numpy arrays.
+
+    Attributes:
+        term_ids (list): interned term id strings, indexed by integer term id
+        term_index (dict): {term id string : integer term id}
+        names (sequence): interned term names, None for terms that are only referenced as is_a targets
+        synonym_indptr (ndarray): synonyms of term i are synonyms[synonym_indptr[i]:synonym_indptr[i + 1]]
+        synonyms (sequence): interned raw synonym values, ex: '"soil" EXACT []'
+        parent_indptr, parent_indices (ndarray): is_a parents of term i are parent_indices[parent_indptr[i]:parent_indptr[i + 1]]
+        child_indptr, child_indices (ndarray): is_a children of term i, same layout as the parent arrays
+    """
+
+    def __init__(self, term_ids, names, synonym_indptr, synonyms, parent_indptr, parent_indices):
+        self.term_ids = term_ids
+        self.term_index = {term_id: i for i, term_id in enumerate(term_ids)}
+        self.names = names
+        self.synonym_indptr = synonym_indptr
+        self.synonyms = synonyms
+        self.parent_indptr = parent_indptr
+        self.parent_indices = parent_indices
+        self.child_indptr, self.child_indices = transpose_csr(parent_indptr, parent_indices, len(term_ids))
+        self.nodes = CompactNodeView(self)
+
+    @classmethod
+    def from_stanzas(cls, stanzas):
+        """
+        Build a compact graph from parsed obo stanzas.
+
+        :param stanzas (iterable): (stanza_type, entry) tuples from extract_obo_category_nodes.iter_obo_stanzas
+        :return graph (CompactOboGraph): graph of all Term stanzas and their is_a links
+        """
+        term_ids = []
+        term_index = {}
+        names = []
+        synonyms = []
+        synonym_counts = []
+        edge_children = array.array('i')
+        edge_parents = array.array('i')
+
+        def get_term_idx(term_id):
+            term_idx = term_index.get(term_id)
+            if term_idx is None:
+                term_idx = len(term_ids)
+                term_index[term_id] = term_idx
+                term_ids.append(sys.intern(term_id))
+                names.append(None)
+                synonym_counts.append(0)
+            return term_idx
+
+        # Synonyms are appended in stanza order, but a term referenced as an is_a target before its own stanza has
+        # already been numbered, so synonyms are grouped per term after parsing.
+        synonym_owners = array.array('i')
+
+        for stanza_type, entry in stanzas:
+            if stanza_type != 'Term' or 'id' not in entry:
+                continue
+
+            term_idx = get_term_idx(entry['id'][0])
+            if entry.get('name'):
+                names[term_idx] = sys.intern(entry['name'][0])
+
+            for synonym in entry.get('synonym', []):
+                synonyms.append(sys.intern(synonym))
+                synonym_owners.append(term_idx)
+                synonym_counts[term_idx] += 1
+
+            for target_term in entry.get('is_a', []):
+                edge_children.append(term_idx)
+                edge_parents.append(get_term_idx(target_term))
+
+        n_terms = len(term_ids)
+
+        synonym_order = np.argsort(np.frombuffer(synonym_owners, dtype=np.int32), kind='stable')
+        synonyms = [synonyms[i] for i in synonym_order]
+        synonym_indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(synonym_counts, out=synonym_indptr[1:])
+
+        parent_indptr, parent_indices = build_csr(np.frombuffer(edge_children, dtype=np.int32),
+                                                  np.frombuffer(edge_parents, dtype=np.int32), n_terms)
+
+        return cls(term_ids, names, synonym_indptr, synonyms, parent_indptr, parent_indices)
+
+    def number_of_nodes(self):
+        return len(self.term_ids)
+
+    def parents(self, term_idx):
+        """
+        :param term_idx (int): integer term id
+        :return (ndarray): integer ids of the term's is_a parents
+        """
+        return self.parent_indices[self.parent_indptr[term_idx]:self.parent_indptr[term_idx + 1]]
+
+    def children(self, term_idx):
+        """
+        :param term_idx (int): integer term id
+        :return (ndarray): integer ids of the term's is_a children
+        """
+        return self.child_indices[self.child_indptr[term_idx]:self.child_indptr[term_idx + 1]]
+
+    def get_node_dict(self, term_idx):
+        """
+        Build the networkx-style node dict of a term on demand.
+
+        :param term_idx (int): integer term id
+        :return node (dict): {'attr_dict': {'name': [name], 'synonym': [raw synonyms]}}, or {} if the term has no stanza
+        """
+        name = self.names[term_idx]
+        if name is None:
+            return {}
+
+        attr_dict = {'name': [name]}
+        term_synonyms = self.synonyms[self.synonym_indptr[term_idx]:self.synonym_indptr[term_idx + 1]]
+        if term_synonyms:
+            attr_dict['synonym'] = term_synonyms
+
+        return {'attr_dict': attr_dict}
+
+    def out_edges(self, node_id, keys=False):
+        """
+        networkx-style out edges of a node, i.e. its is_a links.
+
+        :param node_id (string): term id
+        :param keys (bool): if True, edges are (node_id, parent_id, 'is_a') tuples, otherwise (node_id, parent_id)
+        :return edges (list): is_a edges from node_id
+        """
+        parent_ids = [self.term_ids[i] for i in self.parents(self.term_index[node_id])]
+        if keys:
+            return [(node_id, parent_id, 'is_a') for parent_id in parent_ids]
+        return [(node_id, parent_id) for parent_id in parent_ids]
+
+    def successors(self, node_id):
+        return [self.term_ids[i] for i in self.parents(self.term_index[node_id])]
+
+    def predecessors(self, node_id):
+        return [self.term_ids[i] for i in self.children(self.term_index[node_id])]
+
+def build_csr(rows, columns, n_rows):
+    """
+    Build CSR-style adjacency arrays from an edge list.
+
+    :param rows (ndarray): integer source of each edge
+    :param columns (ndarray): integer target of each edge
+    :param n_rows (int): number of nodes
+    :return (tuple): (indptr, indices), targets of node i are indices[indptr[i]:indptr[i + 1]] in edge order
+    """
+    order = np.argsort(rows, kind='stable')
+    indices = np.asarray(columns, dtype=np.int32)[order]
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, indices
+
+def transpose_csr(indptr, indices, n_rows):
+    """
+    Reverse the direction of CSR adjacency arrays, ex: parent arrays -> child arrays.
+
+    :param indptr (ndarray): from build_csr
+    :param indices (ndarray): from build_csr
+    :param n_rows (int): number of nodes
+    :return (tuple): (indptr, indices) of the reversed edges
+    """
+    rows = np.repeat(np.arange(n_rows, dtype=np.int32), np.diff(indptr))
+    return build_csr(indices, rows, n_rows)
+
+class CompactAncestorIndex(object):
+    """
+    is_a ancestor closure of a CompactOboGraph stored as CSR-style arrays.  Behaves like the dict returned by
+    extract_obo_category_nodes.build_ancestor_index: get(node_id) returns a frozenset of ancestor term ids.
+    """
+
+    def __init__(self, graph, ancestor_indptr, ancestor_indices):
+        self.graph = graph
+        self.ancestor_indptr = ancestor_indptr
+        self.ancestor_indices = ancestor_indices
+
+    @classmethod
+    def from_ancestor_index(cls, graph, ancestor_index):
+        """
+        :param graph (CompactOboGraph): graph the index was built from
+        :param ancestor_index (dict): {node id : collection of ancestor node ids}, from build_ancestor_index
+        :return (CompactAncestorIndex): the same closure in array form
+        """
+        counts = np.zeros(graph.number_of_nodes(), dtype=np.int64)
+        indices = array.array('i')
+        for term_idx, term_id in enumerate(graph.term_ids):
+            ancestors = sorted(graph.term_index[i] for i in ancestor_index.get(term_id, ()))
+            counts[term_idx] = len(ancestors)
+            indices.extend(ancestors)
+
+        indptr = np.zeros(graph.number_of_nodes() + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(graph, indptr, np.frombuffer(indices, dtype=np.int32).copy())
+
+    def get_descendants(self, node_ids):
+        """
+        Find every term with at least one of the given terms among its ancestors, with a single scan of the closure.
+
+        :param node_ids (list): term ids
+        :return descendant_ids (list): term ids of descendants, in graph order
+        """
+        target_idxs = [self.graph.term_index[i] for i in node_ids if i in self.graph.term_index]
+        owners = np.repeat(np.arange(self.graph.number_of_nodes(), dtype=np.int32), np.diff(self.ancestor_indptr))
+        descendant_idxs = np.unique(owners[np.isin(self.ancestor_indices, target_idxs)])
+        return [self.graph.term_ids[i] for i in descendant_idxs]
+
+    def __len__(self):
+        return self.graph.number_of_nodes()
+
+    def __iter__(self):
+        return iter(self.graph.term_ids)
+
+    def __contains__(self, node_id):
+        return node_id in self.graph.term_index
+
+    def __getitem__(self, node_id):
+        term_idx = self.graph.term_index[node_id]
+        ancestors = self.ancestor_indices[self.ancestor_indptr[term_idx]:self.ancestor_indptr[term_idx + 1]]
+        return frozenset(self.graph.term_ids[i] for i in ancestors)
+
+    def get(self, node_id, default=None):
+        if node_id not in self.graph.term_index:
+            return default
+        return self[node_id]
+
+    def items(self):
+        return ((node_id, self[node_id]) for node_id in self.graph.term_ids)
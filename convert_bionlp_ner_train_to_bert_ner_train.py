@@ -1,15 +1,27 @@
-import numpy as np
-import pandas as pd
-import glob
-import scispacy
-import spacy
+import bisect
+import collections
+import importlib.util
+import itertools
+import json
+import multiprocessing
+import os
+import time
 import re
 import argparse
 
-parser = argparse.ArgumentParser(description="")
-parser.add_argument('bionlp_train_dir', help='Directory containing BioNLP NER train files.')
-parser.add_argument('bert_train_outfile', help='Path to write BERT NER train file to.')
-args = parser.parse_args()
+import pipeline_metrics
+from bionlp_corpus_index import load_corpus_manifest
+from sentence_break_cache import SentenceBreakCache
+
+# Conversion of BioNLP labels
+BERT_LABELS = {
+    'Microorganism': 'MORG',
+    'Habitat': 'HAB',
+    'Phenotype': 'PHE'
+}
+
+# Pipeline components that determine sentence boundaries.  All other components are disabled when segmenting.
+SENTENCE_BOUNDARY_COMPONENTS = ('tok2vec', 'parser', 'senter', 'sentencizer')
 
 def extract_and_merge_title_and_abstract(bionlp_lines):
     """
@@ -42,16 +54,58 @@ def extract_ent_lines(bionlp_lines):
 
     return ent_lines
 
-def get_sentence_break_indices(doc_text, nlp):
+def load_sentence_model(model_name='en_core_sci_md'):
     """
-    Using a scispacy model (trained on biomedical texts), identify the position of breaks between sentences in a text passage.
+    Load a spacy model for sentence segmentation, with every component that does not affect sentence boundaries
+    (tagger, lemmatizer, ner, ...) disabled.
 
-    :param doc_text (str): biomedical text passage.
-    :param nlp (spacy model): model to segment sentences with.
-    :return sentence_break_indices (list): positions in the text string of spaces between sentences.
+    :param model_name (str): name of an installed spacy/scispacy model
+    :return nlp (spacy model): model to segment sentences with
+    """
+    # spacy and scispacy take seconds to import, so they are only imported once a model is needed
+    with pipeline_metrics.stage('load_sentence_model'):
+        import scispacy
+        import spacy
+
+        nlp = spacy.load(model_name)
+
+    disabled = [name for name in nlp.pipe_names if name not in SENTENCE_BOUNDARY_COMPONENTS]
+    if disabled:
+        if hasattr(nlp, 'select_pipes'):
+            nlp.select_pipes(disable=disabled)
+        else:
+            nlp.disable_pipes(*disabled)
+
+    return nlp
+
+def get_sentence_model_key(model_name):
     """
+    Identify a sentence model by name and version from its meta.json, without importing spacy or loading the model,
+    ex: for SentenceBreakCache keys.
 
-    doc = nlp(doc_text)
+    :param model_name (str): name of an installed spacy/scispacy model, or path to a model directory
+    :return model_key (str): ex: 'en_core_sci_md==0.2.4 spacy>=2.1.0'
+    """
+    if os.path.isdir(model_name):
+        model_name = os.path.abspath(model_name)
+        model_path = model_name
+    else:
+        # Model packages keep meta.json next to their __init__.py
+        model_spec = importlib.util.find_spec(model_name)
+        if model_spec is None or not model_spec.origin:
+            raise OSError("Can't find spacy model '%s'." % model_name)
+        model_path = os.path.dirname(model_spec.origin)
+
+    with open(os.path.join(model_path, 'meta.json')) as f:
+        meta = json.load(f)
+
+    return '%s==%s spacy%s' % (model_name, meta.get('version'), meta.get('spacy_version', ''))
+
+def get_doc_sentence_break_indices(doc):
+    """
+    :param doc (spacy Doc): segmented biomedical text passage
+    :return sentence_break_indices (list): positions in the text string of spaces between sentences.
+    """
     sentence_break_indices = []
     idx = 0
     for sentence in doc.sents:
@@ -60,6 +114,110 @@ def get_sentence_break_indices(doc_text, nlp):
 
     return sentence_break_indices
 
+def get_sentence_break_indices(doc_text, nlp):
+    """
+    Using a scispacy model (trained on biomedical texts), identify the position of breaks between sentences in a text passage.
+
+    :param doc_text (str): biomedical text passage.
+    :param nlp (spacy model): model to segment sentences with.
+    :return sentence_break_indices (list): positions in the text string of spaces between sentences.
+    """
+    return get_doc_sentence_break_indices(nlp(doc_text))
+
+def iter_sentence_break_indices(doc_texts, nlp, batch_size=64, n_process=1):
+    """
+    Batched get_sentence_break_indices: segment many passages with nlp.pipe, optionally across several processes.
+
+    :param doc_texts (iterable): biomedical text passages
+    :param nlp (spacy model): model to segment sentences with
+    :param batch_size (int): number of passages per nlp.pipe batch
+    :param n_process (int): number of processes nlp.pipe segments with
+    :return: generator of sentence_break_indices lists, in the order of doc_texts
+    """
+    pipe_kwargs = {'batch_size': batch_size}
+    if n_process != 1:
+        pipe_kwargs['n_process'] = n_process
+
+    for doc in pipeline_metrics.iter_timed('segment_sentences', nlp.pipe(doc_texts, **pipe_kwargs)):
+        sentence_break_indices = get_doc_sentence_break_indices(doc)
+        pipeline_metrics.count('sentences', len(sentence_break_indices) + 1)
+        yield sentence_break_indices
+
+def iter_cached_sentence_break_indices(doc_texts, sentence_cache, nlp=None, model_name=None, batch_size=64,
+                                       n_process=1):
+    """
+    iter_sentence_break_indices backed by a SentenceBreakCache: only passages missing from the cache are segmented, and
+    their sentence breaks are added to it.
+
+    The model is only loaded once a passage is missing from the cache, so a fully cached conversion never loads it.
+    Passages found in the cache while earlier ones wait in an nlp.pipe batch are held until that batch is segmented.
+
+    :param doc_texts (iterable): biomedical text passages
+    :param sentence_cache (SentenceBreakCache): cache of sentence breaks for the model
+    :param nlp (spacy model): model to segment sentences with, or None to load model_name when first needed
+    :param model_name (str): name of an installed spacy/scispacy model, used if nlp is None
+    :param batch_size (int): number of passages per nlp.pipe batch
+    :param n_process (int): number of processes nlp.pipe segments with
+    :return: generator of sentence_break_indices lists, in the order of doc_texts
+    """
+    doc_texts = iter(doc_texts)
+    # [key, sentence breaks or None] of passages read but not yet yielded, in order
+    pending = collections.deque()
+
+    def iter_uncached_texts(first_text):
+        yield first_text
+        for doc_text in doc_texts:
+            key = sentence_cache.get_key(doc_text)
+            pending.append([key, sentence_cache.get(key)])
+            if pending[-1][1] is None:
+                yield doc_text
+
+    for doc_text in doc_texts:
+        key = sentence_cache.get_key(doc_text)
+        sentence_break_indices = sentence_cache.get(key)
+        if sentence_break_indices is not None:
+            yield sentence_break_indices
+            continue
+
+        # First uncached passage: segment it and every later uncached passage in a single nlp.pipe stream
+        if nlp is None:
+            nlp = load_sentence_model(model_name)
+        pending.append([key, None])
+        for sentence_break_indices in iter_sentence_break_indices(iter_uncached_texts(doc_text), nlp,
+                                                                  batch_size=batch_size, n_process=n_process):
+            while pending[0][1] is not None:
+                yield pending.popleft()[1]
+            key, _ = pending.popleft()
+            sentence_cache.put(key, sentence_break_indices)
+            yield sentence_break_indices
+
+        while pending:
+            yield pending.popleft()[1]
+
+def parse_ent_line(ent_line):
+    """
+    Parse a BioNLP entity annotation line.  Discontinuous entities list several start/end fragments separated by ';'.
+
+    Ex:
+        'T3\tHabitat 10 17;25 30\tgut of mice' -> ('Habitat', [(10, 17), (25, 30)])
+
+    :param ent_line (str): entity annotation line (from extract_ent_lines function)
+    :return (tuple): (BioNLP label, list of (start, end) fragments), or None if the line is not a text-bound annotation
+    """
+    fields = ent_line.split('\t')
+    if len(fields) < 2 or not fields[0].startswith('T'):
+        return None
+
+    label, _, offsets = fields[1].partition(' ')
+    fragments = []
+    for fragment in offsets.split(';'):
+        start_end = fragment.split()
+        if len(start_end) != 2:
+            return None
+        fragments.append((int(start_end[0]), int(start_end[1])))
+
+    return label, fragments
+
 def convert_bionlp_abstract_to_bert_train_format(passage_text, ent_lines, sentence_break_indices):
     """
     Convert the BioNLP NER annotation format into BERT NER annotation format.
@@ -71,181 +229,479 @@ def convert_bionlp_abstract_to_bert_train_format(passage_text, ent_lines, senten
         produced	I-PHE
         by	O
 
+    Words are aligned to entities by offset: a word belongs to an entity if it starts inside one of the entity's
+    fragments, so discontinuous entities only label the words of their fragments.  Where entities overlap, a word keeps
+    the label of the entity that starts first (the longest one if they start at the same word).  Word starts are
+    searched with bisect and sentence breaks are held in a set, so conversion is linear in passage length.
+
     :param passage_text (str): Biomedical text passage
     :param ent_lines (list): Lines specifying an entity annotation (from extract_ent_lines function)
     :param sentence_break_indices (list): Index positions of spaces between sentences in the passage_text string (from get_sentence_break_indices)
     :return out_lines (list): Lines in BERT NER annotation format
     """
+    words = [word for word in passage_text.split(' ') if word]
 
-    #Conversion of BioNLP labels
-    label_dict = {
-        'Microorganism': 'MORG',
-        'Habitat': 'HAB',
-        'Phenotype': 'PHE'
-    }
-
-    ent_dict = {}
+    # Start position of each word in passage_text
+    word_starts = []
+    abstract_idx = 0
+    for word in words:
+        word_starts.append(abstract_idx)
+        abstract_idx += len(word) + 1
 
-    """
-    Parse ent_lines into ent_dict, 1 entry per token: {
-        start index of token in passage_text str: 
-            { 
-             'end' : end index of token in passage_text string,
-             'token' : token (word or symbol),
-             'label' : BERT label from label dict, preceded by B- (first token) or I- (second or later token)
-            }
-        }            
-    """
+    entities = []
     for ent_line in ent_lines:
-        label_start_end = ent_line.split('\t')[1].split(' ')
-        label = label_start_end[0]
-        start = label_start_end[1]
-        end = label_start_end[-1]
-        bert_label = label_dict[label]
-
-        start = int(start)
-        end = int(end)
-
-        # Abbreviated bacteria names have tokens separated by u'\xa0'
-        ent_line = ent_line.replace(u'\xa0', ' ')
-
-        ent_tokens = ent_line.split('\t')[2].split(' ')
-
-        #first token of entity
-        ent_dict[start] = {
-            'end': end,
-            'token': ent_tokens[0],
-            'label': 'B-%s' % bert_label
-        }
-        idx = start + len(ent_tokens[0]) + 1
-
-        #Tokens after first token of entity
-        for token in ent_tokens[1:]:
-            ent_dict[idx] = {
-                'end': idx + len(token),
-                'token': token,
-                'label': 'I-%s' % bert_label
-            }
-            idx += len(token) + 1
-
+        parsed_ent = parse_ent_line(ent_line)
+        if parsed_ent and parsed_ent[0] in BERT_LABELS:
+            label, fragments = parsed_ent
+            entities.append((fragments[0][0], -fragments[-1][1], BERT_LABELS[label], fragments))
+
+    word_labels = [None] * len(words)
+    for _, _, bert_label, fragments in sorted(entities):
+        prefix = 'B'
+        for start, end in fragments:
+            for word_idx in range(bisect.bisect_left(word_starts, start), bisect.bisect_left(word_starts, end)):
+                if word_labels[word_idx] is None:
+                    word_labels[word_idx] = '%s-%s' % (prefix, bert_label)
+                    prefix = 'I'
+
+    sentence_breaks = set(sentence_break_indices)
     out_lines = []
-    abstract_idx = 0
 
     """
     Iterate through words of passage_text string, generating 1 line per word.
     
     Non-entity tokens are labeled 'O', entities are labeled 'B-<label>' (first token of entity) or 'I-<label>' (second or later token of entity)
     """
-    for word in passage_text.split(' '):
-        if word:
-            ent = ent_dict.get(abstract_idx)
-            end = abstract_idx + len(word) + 1
-
-            if ent:
-                out_label = ent['label']
-            else:
-                out_label = 'O'
-
-            """
-            If a word ends in a period and is the last word of a sentence, generate two lines: 1 for the word, 1 for the period.
-            
-            Otherwise, generate 1 line for the word.
-            """
-            if word[-1] == '.' and end in sentence_break_indices:
-                out_lines.append('%s\t%s\n' % (word[:-1], out_label))
-                out_lines.append('%s\tO\n' % (word[-1]))
-            else:
-                out_lines.append('%s\t%s\n' % (word, out_label))
-
-            abstract_idx += len(word) + 1
-            if abstract_idx in sentence_break_indices:
-                out_lines.append('\n')
+    for word, word_start, out_label in zip(words, word_starts, word_labels):
+        out_label = out_label or 'O'
+        end = word_start + len(word) + 1
+
+        """
+        If a word ends in a period and is the last word of a sentence, generate two lines: 1 for the word, 1 for the period.
+        
+        Otherwise, generate 1 line for the word.
+        """
+        if word[-1] == '.' and end in sentence_breaks:
+            out_lines.append('%s\t%s\n' % (word[:-1], out_label))
+            out_lines.append('%s\tO\n' % (word[-1]))
+        else:
+            out_lines.append('%s\t%s\n' % (word, out_label))
+
+        if end in sentence_breaks:
+            out_lines.append('\n')
 
     return out_lines
 
-def generate_article_train_lines(article_text, bionlp_lines, nlp):
+def generate_article_train_lines(article_text, bionlp_lines, nlp, sentence_break_indices=None):
     """
     Convert a single BioNLP annotated title+abstract or body passage into BERT NER training format.
 
     :param article_text (str): Biomedical text passage
     :param bionlp_lines (list): BioNLP annotation lines
     :param nlp (spacy model): model to segment sentences with
+    :param sentence_break_indices (list): sentence breaks of article_text, if already computed (ex: by iter_sentence_break_indices)
     :return article_train_lines (list): BERT NER annotation lines
     """
 
     ent_lines = extract_ent_lines(bionlp_lines)
-    sentence_break_indices = get_sentence_break_indices(article_text, nlp)
+    if sentence_break_indices is None:
+        sentence_break_indices = get_sentence_break_indices(article_text, nlp)
     article_text = article_text.replace(u'\xa0', ' ')
-    article_train_lines = convert_bionlp_abstract_to_bert_train_format(article_text, ent_lines, sentence_break_indices)
+    with pipeline_metrics.stage('convert_bert_format'):
+        article_train_lines = convert_bionlp_abstract_to_bert_train_format(article_text, ent_lines,
+                                                                           sentence_break_indices)
     return article_train_lines
 
-if __name__ == "__main__":
-    nlp = spacy.load('en_core_sci_md')
+def read_abstract_file_pair(txt_file, ann_file):
+    """
+    Read a title/abstract document (Format 1): text from the Title/Paragraph lines of the .a1 file, entities from the .a2 file.
 
-    out_file = args.bert_train_outfile
+    :return (tuple): (merged title and abstract text, annotation lines)
+    """
+    with open(ann_file) as f:
+        bionlp_lines = f.readlines()
+
+    with open(txt_file) as f:
+        abstr_text = ' '.join([i.split('\t')[2].strip() for i in f.readlines()])
 
+    return abstr_text, bionlp_lines
+
+def read_passage_file_pair(txt_file, ann_file):
     """
-    BioNLP NER annotation files exist in 2 formats:
-        
-        Format 1:
-            <BB-norm-PMID> - Single .a1 file contains labeled Title and/or Abstract followed by lines with entity annotations.
-        Format 2:
-            <BB-norm-F-PMID-NNN> - Pairs of txt files (containing the text passage) and .a1 files (containing entity annotations)
-    
-    Regex patterns are used to differentiate the two formats, and pair up the text and a1 files for Format 2.
+    Read a body passage document (Format 2): text from the .txt file, entities from the annotation file.
+
+    :return (tuple): (passage text, annotation lines)
     """
-    bionlp_train_files = glob.glob('%s*a1' % args.bionlp_train_dir)
-    text_files = glob.glob('%s*txt' % args.bionlp_train_dir)
+    with open(ann_file) as f:
+        bionlp_lines = f.readlines()
 
-    pm_abstr_a1_pattern = re.compile(r'BB-norm\+ner\-\w+.a1')
-    pm_abstr_a2_pattern = re.compile(r'BB-norm\+ner\-\w+.a2')
+    with open(txt_file) as f:
+        passage_text = ' '.join([i.strip() for i in f.readlines()])
 
-    pm_passage_a1_pattern = re.compile(r'BB-norm\+ner-F\-\w+\-\w{3}.a1')
-    pm_passage_a2_pattern = re.compile(r'BB-norm\+ner-F\-\w+\-\w{3}.a2')
-    pm_passage_txt_pattern = re.compile(r'BB-norm\+ner-F\-\w+\-\w{3}.txt')
+    return passage_text, bionlp_lines
 
-    abstr_txt_files = sorted(list(filter(pm_abstr_a1_pattern.search, bionlp_train_files)))
-    abstr_ann_files = sorted(list(filter(pm_abstr_a2_pattern.search, bionlp_train_files)))
+def iter_article_files(abstr_file_tuples, passage_file_tuples, skip_sources=()):
+    """
+    List BioNLP documents to convert, without reading them.
 
-    passage_txt_files = sorted(list(filter(pm_passage_txt_pattern.search, text_files)))
-    passage_ann_files = sorted(list(filter(pm_passage_a2_pattern.search, bionlp_train_files)))
+    :param abstr_file_tuples (list): (a1 file, a2 file) pairs of title/abstract documents
+    :param passage_file_tuples (list): (txt file, annotation file) pairs of body passage documents
+    :param skip_sources (set): source ids (text file names) of documents to skip, ex: already converted ones
+    :return: generator of (source id, read function, text file, annotation file) tuples
+    """
+    for read_function, file_tuples in [(read_abstract_file_pair, abstr_file_tuples),
+                                       (read_passage_file_pair, passage_file_tuples)]:
+        for txt_file, ann_file in file_tuples:
+            source_id = os.path.basename(txt_file)
+            if source_id not in skip_sources:
+                yield source_id, read_function, txt_file, ann_file
+
+def iter_articles(abstr_file_tuples, passage_file_tuples, skip_sources=()):
+    """
+    Lazily read BioNLP documents, one at a time.
 
-    bert_train_lines = []
+    :param abstr_file_tuples (list): (a1 file, a2 file) pairs of title/abstract documents
+    :param passage_file_tuples (list): (txt file, annotation file) pairs of body passage documents
+    :param skip_sources (set): source ids (text file names) of documents to skip, ex: already converted ones
+    :return: generator of (source id, article text, annotation lines) tuples
+    """
+    for source_id, read_function, txt_file, ann_file in iter_article_files(abstr_file_tuples, passage_file_tuples,
+                                                                           skip_sources):
+        article_text, bionlp_lines = read_function(txt_file, ann_file)
+        yield source_id, article_text, bionlp_lines
 
-    usable_files = 0
-    unusable_files = []
+def iter_article_train_lines(articles, nlp, batch_size=64, n_process=1, sentence_cache=None, model_name=None):
+    """
+    Convert a stream of documents into BERT NER lines, segmenting sentences in nlp.pipe batches.
 
-    # Title/abstract files
-    abstr_file_tuples = list(zip(sorted(abstr_txt_files), sorted(abstr_ann_files)))
+    Only the documents in the current nlp.pipe batch are held in memory.
 
-    for abstr_file_tuple in abstr_file_tuples:
-        txt_file, ann_file = abstr_file_tuple
+    :param articles (iterable): (source id, article text, annotation lines) tuples, ex: from iter_articles
+    :param nlp (spacy model): model to segment sentences with, or None to load model_name on the first passage missing from sentence_cache
+    :param batch_size (int): number of passages per nlp.pipe batch
+    :param n_process (int): number of processes nlp.pipe segments with
+    :param sentence_cache (SentenceBreakCache): cache of sentence breaks to read and update, or None to segment every passage
+    :param model_name (str): name of an installed spacy/scispacy model, used if nlp is None
+    :return: generator of (source id, BERT NER annotation lines) tuples
+    """
+    articles, article_texts = itertools.tee(articles)
+    if sentence_cache is not None:
+        article_sentence_breaks = iter_cached_sentence_break_indices((text for _, text, _ in article_texts),
+                                                                     sentence_cache, nlp=nlp, model_name=model_name,
+                                                                     batch_size=batch_size, n_process=n_process)
+    else:
+        article_sentence_breaks = iter_sentence_break_indices((text for _, text, _ in article_texts), nlp,
+                                                              batch_size=batch_size, n_process=n_process)
+
+    for (source_id, article_text, bionlp_lines), sentence_break_indices in zip(articles, article_sentence_breaks):
+        yield source_id, generate_article_train_lines(article_text, bionlp_lines, nlp, sentence_break_indices)
+
+# Sentence model and sentence break cache of a conversion worker process, set up once by init_conversion_worker
+worker_nlp = None
+worker_model_name = None
+worker_sentence_cache = None
+
+def init_conversion_worker(model_name, sentence_cache_path=None, model_key=None):
+    """
+    Process pool initializer: load the sentence model once per worker.  With a sentence break cache, the model is only
+    loaded once the worker gets a passage missing from the cache.
 
-        with open(ann_file) as f:
-            bionlp_lines = f.readlines()
+    :param model_name (str): name of an installed spacy/scispacy model
+    :param sentence_cache_path (str): path to SentenceBreakCache file to read from, or None
+    :param model_key (str): sentence model key of the cache, from get_sentence_model_key
+    """
+    global worker_nlp, worker_model_name, worker_sentence_cache
+    worker_model_name = model_name
+    if sentence_cache_path:
+        worker_sentence_cache = SentenceBreakCache(sentence_cache_path, model_key)
+    else:
+        worker_nlp = load_sentence_model(model_name)
+
+def convert_article_file(article_file):
+    """
+    Read and convert one document in a worker process.
 
-        with open(txt_file) as f:
-            abstr_text = ' '.join([i.split('\t')[2].strip() for i in f.readlines()])
+    Workers only read the sentence break cache.  The key and sentence breaks of each passage are returned so the main
+    process can update the cache.
 
-        bert_train_lines += generate_article_train_lines(abstr_text, bionlp_lines, nlp)
+    :param article_file (tuple): (source id, read function, text file, annotation file), from iter_article_files
+    :return (tuple): (source id, BERT NER annotation lines, worker process id, seconds spent, cache key or None,
+                      sentence breaks, True if the sentence breaks came from the cache)
+    """
+    global worker_nlp
+    start = time.perf_counter()
+    source_id, read_function, txt_file, ann_file = article_file
+    article_text, bionlp_lines = read_function(txt_file, ann_file)
+
+    key = None
+    sentence_break_indices = None
+    if worker_sentence_cache is not None:
+        key = worker_sentence_cache.get_key(article_text)
+        sentence_break_indices = worker_sentence_cache.get(key, mark_used=False)
+    cached = sentence_break_indices is not None
+
+    if not cached:
+        if worker_nlp is None:
+            worker_nlp = load_sentence_model(worker_model_name)
+        sentence_break_indices = get_sentence_break_indices(article_text, worker_nlp)
+
+    article_train_lines = generate_article_train_lines(article_text, bionlp_lines, worker_nlp, sentence_break_indices)
+
+    return (source_id, article_train_lines, os.getpid(), time.perf_counter() - start, key, sentence_break_indices,
+            cached)
+
+def iter_article_train_lines_parallel(article_files, model_name, workers, worker_stats, chunksize=4,
+                                      sentence_cache=None):
+    """
+    Convert documents in a pool of worker processes, each with its own copy of the sentence model.
 
-    # Select passage files
-    passage_file_tuples = list(zip(sorted(passage_txt_files), sorted(passage_ann_files)))
+    Results are yielded in the order of article_files, so output is identical to the serial conversion.
 
-    for passage_file_tuple in passage_file_tuples:
-        txt_file, ann_file = passage_file_tuple
+    :param article_files (iterable): (source id, read function, text file, annotation file), from iter_article_files
+    :param model_name (str): name of an installed spacy/scispacy model
+    :param workers (int): number of worker processes
+    :param worker_stats (dict): filled with {worker process id : {'documents', 'lines', 'seconds'}}
+    :param chunksize (int): number of documents sent to a worker at a time
+    :param sentence_cache (SentenceBreakCache): cache of sentence breaks to read and update, or None to segment every passage
+    :return: generator of (source id, BERT NER annotation lines) tuples
+    """
+    initargs = (model_name,)
+    if sentence_cache is not None:
+        # Buffered entries must be written before workers open the cache
+        sentence_cache.flush()
+        initargs = (model_name, sentence_cache.cache_path, sentence_cache.model_key)
+
+    pool = multiprocessing.Pool(workers, initializer=init_conversion_worker, initargs=initargs)
+    try:
+        for source_id, lines, pid, seconds, key, sentence_break_indices, cached in pool.imap(
+                convert_article_file, article_files, chunksize=chunksize):
+            stats = worker_stats.setdefault(pid, {'documents': 0, 'lines': 0, 'seconds': 0.0})
+            stats['documents'] += 1
+            stats['lines'] += len(lines)
+            stats['seconds'] += seconds
+
+            if sentence_cache is not None:
+                if cached:
+                    sentence_cache.hits += 1
+                    sentence_cache.mark_used(key)
+                else:
+                    sentence_cache.misses += 1
+                    sentence_cache.put(key, sentence_break_indices)
+
+            yield source_id, lines
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def read_checkpoint(checkpoint_path):
+    """
+    Read a conversion checkpoint written by write_article_train_lines.
 
-        with open(ann_file) as f:
-            bionlp_lines = f.readlines()
+    :param checkpoint_path (str): path to checkpoint file
+    :return (tuple): (set of source ids already written, output file size in bytes after the last of them)
+    """
+    completed_sources = set()
+    out_file_offset = 0
+
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                # A line cut short by a crash is ignored, its offset may be missing digits
+                if line.endswith('\n') and len(fields) == 2 and fields[1].isdigit():
+                    completed_sources.add(fields[0])
+                    out_file_offset = int(fields[1])
+
+    return completed_sources, out_file_offset
+
+def write_article_train_lines(article_train_lines, out_path, checkpoint_path=None, resume_offset=None,
+                              buffer_size=1 << 20):
+    """
+    Write BERT NER lines to a file as each document is converted.
+
+    If a checkpoint path is given, each document's source id and the output file size after it are appended to the
+    checkpoint once the document's lines are flushed, so an interrupted conversion can be resumed.
+
+    :param article_train_lines (iterable): (source id, lines) tuples, ex: from iter_article_train_lines
+    :param out_path (str): path to write BERT NER train file to
+    :param checkpoint_path (str): path of checkpoint file to append to, or None for no checkpoint
+    :param resume_offset (int): if given, append to out_path after truncating it to this size (from read_checkpoint),
+                              raises ValueError if out_path is missing or shorter
+    :param buffer_size (int): write buffer size in bytes
+    :return n_articles (int): number of documents written
+    """
+    if resume_offset is not None:
+        if not os.path.exists(out_path) or os.path.getsize(out_path) < resume_offset:
+            raise ValueError("Cannot resume: %s is missing or shorter than the %d bytes of its checkpoint." % (
+                out_path, resume_offset))
+        # Drop lines of a document that was only partly written before the interruption
+        os.truncate(out_path, resume_offset)
+        out_mode = 'a'
+    else:
+        out_mode = 'w'
+
+    checkpoint_file = None
+    if checkpoint_path:
+        checkpoint_ends_record = True
+        if out_mode == 'a' and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'rb') as f:
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    checkpoint_ends_record = f.read(1) == b'\n'
+        checkpoint_file = open(checkpoint_path, out_mode)
+        # Terminate a record cut short by the interruption, so it stays separate from the next one
+        if not checkpoint_ends_record:
+            checkpoint_file.write('\n')
+
+    n_articles = 0
+    try:
+        with open(out_path, out_mode, encoding='utf-8', buffering=buffer_size) as f:
+            for source_id, lines in article_train_lines:
+                with pipeline_metrics.stage('write_lines'):
+                    f.writelines(lines)
+                n_articles += 1
+                # Sentences are separated by empty lines, every other line is a token
+                pipeline_metrics.count('tokens_emitted', len(lines) - lines.count('\n'))
+
+                if checkpoint_file:
+                    f.flush()
+                    checkpoint_file.write('%s\t%d\n' % (source_id, f.tell()))
+                    checkpoint_file.flush()
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    return n_articles
+
+def main():
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument('bionlp_train_dir', help='Directory containing BioNLP NER train files.')
+    parser.add_argument('bert_train_outfile', help='Path to write BERT NER train file to.')
+    parser.add_argument('--spacy_model', default='en_core_sci_md', help='scispacy model to segment sentences with.')
+    parser.add_argument('--batch_size', type=int, default=64, help='Number of passages per nlp.pipe batch.')
+    parser.add_argument('--n_process', type=int, default=1, help='Number of processes to segment sentences with.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes converting documents.  Each loads its own copy of the model.  1 converts serially.')
+    parser.add_argument('--manifest_cache',
+                        help='Path to json file caching the corpus file manifest.  Rebuilt when files are added, removed or renamed.')
+    parser.add_argument('--sentence_cache',
+                        help='Path to SQLite file caching sentence breaks by passage text and model version.  Passages found in it are not segmented again, and the model is not loaded if all are.')
+    parser.add_argument('--sentence_cache_size', type=int, default=1000000,
+                        help='Maximum number of passages kept in --sentence_cache.  Least recently used passages are evicted first.')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='Record converted documents in <bert_train_outfile>.checkpoint as they are written.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted --checkpoint conversion, skipping documents already written.')
+    parser.add_argument('--vocab_file',
+                        help='BERT vocab file.  With --shard_dir, the output is also written as pre-tokenized NumPy shards (see bert_ner_shards.py).')
+    parser.add_argument('--shard_dir', help='Directory to write pre-tokenized shards, label_map.json and shards.json to.')
+    parser.add_argument('--max_seq_length', type=int, default=128,
+                        help='Most tokens per shard example, including [CLS] and [SEP].  Longer sentences are split.')
+    parser.add_argument('--shard_size', type=int, default=4096, help='Number of examples per shard.')
+    parser.add_argument('--do_lower_case', action='store_true', help='Lower-case words when tokenizing, for uncased vocabs.')
+    pipeline_metrics.add_profile_arguments(parser)
+    args = parser.parse_args()
+    if bool(args.vocab_file) != bool(args.shard_dir):
+        parser.error("--vocab_file and --shard_dir are used together.")
+
+    profiler = pipeline_metrics.start_run(args)
 
-        with open(txt_file) as f:
-            passage_text = ' '.join([i.strip() for i in f.readlines()])
+    out_file = args.bert_train_outfile
 
-        bert_train_lines += generate_article_train_lines(passage_text, bionlp_lines, nlp)
+    """
+    BioNLP NER annotation files exist in 2 formats:
+        
+        Format 1:
+            <BB-norm+ner-PMID> - .a1 file contains labeled Title and/or Abstract, .a2 file contains entity annotations.
+        Format 2:
+            <BB-norm+ner-F-PMID-NNN> - Pairs of txt files (containing the text passage) and .a2 files (containing entity annotations)
+    
+    The corpus indexer pairs the files of each document by document ID and reports documents with missing files.
+    """
+    with pipeline_metrics.stage('load_corpus_manifest'):
+        documents, orphans = load_corpus_manifest(args.bionlp_train_dir, cache_path=args.manifest_cache)
 
-    print("Directory contains %d Title/Abstract files." % len(abstr_files))
+    # Title/abstract files
+    abstr_file_tuples = [(i.text_file, i.ann_file) for i in documents if i.kind == 'abstract']
+
+    # Select passage files
+    passage_file_tuples = [(i.text_file, i.ann_file) for i in documents if i.kind == 'passage']
+
+    print("Directory contains %d Title/Abstract files." % len(abstr_file_tuples))
     print("Directory contains %d body passage files." % len(passage_file_tuples))
+    if orphans:
+        print("Skipping %d unpaired or unrecognized files:" % len(orphans))
+        for orphan in orphans:
+            print("    %s (%s)" % orphan)
+
+    checkpoint_path = None
+    completed_sources = set()
+    resume_offset = None
+    if args.checkpoint or args.resume:
+        checkpoint_path = '%s.checkpoint' % out_file
+    if args.resume:
+        completed_sources, resume_offset = read_checkpoint(checkpoint_path)
+        if not os.path.exists(out_file) or os.path.getsize(out_file) < resume_offset:
+            # The documents of the checkpoint are not all in the output, so none of them can be skipped
+            print("%s is missing or shorter than its checkpoint, converting all documents." % out_file)
+            completed_sources, resume_offset = set(), None
+        else:
+            print("Resuming after %d converted documents." % len(completed_sources))
+
+    start = time.perf_counter()
+    sentence_cache = None
+    if args.sentence_cache:
+        sentence_cache = SentenceBreakCache(args.sentence_cache, get_sentence_model_key(args.spacy_model),
+                                            max_entries=args.sentence_cache_size)
+
+    worker_stats = {}
+    if args.workers > 1:
+        article_files = iter_article_files(abstr_file_tuples, passage_file_tuples, skip_sources=completed_sources)
+        article_train_lines = iter_article_train_lines_parallel(article_files, args.spacy_model, args.workers,
+                                                                worker_stats, sentence_cache=sentence_cache)
+    else:
+        # With a sentence cache, the model is loaded on the first uncached passage
+        nlp = None if sentence_cache else load_sentence_model(args.spacy_model)
+        articles = iter_articles(abstr_file_tuples, passage_file_tuples, skip_sources=completed_sources)
+        article_train_lines = iter_article_train_lines(articles, nlp, batch_size=args.batch_size,
+                                                       n_process=args.n_process, sentence_cache=sentence_cache,
+                                                       model_name=args.spacy_model)
+    try:
+        n_articles = write_article_train_lines(article_train_lines, out_file, checkpoint_path=checkpoint_path,
+                                               resume_offset=resume_offset)
+    finally:
+        if sentence_cache:
+            sentence_cache.close()
+    elapsed = time.perf_counter() - start
+    pipeline_metrics.count('documents', n_articles)
+
+    print("Wrote %d documents to %s in %.1fs (%.1f documents/sec)." % (
+        n_articles, out_file, elapsed, n_articles / elapsed if elapsed else 0))
+    if sentence_cache:
+        print("Sentence cache: %d passages cached, %d segmented." % (sentence_cache.hits, sentence_cache.misses))
+        pipeline_metrics.count('sentence_cache_hits', sentence_cache.hits)
+        pipeline_metrics.count('sentence_cache_misses', sentence_cache.misses)
+    for pid, stats in sorted(worker_stats.items()):
+        print("Worker %d: %d documents, %d lines, %.1fs busy (%.1f documents/sec)" % (
+            pid, stats['documents'], stats['lines'], stats['seconds'],
+            stats['documents'] / stats['seconds'] if stats['seconds'] else 0))
+        # Stages of worker processes are not recorded, only their busy time.  It is summed over workers, so it can exceed
+        # the run time.
+        pipeline_metrics.metrics.add_time('worker_convert_article_file', stats['seconds'], calls=stats['documents'])
+
+    if args.shard_dir:
+        # Imported here, bert_ner_shards imports this script
+        from bert_ner_shards import write_bert_ner_shards
+
+        print("Writing pre-tokenized shards to %s..." % args.shard_dir)
+        manifest = write_bert_ner_shards(out_file, args.vocab_file, args.shard_dir,
+                                         max_seq_length=args.max_seq_length, shard_size=args.shard_size,
+                                         do_lower_case=args.do_lower_case)
+        print("Wrote %d examples of %d sentences to %d shards." % (
+            manifest['n_examples'], manifest['n_sentences'], len(manifest['shards'])))
+
+    pipeline_metrics.finish_run(args, profiler)
 
-    with open(out_file, 'w') as f:
-        for line in bert_train_lines:
-            f.write(line)
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 import json
-import itertools
+import os
 import re
-import networkx
+import time
 import argparse
 
+import pipeline_metrics
+
 """
 This script is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
 
@@ -13,16 +15,41 @@ https://drive.google.com/file/d/1G0po_xlRjQCZ-qxuA_4PLdipXU6rtYTp/view
 This script contains functions to extract nodes linked to a specified concept/category from an obo file into a graph object,
 convert the graph into a dict, and dump the dict to a json file. 
 
+Several categories can be extracted from one parse of the obo file:
+    python extract_obo_category_nodes.py OntoBiotope.obo --categories microbial_habitat phenotype --out_dir dicts/
+
+--compact_out_dir also writes each category dict in the memory-mappable format of compact_dictionary.py.
+
+--profile writes the time spent in each stage (parsing, ancestor index, category traversal, dict conversion, json
+serialization), counters and peak memory to a json file (see pipeline_metrics.py).
+
 To-do:
-    -Add ability to extract by a list of categories
     -Add functions to visualize paths between graph nodes
     -Add handling for non-exact synonyms
 """
-parser = argparse.ArgumentParser(description="Extract all terms linked to specified concept in obo format file and dump them to a json file.")
-parser.add_argument('obo_file_path', help='Path to .obo format file')
-parser.add_argument('category', help='Name of category/parent/concept node.  All extracted nodes will be linked to this node.  Ex: "microbial habitats"')
-parser.add_argument('out_file', help='Name of json file to dump dict of extracted nodes to.')
-args = parser.parse_args()
+
+# Regex pattern for parsing obo format from https://github.com/cmungall/obo/blob/master/obo/read.py
+OBO_ENTRY_LINE_PATTERN = re.compile(
+    r'^(?P<key>.+?): *(?P<value>.+?) ?(?P<trailing_modifier>(?<!\\)\{.*?(?<!\\)\})? ?(?P<comment>(?<!\\)!.*?)?$')
+
+# Synonym values, ex: '"soil" EXACT []'
+OBO_ENTRY_SYNONYM_PATTERN = re.compile(r'(\"[ \w|\W+]+\") ([A-Z]+) (\[[a-zA-Z]*\:*[0-9]*\])')
+
+def parse_obo_line(line):
+    """
+    Split a tag-value line from an obo file into its key and value, dropping trailing modifiers and comments.
+
+    :param line (string): line from .obo file, ex: 'is_a: OBT:000001 ! root'
+    :return (tuple): (key, value), or None if the line is a comment or is not a tag-value pair
+    """
+    if line.startswith('!'):
+        return None
+
+    regex_match = OBO_ENTRY_LINE_PATTERN.match(line)
+    if not regex_match:
+        return None
+
+    return regex_match.group('key'), regex_match.group('value')
 
 def parse_obo_entry(entry_lines):
     """
@@ -31,84 +58,320 @@ def parse_obo_entry(entry_lines):
     :return: entry (dict), each regex match in the term is a key/value entry
     """
     entry_type = next(entry_lines)
-    entry_lines = list(entry_lines)
     entry = dict()
 
-    # Regex pattern for parsing obo format from https://github.com/cmungall/obo/blob/master/obo/read.py
-    obo_entry_line_pattern = re.compile(
-        r'^(?P<key>.+?): *(?P<value>.+?) ?(?P<trailing_modifier>(?<!\\)\{.*?(?<!\\)\})? ?(?P<comment>(?<!\\)!.*?)?$')
-
     #Verify entry is a Term, regex match key and value, and add it to dict
     if entry_type.startswith('[Term]'):
         for line in entry_lines:
-            if line.startswith('!'):
-                continue
-            regex_match = re.match(obo_entry_line_pattern, line)
-            key = regex_match.group('key')
-            value = regex_match.group('value')
-            entry.setdefault(key, []).append(value)
+            key_value = parse_obo_line(line)
+            if key_value:
+                key, value = key_value
+                entry.setdefault(key, []).append(value)
 
     return entry
 
+def iter_obo_stanzas(obo_file):
+    """
+    Lazily parse the stanzas of an open obo file, one line at a time.
+
+    Only the stanza being read is held in memory.  Header tag-value lines (before the first stanza) are skipped.
+
+    Ex:
+        [Term]
+        id: OBT:000002
+        is_a: OBT:000001 ! root
+
+        -> ('Term', {'id': ['OBT:000002'], 'is_a': ['OBT:000001']})
+
+    :param obo_file (file): open .obo file, or any iterable of lines
+    :return: generator of (stanza_type, entry) tuples, stanza_type is 'Term', 'Typedef' or 'Instance' and entry is a dict
+        of tag : list of values
+    """
+    stanza_type = None
+    entry = None
+    n_stanzas = 0
+
+    for line in obo_file:
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('[') and line.endswith(']'):
+            if entry is not None:
+                yield stanza_type, entry
+            n_stanzas += 1
+            stanza_type = line[1:-1]
+            entry = dict()
+            continue
+
+        if entry is None:
+            continue
+
+        key_value = parse_obo_line(line)
+        if key_value:
+            key, value = key_value
+            entry.setdefault(key, []).append(value)
+
+    if entry is not None:
+        yield stanza_type, entry
+
+    pipeline_metrics.count('obo_stanzas', n_stanzas)
+
 def parse_obo_file_to_graph(obo_path):
     """
     Parse obo file into a networkx MultiDiGraph.
 
+    Stanzas are streamed from the file and added to the graph as they are read.  Terms become nodes, is_a lines become
+    'is_a' edges and relationship lines become edges keyed by their relationship type (ex: 'part_of').  Typedef stanzas
+    are stored in graph.graph['typedefs'] as {typedef id : entry dict}.
+
     Regex pattern for parsing obo terms and some parts of this function are copied from:
         https://github.com/cmungall/obo/blob/master/obo/read.py
 
     :param obo_path (string): path to .obo file.
     :return: graph (MultiDiGraph): graph containing linked entries from .obo file
     """
+    # Imported here so the compact and cached backends (and --help) start without networkx
+    import networkx
+
     graph = networkx.MultiDiGraph()
-    edge_tuples = []
+    typedefs = {}
 
     with open(obo_path) as f:
-        obo_lines = f.read().splitlines()
+        for stanza_type, entry in iter_obo_stanzas(f):
+            if 'id' not in entry:
+                continue
 
-    entries = itertools.groupby(obo_lines, lambda line: line.strip() == '')
-    parsed_terms = []
-    for is_blank, entry_lines in entries:
-        if is_blank:
-            continue
-        parsed_term = parse_obo_entry(entry_lines)
-        parsed_terms.append(parsed_term)
+            if stanza_type == 'Typedef':
+                typedefs[entry['id'][0]] = entry
+                continue
+            elif stanza_type != 'Term':
+                continue
+
+            term_id = entry.pop('id')[0]
+            graph.add_node(term_id, attr_dict=entry)
+            for target_term in entry.pop('is_a', []):
+                graph.add_edge(term_id, target_term, key='is_a')
+
+            # Ex: 'part_of OBT:000006'
+            for relationship in entry.get('relationship', []):
+                relationship_fields = relationship.split()
+                if len(relationship_fields) >= 2:
+                    graph.add_edge(term_id, relationship_fields[1], key=relationship_fields[0])
+
+    graph.graph['typedefs'] = typedefs
+
+    return graph
+
+def parse_obo_file_to_compact_graph(obo_path):
+    """
+    Parse obo file into a compact, array-backed graph (see compact_obo_graph.py).  Requires numpy.
 
-    for term in parsed_terms:
-        if term:
-            term_id = term.pop('id')[0]
-            graph.add_node(term_id, attr_dict=term)
-            for target_term in term.pop('is_a', []):
-                edge_tuple = term_id, 'is_a', target_term
-                edge_tuples.append(edge_tuple)
+    The compact graph stores only term ids, names, synonyms and is_a links, and can be passed in place of the
+    MultiDiGraph to the functions in this script.
 
-    for origin_term, typedef, dest_term in edge_tuples:
-        graph.add_edge(origin_term, dest_term, key=typedef)
+    :param obo_path (string): path to .obo file.
+    :return: graph (CompactOboGraph): graph containing linked entries from .obo file
+    """
+    from compact_obo_graph import CompactOboGraph
+
+    with open(obo_path) as f:
+        graph = CompactOboGraph.from_stanzas(iter_obo_stanzas(f))
 
     return graph
 
-def get_nodes_by_category(graph, category, convert_to_names=False):
+def get_node_name(graph, node_id):
+    """
+    Return the first name of a graph node, or None if the node has no attribute dict or name.
+
+    Nodes referenced only as an is_a target (e.g. terms from an imported ontology) are created without attributes.
+
+    :param graph (MultiDiGraph): MultiDiGraph from parse_obo_file_to_graph function, or CompactOboGraph
+    :param node_id (string): node id, ex: 'OBT:000001'
+    :return node_name (string): first entry of the node's name field, or None
+    """
+    node = graph.nodes.get(node_id)
+    if not node or not node.get('attr_dict'):
+        return None
+
+    node_names = node.get('attr_dict').get('name')
+    if not node_names:
+        return None
+
+    return node_names[0]
+
+def get_is_a_parents(graph, node_id):
+    """
+    Return the ids of the nodes a node is linked to by is_a edges.
+
+    :param graph (MultiDiGraph): MultiDiGraph from parse_obo_file_to_graph function
+    :param node_id (string): node id
+    :return parents (list): ids of is_a parent nodes
+    """
+    return [target for _, target, typedef in graph.out_edges(node_id, keys=True) if typedef == 'is_a']
+
+def build_ancestor_index(graph):
+    """
+    Compute the is_a ancestor closure of every node in a single depth-first topological pass.
+
+    Each node's ancestors are the union of its parents and its parents' ancestors, so every parent is completed before
+    its children and no edge is traversed more than once.  Cycles (which are invalid in an is_a DAG) are broken at the
+    first revisited node rather than looping forever.
+
+    :param graph (MultiDiGraph): MultiDiGraph from parse_obo_file_to_graph function
+    :return ancestor_index (dict): {node id : frozenset of is_a ancestor node ids}
+    """
+    ancestor_index = {}
+
+    for root in graph.nodes():
+        if root in ancestor_index:
+            continue
+
+        in_progress = {root}
+        stack = [(root, iter(get_is_a_parents(graph, root)))]
+        while stack:
+            node, parents = stack[-1]
+
+            # Descend into the first parent that has not been completed yet
+            for parent in parents:
+                if parent not in ancestor_index and parent not in in_progress:
+                    in_progress.add(parent)
+                    stack.append((parent, iter(get_is_a_parents(graph, parent))))
+                    break
+            else:
+                stack.pop()
+                in_progress.discard(node)
+
+                ancestors = set()
+                for parent in get_is_a_parents(graph, node):
+                    ancestors.add(parent)
+                    ancestors.update(ancestor_index.get(parent, ()))
+                ancestor_index[node] = frozenset(ancestors)
+
+    return ancestor_index
+
+def save_ancestor_index(ancestor_index, index_path, obo_path):
+    """
+    Write an ancestor index to a json file, along with the size and modification time of the obo file it was built from.
+
+    :param ancestor_index (dict): from build_ancestor_index function
+    :param index_path (string): path of json file to write
+    :param obo_path (string): path to the .obo file the index was built from
+    """
+    obo_stat = os.stat(obo_path)
+    index_json = {
+        'obo_file': os.path.abspath(obo_path),
+        'obo_size': obo_stat.st_size,
+        'obo_mtime': obo_stat.st_mtime,
+        'ancestors': {node: sorted(ancestors) for node, ancestors in ancestor_index.items()}
+    }
+
+    with open(index_path, 'w') as f:
+        json.dump(index_json, f)
+
+def load_ancestor_index(index_path, obo_path):
+    """
+    Read an ancestor index written by save_ancestor_index.
+
+    The index is only returned if it was built from the same obo file, and the file has not changed size or been
+    modified since.
+
+    :param index_path (string): path of json file written by save_ancestor_index
+    :param obo_path (string): path to the .obo file the index should correspond to
+    :return ancestor_index (dict): {node id : frozenset of ancestor node ids}, or None if missing or out of date
+    """
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path) as f:
+        index_json = json.load(f)
+
+    obo_stat = os.stat(obo_path)
+    if (index_json.get('obo_file') != os.path.abspath(obo_path)
+            or index_json.get('obo_size') != obo_stat.st_size
+            or index_json.get('obo_mtime') != obo_stat.st_mtime):
+        return None
+
+    return {node: frozenset(ancestors) for node, ancestors in index_json['ancestors'].items()}
+
+def get_nodes_by_categories(graph, categories, convert_to_names=False, ancestor_index=None):
+    """
+    Returns lists of nodes linked to each of several categories from a MultiDiGraph object.
+
+    A node belongs to a category if any of its is_a ancestors is named after the category.  The category node itself is
+    not included.  Membership of every category is resolved in one pass over the ancestor index.
+
+    :param graph (MultiDiGraph): MultiDiGraph from parse_obo_file_to_graph function
+    :param categories (list): names of category/parent nodes to get linked nodes from, ex: ['microbial habitat', 'phenotype']
+    :param convert_to_names (bool): If True, returns lists of name strings instead of node ids
+    :param ancestor_index (dict): from build_ancestor_index or load_ancestor_index.  Built from the graph if not provided.
+    :return category_nodes (dict): {category : list of node ids or node names linked to category}
+    """
+    if ancestor_index is None:
+        ancestor_index = build_ancestor_index(graph)
+
+    # Map ids of nodes named after a category to that category.  More than one node may share a name.
+    category_ids = {}
+    category_set = set(categories)
+    for node_id in graph.nodes():
+        node_name = get_node_name(graph, node_id)
+        if node_name in category_set:
+            category_ids[node_id] = node_name
+    category_id_set = frozenset(category_ids)
+
+    if hasattr(ancestor_index, 'get_descendants'):
+        # Array-backed index (CompactAncestorIndex): one vectorized scan of the closure per category
+        category_nodes = {}
+        for category in categories:
+            category_nodes[category] = ancestor_index.get_descendants(
+                [node_id for node_id, node_name in category_ids.items() if node_name == category])
+    else:
+        category_nodes = {category: [] for category in categories}
+        for node_id in graph.nodes():
+            linked_ids = category_id_set.intersection(ancestor_index.get(node_id, ()))
+            for category in {category_ids[i] for i in linked_ids}:
+                category_nodes[category].append(node_id)
+
+    # Convert category nodes from lists of identifiers (OBT:002837) to string names
+    if convert_to_names:
+        category_nodes = {category: [get_node_name(graph, i) for i in node_ids]
+                          for category, node_ids in category_nodes.items()}
+
+    return category_nodes
+
+def get_nodes_by_category(graph, category, convert_to_names=False, ancestor_index=None):
     """
     Returns a list of nodes linked to a specific category from a MultiDiGraph object.
 
     :param graph (MultiDiGraph): MultiDiGraph from parse_obo_file_to_graph function
     :param category (string): name of category/parent node to get linked nodes from, ex: 'microbial habitat'
     :param convert_to_names (bool): If True, returns a list of name strings instead of node ids
+    :param ancestor_index (dict): from build_ancestor_index or load_ancestor_index.  Built from the graph if not provided.
     :return: category nodes (list): node ids or node names for specific category
     """
-    category_nodes = []
+    return get_nodes_by_categories(graph, [category], convert_to_names, ancestor_index)[category]
 
-    for source_node in graph.nodes():
-        for i in networkx.algorithms.traversal.edgedfs.edge_dfs(graph, source=source_node):
-            node_name = (graph.nodes.get(i[1]).get('attr_dict').get('name')[0])
-            if node_name == category:
-                category_nodes.append(source_node)
+def get_node_dict_keys(node_name, node_synonyms):
+    """
+    :param node_name (string): first name of a node
+    :param node_synonyms (list): raw synonym values of the node, ex: ['"soil" EXACT []']
+    :return keys (list): dict keys the node is entered under: its name followed by its EXACT synonyms
+    """
+    keys = [node_name]
 
-    # Convert category nodes from list of identifiers (OBT:002837) to string names
-    if convert_to_names:
-        category_nodes = [graph.nodes.get(i).get('attr_dict').get('name')[0] for i in category_nodes]
+    # For now, only use synonyms of type EXACT.
+    for attr_synonym in node_synonyms or []:
+        attr_synonym = attr_synonym.replace('-', ' ')
+        re_match_syn = re.match(OBO_ENTRY_SYNONYM_PATTERN, attr_synonym)
+        re_match_syn_groups = re_match_syn.groups()
 
-    return category_nodes
+        attr_synonym_name = re_match_syn_groups[0].replace('"', '')
+        attr_synonym_type = re_match_syn_groups[1]
+
+        if attr_synonym_type == 'EXACT':
+            keys.append(attr_synonym_name)
+
+    return keys
 
 def convert_node_list_to_dict(graph, node_list, category, path_to_write=''):
     """
@@ -120,11 +383,7 @@ def convert_node_list_to_dict(graph, node_list, category, path_to_write=''):
     """
     node_dict = {}
 
-    obo_entry_synonym_pattern = re.compile(
-        r'(\"[ \w|\W+]+\") ([A-Z]+) (\[[a-zA-Z]*\:*[0-9]*\])'
-    )
-
-    # Parse nodes into dict with ID, name, and synonyms.  For now, only use synonyms of type EXACT.
+    # Parse nodes into dict with ID, name, and synonyms.
     for node_id in node_list:
         node = graph.nodes.get(node_id)
 
@@ -140,41 +399,447 @@ def convert_node_list_to_dict(graph, node_list, category, path_to_write=''):
         # Possible for nodes to have more than 1 name?
         node_name = node_names[0]
 
-        node_dict[node_name] = {
-            'id': node_id,
-            'entity_class': category
-        }
-        node_synonyms = []
-        attr_dict_node_synonyms = node_attr_dict.get('synonym')
-        if attr_dict_node_synonyms:
-            for attr_synonym in attr_dict_node_synonyms:
-                attr_synonym = attr_synonym.replace('-', ' ')
-                re_match_syn = re.match(obo_entry_synonym_pattern, attr_synonym)
-                re_match_syn_groups = re_match_syn.groups()
-
-                attr_synonym_name = re_match_syn_groups[0].replace('"', '')
-                attr_synonym_type = re_match_syn_groups[1]
-                attr_synonym_id = re_match_syn_groups[2]
-
-                if attr_synonym_type == 'EXACT':
-                    node_dict[attr_synonym_name] = {
-                        'id': node_id,
-                        'entity_class': category
-                    }
+        for key in get_node_dict_keys(node_name, node_attr_dict.get('synonym')):
+            node_dict[key] = {
+                'id': node_id,
+                'entity_class': category
+            }
     return node_dict
 
-if __name__ == "__main__":
+def read_obo_terms(obo_path):
+    """
+    Read the parts of an obo file that category dicts depend on, without building a graph.
+
+    :param obo_path (string): path to .obo file
+    :return (tuple): ({term id : [name, raw synonyms, is_a parent ids]}, list of node ids in the order
+                     parse_obo_file_to_graph adds them to the graph)
+    """
+    terms = {}
+    node_order = []
+    seen = set()
+
+    def add_node(node_id):
+        if node_id not in seen:
+            seen.add(node_id)
+            node_order.append(node_id)
+
+    with open(obo_path) as f:
+        for stanza_type, entry in iter_obo_stanzas(f):
+            if stanza_type != 'Term' or 'id' not in entry:
+                continue
+
+            term_id = entry['id'][0]
+            add_node(term_id)
+            parents = entry.get('is_a', [])
+            for parent in parents:
+                add_node(parent)
+            for relationship in entry.get('relationship', []):
+                relationship_fields = relationship.split()
+                if len(relationship_fields) >= 2:
+                    add_node(relationship_fields[1])
 
-    print("Generating MultiDiGraph from obo file...")
-    graph = parse_obo_file_to_graph(args.obo_file_path)
+            terms[term_id] = [entry['name'][0] if entry.get('name') else None, entry.get('synonym', []), parents]
 
-    category = args.category.replace('_', ' ')
-    print("Extracting nodes linked to category %s..." % category)
-    category_nodes = get_nodes_by_category(graph, category)
+    return terms, node_order
 
-    print("Converting extracted nodes into dict...")
-    category_nodes_dict = convert_node_list_to_dict(graph, category_nodes, args.category)
+def get_term_descendants(terms, node_ids):
+    """
+    :param terms (dict): from read_obo_terms
+    :param node_ids (iterable): ids of nodes to start from
+    :return descendants (set): node_ids and every node with one of them among its is_a ancestors
+    """
+    children = {}
+    for term_id, (_, _, parents) in terms.items():
+        for parent in parents:
+            children.setdefault(parent, []).append(term_id)
+
+    descendants = set(node_ids)
+    stack = list(descendants)
+    while stack:
+        for child in children.get(stack.pop(), ()):
+            if child not in descendants:
+                descendants.add(child)
+                stack.append(child)
+
+    return descendants
+
+def get_term_ancestors(terms, node_id, ancestor_memo):
+    """
+    :param terms (dict): from read_obo_terms
+    :param node_id (string): node id
+    :param ancestor_memo (dict): {node id : frozenset of ancestor ids} shared between calls on the same terms
+    :return (frozenset): is_a ancestors of node_id
+    """
+    stack = [node_id]
+    in_progress = set()
+    while stack:
+        node = stack[-1]
+        if node in ancestor_memo:
+            stack.pop()
+            continue
+
+        parents = terms[node][2] if node in terms else []
+        pending = [parent for parent in parents if parent not in ancestor_memo and parent not in in_progress]
+        if pending and node not in in_progress:
+            in_progress.add(node)
+            stack.extend(pending)
+            continue
+
+        # Parents are complete (or on a cycle, which is broken here as in build_ancestor_index)
+        stack.pop()
+        in_progress.discard(node)
+        ancestors = set()
+        for parent in parents:
+            ancestors.add(parent)
+            ancestors.update(ancestor_memo.get(parent, ()))
+        ancestor_memo[node] = frozenset(ancestors)
+
+    return ancestor_memo[node_id]
 
-    print("Writing category nodes dict to %s..." % args.out_file)
-    with open(args.out_file, 'w') as f:
-        json.dump(category_nodes_dict, f)
+def diff_obo_terms(old_terms, new_terms):
+    """
+    :param old_terms (dict): from read_obo_terms (or a snapshot) of the previous obo file
+    :param new_terms (dict): from read_obo_terms of the new obo file
+    :return changes (dict): lists of added and removed term ids, renamed terms, terms with changed synonyms, and terms
+                            with changed is_a parents
+    """
+    changes = {'added': [], 'removed': [], 'renamed': [], 'synonyms_changed': [], 'is_a_changed': []}
+
+    for term_id, (name, synonyms, parents) in new_terms.items():
+        old_term = old_terms.get(term_id)
+        if old_term is None:
+            changes['added'].append(term_id)
+            continue
+
+        old_name, old_synonyms, old_parents = old_term
+        if name != old_name:
+            changes['renamed'].append({'id': term_id, 'old_name': old_name, 'new_name': name})
+        if synonyms != old_synonyms:
+            changes['synonyms_changed'].append(term_id)
+        if sorted(parents) != sorted(old_parents):
+            changes['is_a_changed'].append({'id': term_id, 'old_parents': old_parents, 'new_parents': parents})
+
+    changes['removed'] = [term_id for term_id in old_terms if term_id not in new_terms]
+    return changes
+
+def update_category_dicts(snapshot, new_terms, node_order, category_names, category_seconds=None):
+    """
+    Bring the category dicts of a snapshot up to date with a new obo file, recomputing only affected entries.
+
+    Category membership is recomputed for added, removed and moved (changed is_a) terms, terms renamed to or from a
+    category name, and all of their descendants.  Dict entries are recomputed for the names and synonyms of those terms
+    and of renamed terms or terms with changed synonyms.  Where several member terms share a name or synonym, the term
+    added to the graph last wins, as in convert_node_list_to_dict.  Dict keys are ordered as convert_node_list_to_dict
+    orders them, so the json written from an updated dict is the same as that of a full build.
+
+    :param snapshot (dict): from load_obo_snapshot
+    :param new_terms (dict): from read_obo_terms of the new obo file
+    :param node_order (list): from read_obo_terms of the new obo file
+    :param category_names (dict): {category argument : category node name}, ex: {'microbial_habitat': 'microbial habitat'}
+    :param category_seconds (dict): if given, filled with {category argument : seconds spent updating its dict}
+    :return (tuple): ({category argument : {'members': list of node ids, 'dict': category dict}}, changelog dict)
+    """
+    old_terms = snapshot['terms']
+    changes = diff_obo_terms(old_terms, new_terms)
+    category_name_set = set(category_names.values())
+
+    # Terms whose changes can move their descendants in or out of a category
+    moved_ids = set(changes['added']) | set(changes['removed']) | {i['id'] for i in changes['is_a_changed']}
+    moved_ids |= {i['id'] for i in changes['renamed']
+                  if i['old_name'] in category_name_set or i['new_name'] in category_name_set}
+    membership_ids = get_term_descendants(old_terms, moved_ids) | get_term_descendants(new_terms, moved_ids)
+
+    entry_ids = membership_ids | {i['id'] for i in changes['renamed']} | set(changes['synonyms_changed'])
+
+    category_ids = {}
+    for term_id, (name, _, _) in new_terms.items():
+        if name in category_name_set:
+            category_ids.setdefault(name, set()).add(term_id)
+
+    ancestor_memo = {}
+    node_rank = {node_id: i for i, node_id in enumerate(node_order)}
+    category_dicts = {}
+    changelog = {'terms': changes, 'categories': {}}
+
+    for category, category_name in category_names.items():
+        start = time.perf_counter()
+        old_members = snapshot['categories'][category]['members']
+        old_dict = snapshot['categories'][category]['dict']
+
+        # Only terms with a stanza can be converted into dict entries, so other nodes are left out
+        linked_ids = category_ids.get(category_name, set())
+        affected_members = {i for i in membership_ids if i in new_terms and
+                            not linked_ids.isdisjoint(get_term_ancestors(new_terms, i, ancestor_memo))}
+        members = set(i for i in old_members if i not in membership_ids) | affected_members
+        for term_id in members:
+            # Same requirement as convert_node_list_to_dict, so both builds fail on the same obo file
+            assert new_terms[term_id][0], "Node %s has no name field." % term_id
+
+        # Names and synonyms whose entries may have changed
+        touched_keys = set()
+        for terms, term_members in [(old_terms, set(old_members)), (new_terms, members)]:
+            for term_id in entry_ids & term_members:
+                name, synonyms, _ = terms[term_id]
+                touched_keys.update(get_node_dict_keys(name, synonyms))
+
+        # Keys are inserted in the order convert_node_list_to_dict first enters them, entries of untouched keys are kept
+        sorted_members = sorted(members, key=lambda i: node_rank.get(i, -1))
+        key_ids = {}
+        for term_id in sorted_members:
+            name, synonyms, _ = new_terms[term_id]
+            for key in get_node_dict_keys(name, synonyms):
+                if key in touched_keys:
+                    key_ids[key] = term_id
+                elif key not in key_ids:
+                    key_ids[key] = None
+
+        category_dict = {}
+        for key, term_id in key_ids.items():
+            category_dict[key] = old_dict[key] if term_id is None else {'id': term_id, 'entity_class': category}
+
+        category_dicts[category] = {
+            'members': sorted_members,
+            'dict': category_dict
+        }
+        if category_seconds is not None:
+            category_seconds[category] = time.perf_counter() - start
+        changelog['categories'][category] = {
+            'members_added': sorted(members.difference(old_members)),
+            'members_removed': sorted(set(old_members).difference(members)),
+            'entries_added': sorted(set(category_dict).difference(old_dict)),
+            'entries_removed': sorted(set(old_dict).difference(category_dict)),
+            'entries_changed': sorted(key for key in touched_keys
+                                      if key in old_dict and key in category_dict and old_dict[key] != category_dict[key])
+        }
+
+    return category_dicts, changelog
+
+def save_obo_snapshot(snapshot_path, obo_path, terms, category_dicts):
+    """
+    :param snapshot_path (string): path of json file to write
+    :param obo_path (string): path to the .obo file terms were read from
+    :param terms (dict): from read_obo_terms
+    :param category_dicts (dict): {category argument : {'members': list of node ids, 'dict': category dict}}
+    """
+    # json.dumps encodes in C, json.dump to a file object does not
+    with open(snapshot_path, 'w') as f:
+        f.write(json.dumps({'obo_file': os.path.abspath(obo_path), 'terms': terms, 'categories': category_dicts}))
+
+def load_obo_snapshot(snapshot_path, categories):
+    """
+    :param snapshot_path (string): path of json file written by save_obo_snapshot
+    :param categories (list): category arguments the snapshot must hold
+    :return snapshot (dict): {'obo_file', 'terms', 'categories'}, or None if missing or made for other categories
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+
+    with open(snapshot_path) as f:
+        snapshot = json.load(f)
+
+    if set(snapshot['categories']) != set(categories):
+        return None
+    return snapshot
+
+def extract_category_dicts(args, category_names, category_seconds=None):
+    """
+    Full extraction: load the graph of the obo file and convert the nodes of every category.
+
+    :param args (Namespace): parsed command line arguments
+    :param category_names (dict): {category argument : category node name}
+    :param category_seconds (dict): if given, filled with {category argument : seconds spent converting its dict}
+    :return category_dicts (dict): {category argument : {'members': list of node ids, 'dict': category dict}}
+    """
+    start = time.perf_counter()
+    if args.cache_dir:
+        from obo_graph_cache import load_or_build_cached_graph
+
+        print("Loading compact graph and ancestor index from cache %s..." % args.cache_dir)
+        with pipeline_metrics.stage('load_cached_graph'):
+            graph, ancestor_index, cache_hit = load_or_build_cached_graph(
+                args.obo_file_path, args.cache_dir, parse_obo_file_to_compact_graph, build_ancestor_index)
+        pipeline_metrics.count('graph_cache_hits' if cache_hit else 'graph_cache_misses')
+        if not cache_hit:
+            print("Cache miss: parsed obo file and wrote new cache entry.")
+    else:
+        with pipeline_metrics.stage('parse_obo'):
+            if args.backend == 'compact':
+                print("Generating compact graph from obo file...")
+                graph = parse_obo_file_to_compact_graph(args.obo_file_path)
+            else:
+                print("Generating MultiDiGraph from obo file...")
+                graph = parse_obo_file_to_graph(args.obo_file_path)
+
+        ancestor_index = None
+        if args.ancestor_index_file:
+            with pipeline_metrics.stage('load_ancestor_index'):
+                ancestor_index = load_ancestor_index(args.ancestor_index_file, args.obo_file_path)
+            pipeline_metrics.count('ancestor_index_cache_hits' if ancestor_index is not None else
+                                   'ancestor_index_cache_misses')
+
+        if ancestor_index is None:
+            print("Building is_a ancestor index...")
+            with pipeline_metrics.stage('build_ancestor_index'):
+                ancestor_index = build_ancestor_index(graph)
+            if args.ancestor_index_file:
+                print("Writing ancestor index to %s..." % args.ancestor_index_file)
+                with pipeline_metrics.stage('save_ancestor_index'):
+                    save_ancestor_index(ancestor_index, args.ancestor_index_file, args.obo_file_path)
+        else:
+            print("Loaded ancestor index from %s." % args.ancestor_index_file)
+
+    print("Loaded graph in %.2fs." % (time.perf_counter() - start))
+
+    print("Extracting nodes linked to %d categories: %s..." % (len(category_names), ', '.join(category_names.values())))
+    with pipeline_metrics.stage('get_nodes_by_categories') as timer:
+        category_nodes = get_nodes_by_categories(graph, sorted(set(category_names.values())),
+                                                 ancestor_index=ancestor_index)
+    print("Extracted nodes for all categories in %.2fs." % timer.seconds)
+
+    category_dicts = {}
+    for category in category_names:
+        node_list = category_nodes[category_names[category]]
+        with pipeline_metrics.stage('convert_node_list_to_dict') as timer:
+            category_dicts[category] = {'members': node_list,
+                                        'dict': convert_node_list_to_dict(graph, node_list, category)}
+        if category_seconds is not None:
+            category_seconds[category] = timer.seconds
+    return category_dicts
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract all terms linked to specified concept in obo format file and dump them to a json file.")
+    parser.add_argument('obo_file_path', help='Path to .obo format file')
+    parser.add_argument('category', nargs='?',
+                        help='Name of category/parent/concept node.  All extracted nodes will be linked to this node.  Ex: "microbial habitats"')
+    parser.add_argument('out_file', nargs='?', help='Name of json file to dump dict of extracted nodes to.')
+    parser.add_argument('--categories', nargs='+', default=[],
+                        help='Batch mode: names of several categories to extract from a single parse of the obo file.')
+    parser.add_argument('--category_file', help='Batch mode: file with one category name per line.')
+    parser.add_argument('--out_dir', help='Batch mode: directory to write one <category>.json file per category to.')
+    parser.add_argument('--compact_out_dir',
+                        help='Directory to also write one memory-mappable <category>.dict file per category to (see compact_dictionary.py).')
+    parser.add_argument('--combined_out_file',
+                        help='Batch mode: json file to write all category dicts to, as {category : {node_name : {...}}}.')
+    parser.add_argument('--backend', choices=['networkx', 'compact'], default='networkx',
+                        help='Graph backend.  "compact" stores the ontology in numpy arrays and uses much less memory.')
+    parser.add_argument('--ancestor_index_file',
+                        help='Path to json file caching the is_a ancestor index of the obo file.  Built and written if missing or out of date.')
+    parser.add_argument('--cache_dir',
+                        help='Directory caching parsed obo files and their ancestor indexes, keyed by file contents.  Implies the compact backend.')
+    parser.add_argument('--snapshot_file',
+                        help='Path to json snapshot of the previous run.  If it exists, only dict entries affected by term changes since that run are recomputed.  Rewritten after every run.')
+    parser.add_argument('--changelog_file',
+                        help='Path to json file to write the term and dict entry changes since the snapshot to.')
+    pipeline_metrics.add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    categories = list(args.categories)
+    if args.category:
+        categories.insert(0, args.category)
+    if args.category_file:
+        categories += [line.strip() for line in open(args.category_file) if line.strip()]
+
+    if not categories:
+        parser.error('Specify a category, --categories or --category_file.')
+    if not (args.out_file or args.out_dir or args.combined_out_file or args.compact_out_dir):
+        parser.error('Specify out_file, --out_dir, --combined_out_file or --compact_out_dir.')
+    if args.out_file and len(categories) > 1:
+        parser.error('out_file holds a single category.  Use --out_dir or --combined_out_file for several categories.')
+
+    # Category names may be given with underscores in place of spaces, ex: microbial_habitat
+    category_names = {category: category.replace('_', ' ') for category in categories}
+
+    profiler = pipeline_metrics.start_run(args)
+
+    snapshot = None
+    if args.snapshot_file:
+        snapshot = load_obo_snapshot(args.snapshot_file, categories)
+        if snapshot is None:
+            print("No snapshot of these categories in %s, extracting all nodes." % args.snapshot_file)
+
+    terms = None
+    # Seconds spent converting or updating the dict of each category, the time spent writing it is added below
+    category_seconds = {}
+    changelog = {'obo_file': os.path.abspath(args.obo_file_path), 'incremental': snapshot is not None}
+    if snapshot is not None:
+        print("Updating category dicts from snapshot %s..." % args.snapshot_file)
+        start = time.perf_counter()
+        with pipeline_metrics.stage('read_obo_terms'):
+            terms, node_order = read_obo_terms(args.obo_file_path)
+        with pipeline_metrics.stage('update_category_dicts'):
+            category_dicts, term_changelog = update_category_dicts(snapshot, terms, node_order, category_names,
+                                                                   category_seconds=category_seconds)
+        changelog.update(term_changelog)
+        print("Terms: %d added, %d removed, %d renamed, %d with new synonyms, %d with new is_a links." % tuple(
+            len(term_changelog['terms'][change]) for change in
+            ['added', 'removed', 'renamed', 'synonyms_changed', 'is_a_changed']))
+        print("Updated category dicts in %.2fs." % (time.perf_counter() - start))
+    else:
+        category_dicts = extract_category_dicts(args, category_names, category_seconds=category_seconds)
+
+    for out_dir in [args.out_dir, args.compact_out_dir]:
+        if out_dir and not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+
+    combined_dict = {}
+    for category in categories:
+        start = time.perf_counter()
+        category_nodes_dict = category_dicts[category]['dict']
+
+        out_files = []
+        if args.out_file:
+            out_files.append(args.out_file)
+        if args.out_dir:
+            out_files.append(os.path.join(args.out_dir, '%s.json' % category.replace(' ', '_')))
+
+        for out_file in out_files:
+            with pipeline_metrics.stage('write_json'), open(out_file, 'w') as f:
+                f.write(json.dumps(category_nodes_dict))
+
+        if args.compact_out_dir:
+            from compact_dictionary import write_compact_dictionary
+
+            out_files.append(os.path.join(args.compact_out_dir, '%s.dict' % category.replace(' ', '_')))
+            with pipeline_metrics.stage('write_compact_dictionary'):
+                write_compact_dictionary(category_nodes_dict, out_files[-1])
+
+        pipeline_metrics.count('category_nodes', len(category_dicts[category]['members']))
+        pipeline_metrics.count('dict_entries', len(category_nodes_dict))
+
+        if args.combined_out_file:
+            combined_dict[category] = category_nodes_dict
+
+        entry_changes = ''
+        if snapshot is not None:
+            category_changelog = changelog['categories'][category]
+            entry_changes = ' (%d added, %d removed, %d changed)' % (
+                len(category_changelog['entries_added']), len(category_changelog['entries_removed']),
+                len(category_changelog['entries_changed']))
+
+        print("%s: %d nodes, %d dict entries%s, converted and written in %.2fs -> %s" % (
+            category_names[category], len(category_dicts[category]['members']), len(category_nodes_dict),
+            entry_changes, category_seconds[category] + time.perf_counter() - start,
+            ', '.join(out_files) or args.combined_out_file))
+
+    if args.combined_out_file:
+        print("Writing combined category nodes dict to %s..." % args.combined_out_file)
+        with pipeline_metrics.stage('write_json'), open(args.combined_out_file, 'w') as f:
+            f.write(json.dumps(combined_dict))
+
+    if args.snapshot_file:
+        if terms is None:
+            with pipeline_metrics.stage('read_obo_terms'):
+                terms, _ = read_obo_terms(args.obo_file_path)
+        print("Writing snapshot to %s..." % args.snapshot_file)
+        with pipeline_metrics.stage('save_snapshot'):
+            save_obo_snapshot(args.snapshot_file, args.obo_file_path, terms, category_dicts)
+
+    if args.changelog_file:
+        print("Writing changelog to %s..." % args.changelog_file)
+        with open(args.changelog_file, 'w') as f:
+            json.dump(changelog, f, indent=1)
+
+    pipeline_metrics.finish_run(args, profiler)
+
+if __name__ == "__main__":
+    main()
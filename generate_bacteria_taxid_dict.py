@@ -1,22 +1,12 @@
-import pandas as pd
 import re
 import json
 import argparse
+import os
 
-from ete3 import NCBITaxa
+import pipeline_metrics
 
-ncbi = NCBITaxa()
-
-parser = argparse.ArgumentParser(
-    description="Extract all terms linked to specified concept in obo format file and dump them to a json file.")
-parser.add_argument('ncbi_lineage_file',
-                    help='Path to ncbi taxdump lineage file.  Each line is a taxonomic lineage.  Ex: ')
-parser.add_argument('out_file', help='Path to json to dump microorganism taxid dict')
-parser.add_argument('--stopwords_file',
-                    help='Stopwords from bioNLP task description.  Species containing any of these words will be filtered out.')
-parser.add_argument('--genera_filter_file',
-                    help='List of genera to filter to.  If present, output dict will only contain species of these genera.')
-args = parser.parse_args()
+# All rank and name lookups go through this layer, created by get_taxonomy_lookup or main.
+taxonomy_lookup = None
 
 """
 This script is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
@@ -35,6 +25,17 @@ To-do:
     -Make additional manual entries from task specifications.
 """
 
+def get_taxonomy_lookup():
+    """
+    :return taxonomy_lookup (NCBITaxonomyLookup): the lookup set by main, or one reading ete3's default database
+    """
+    global taxonomy_lookup
+    if taxonomy_lookup is None:
+        # numpy is only imported once a lookup is needed
+        from ncbi_taxonomy import NCBITaxonomyLookup
+        taxonomy_lookup = NCBITaxonomyLookup()
+    return taxonomy_lookup
+
 def check_taxon_name_legitimacy(taxon, stopwords, verbose=False):
     """
     Check a taxon name for usability, defined as:
@@ -115,7 +116,7 @@ def generate_dict_entry(taxid, varietas, subspecies, species, genus, stopwords):
     """
     global microorganism_taxid_dict
 
-    rank = ncbi.get_rank([taxid]).get(taxid)
+    rank = get_taxonomy_lookup().get_rank([taxid]).get(taxid)
     if rank == 'genus':
         if check_taxon_name_legitimacy(genus, stopwords):
             microorganism_taxid_dict[genus] = {
@@ -168,7 +169,7 @@ def generate_truncated_dict_entry(taxid, species, genus, genera_filter_list, sto
     """
     global microorganism_taxid_dict
 
-    rank = ncbi.get_rank([taxid]).get(taxid)
+    rank = get_taxonomy_lookup().get_rank([taxid]).get(taxid)
 
     if rank == 'species':
         if genus in genera_filter_list:
@@ -178,74 +179,498 @@ def generate_truncated_dict_entry(taxid, species, genus, genera_filter_list, sto
                     'rank': rank
                 }
 
-if __name__ == "__main__":
+# Lineage columns used to build taxid dicts.  All other ranks in the ncbi lineage file are skipped when reading it.
+LINEAGE_COLUMNS = ['tax_id', 'superkingdom', 'genus', 'species', 'subspecies', 'varietas']
+
+def load_bacteria_lineages(lineage_path, valid_taxids, chunksize=500000):
     """
-    Read NCBI lineages from file and filter them to bacterial lineages with taxids belonging to the BioNLP-BB-norm specified list
-    of usable taxids.
+    Stream the ncbi lineage csv in chunks, keeping only bacterial lineages with a valid taxid.
+
+    Only LINEAGE_COLUMNS are parsed, superkingdom and genus are read as categoricals, and both filters are applied to
+    each chunk as it is read, so peak memory follows the size of the filtered result rather than the lineage file.
+
+    :param lineage_path (string): path to ncbi taxdump lineage csv (one lineage per line)
+    :param valid_taxids (set): int taxids to keep
+    :param chunksize (int): number of lines to read at a time
+    :return (tuple): (DataFrame of valid bacterial lineages, dict of counts: total, valid, bacteria)
     """
-    print("Generating dataframe of bacterial candidates from NCBI lineages and BioNLP taxids...")
-    lineage_df = pd.read_csv(args.ncbi_lineage_file)
-    bio_nlp_taxids_path = './resources/BioNLP-OST-2019_BB-norm_Microorganism-ids.txt'
+    # pandas is imported by the functions that use it, so the script starts (and --help runs) without it
+    import pandas as pd
+
+    header = pd.read_csv(lineage_path, nrows=0).columns
+    usecols = [column for column in LINEAGE_COLUMNS if column in header]
+    dtypes = {
+        'tax_id': 'int64',
+        'superkingdom': 'category',
+        'genus': 'category',
+        'species': 'object',
+        'subspecies': 'object',
+        'varietas': 'object'
+    }
 
-    valid_taxids = [line.rstrip('\n') for line in open(bio_nlp_taxids_path)]
-    valid_microorganisms_df = lineage_df[lineage_df['tax_id'].isin(valid_taxids)]
-    valid_bacteria_df = valid_microorganisms_df[valid_microorganisms_df['superkingdom'] == 'Bacteria']
+    counts = {'total': 0, 'valid': 0, 'bacteria': 0}
+    bacteria_chunks = []
+    for chunk in pd.read_csv(lineage_path, usecols=usecols, dtype={c: dtypes[c] for c in usecols}, chunksize=chunksize):
+        counts['total'] += len(chunk)
 
-    print("Total number of NCBI lineages = %d" % len(lineage_df))
-    print("Lineages with valid microorganism taxids = %d" % len(valid_microorganisms_df))
-    print("Lineages with superkingdom bacteria and valid microorganism taxids = %d" % len(valid_bacteria_df))
+        chunk = chunk[chunk['tax_id'].isin(valid_taxids)]
+        counts['valid'] += len(chunk)
 
-    # If a stopwords file has been specified, read stopwords into list
-    stopwords = []
-    if args.stopwords_file:
-        stopwords = [line.rstrip('\n') for line in open(args.stopwords_file)]
+        chunk = chunk[chunk['superkingdom'] == 'Bacteria']
+        counts['bacteria'] += len(chunk)
+        bacteria_chunks.append(chunk)
+
+    bacteria_df = pd.concat(bacteria_chunks, ignore_index=True)
+
+    # Categories differ between chunks, so concatenated categoricals fall back to object dtype
+    for column in ['superkingdom', 'genus']:
+        if column in bacteria_df:
+            bacteria_df[column] = bacteria_df[column].astype('category')
+    for column in LINEAGE_COLUMNS:
+        if column not in bacteria_df:
+            bacteria_df[column] = None
+
+    return bacteria_df, counts
+
+def get_legitimate_name_mask(taxons, stopwords):
     """
-    This will be used as a global dict that entries are added to as they are generated.
+    Vectorized check_taxon_name_legitimacy over a column of organism names.
 
-    Once completed, it will be written to out_file.
+    :param taxons (Series): organism names, missing names are NaN
+    :param stopwords (list): strings that must not be included as a word in a taxon
+    :return legitimacy (Series): boolean mask, True where a name is a string without any stopword
     """
-    microorganism_taxid_dict = {}
+    legitimacy = taxons.notna()
 
+    # A name fails if any of its space-separated, lowercased words is a stopword
+    stopwords = [word for word in stopwords if ' ' not in word]
+    if stopwords:
+        stopword_pattern = r'(?:^| )(?:%s)(?: |$)' % '|'.join(re.escape(word) for word in stopwords)
+        legitimacy &= ~taxons.astype(object).str.lower().str.contains(stopword_pattern, regex=True, na=False)
+
+    return legitimacy
+
+def build_taxid_dict(entries):
     """
-    If a list of genera to filter to is specified, add only species-level entries to microorganism_taxid_dict for lineages in one of these genera.
+    Assemble dict entries generated by generate_taxid_dict/generate_truncated_taxid_dict.
 
-    Otherwise, for each lineage, add an entry for the rightmost, usable name (of genus, species, subspecies, varietas).  
+    Entries are inserted in order, so a later lineage overwrites an earlier one with the same name, exactly as repeated
+    generate_dict_entry calls would.
+
+    :param entries (DataFrame): columns key, taxid, rank and (optionally) corrected_name, ordered by 'order'
+    :return microorganism_taxid_dict (dict): {organism name : {'taxid', ('corrected_name'), 'rank'}}
     """
-    filter_genera = []
-    if args.genera_filter_file:
+    import pandas as pd
 
-        dict_type = 'truncated'
-        filter_genera = [line.rstrip('\n') for line in open(args.genera_filter_file)]
-        x = valid_bacteria_df.apply(
-            lambda row: generate_truncated_dict_entry(row['tax_id'], row['species'], row['genus'], filter_genera,
-                                                      stopwords), axis=1)
+    entries = entries.sort_values('order', kind='stable')
+    ranks = [None if pd.isnull(rank) else rank for rank in entries['rank'].tolist()]
+
+    microorganism_taxid_dict = {}
+    if 'corrected_name' in entries:
+        for key, taxid, corrected_name, rank in zip(entries['key'].tolist(), entries['taxid'].tolist(),
+                                                    entries['corrected_name'].tolist(), ranks):
+            microorganism_taxid_dict[key] = {
+                'taxid': taxid,
+                'corrected_name': corrected_name,
+                'rank': rank
+            }
     else:
-        dict_type = 'full'
-        x = valid_bacteria_df.apply(
-            lambda row: generate_dict_entry(row['tax_id'], row['varietas'], row['subspecies'], row['species'],
-                                            row['genus'], stopwords), axis=1)
+        for key, taxid, rank in zip(entries['key'].tolist(), entries['taxid'].tolist(), ranks):
+            microorganism_taxid_dict[key] = {
+                'taxid': taxid,
+                'rank': rank
+            }
+
+    return microorganism_taxid_dict
 
+def get_abbreviated_species_names(species):
+    """
+    :param species (Series): species names, missing names are NaN
+    :return (Series): species names with the genus abbreviated to its first letter, ex: Staphylococcus aureus -> S. aureus
+    """
+    species = species.astype(object)
+    return species.str[0] + '. ' + species.str.split(' ', n=1).str[1].fillna('')
+
+def get_taxid_dict_entries(lineage_df, taxid_ranks, stopwords):
+    """
+    Vectorized equivalent of applying generate_dict_entry to every lineage in a dataframe, before the entries are
+    assembled into a dict.
+
+    Names are masked column-wise for stopwords and rank, and abbreviated species names ("S. aureus") are built for the
+    whole species column at once.
+
+    :param lineage_df (DataFrame): lineages with columns tax_id, genus, species, subspecies, varietas
+    :param taxid_ranks (dict): {taxid : NCBI rank} for every taxid in lineage_df, ex: from NCBITaxonomyLookup.get_rank
+    :param stopwords (list): organism names containing any of these words will be excluded
+    :return entries (DataFrame): columns key, taxid, corrected_name, rank, order, see build_taxid_dict
+    """
+    import pandas as pd
+
+    lineage_df = lineage_df.reset_index(drop=True)
+    taxids = lineage_df['tax_id']
+    ranks = taxids.map(taxid_ranks)
+    genus = lineage_df['genus']
+    species = lineage_df['species']
+
+    # Each lineage can produce up to 2 entries, 'order' preserves their row-by-row generation order
+    row_order = pd.Series(range(len(lineage_df))) * 2
+    entries = []
+
+    def add_entries(mask, keys, corrected_names, entry_order):
+        entries.append(pd.DataFrame({
+            'key': keys[mask],
+            'taxid': taxids[mask],
+            'corrected_name': corrected_names[mask],
+            'rank': ranks[mask],
+            'order': row_order[mask] + entry_order
+        }))
+
+    is_genus = ranks == 'genus'
+    is_species = ranks == 'species'
+    is_other = ~(is_genus | is_species)
+
+    legitimate_genus = get_legitimate_name_mask(genus, stopwords)
+    legitimate_species = get_legitimate_name_mask(species, stopwords)
+    unnamed_species = (species.astype(object).str.rsplit(' ', n=1).str[-1] == 'sp.').fillna(False).astype(bool)
+
+    add_entries(is_genus & legitimate_genus, genus, genus, 0)
+
+    # Unnamed species (ex: Bacillus sp.) are corrected to their genus
+    add_entries(is_species & legitimate_species & unnamed_species & legitimate_genus, species, genus, 0)
+
+    named_species = is_species & legitimate_species & ~unnamed_species
+    add_entries(named_species, species, species, 0)
+
+    # Staphylococcus aureus -> S. aureus
+    abbreviated_species = get_abbreviated_species_names(species)
+    has_sp = species.astype(object).str.contains('sp.', regex=False, na=False)
+    add_entries(named_species & ~has_sp, abbreviated_species, species, 1)
+
+    for taxon_column, entry_order in [('varietas', 0), ('subspecies', 1)]:
+        taxons = lineage_df[taxon_column]
+        add_entries(is_other & get_legitimate_name_mask(taxons, stopwords), taxons, taxons, entry_order)
+
+    return pd.concat(entries)
+
+def generate_taxid_dict(lineage_df, taxid_ranks, stopwords):
+    """
+    Vectorized equivalent of applying generate_dict_entry to every lineage in a dataframe.
+
+    :param lineage_df (DataFrame): lineages with columns tax_id, genus, species, subspecies, varietas
+    :param taxid_ranks (dict): {taxid : NCBI rank} for every taxid in lineage_df, ex: from NCBITaxonomyLookup.get_rank
+    :param stopwords (list): organism names containing any of these words will be excluded
+    :return microorganism_taxid_dict (dict): {organism name : {'taxid', 'corrected_name', 'rank'}}
+    """
+    return build_taxid_dict(get_taxid_dict_entries(lineage_df, taxid_ranks, stopwords))
+
+def get_truncated_taxid_dict_entries(lineage_df, taxid_ranks, genera_filter_list, stopwords):
+    """
+    Vectorized equivalent of applying generate_truncated_dict_entry to every lineage in a dataframe, before the entries
+    are assembled into a dict.
+
+    :param lineage_df (DataFrame): lineages with columns tax_id, genus, species
+    :param taxid_ranks (dict): {taxid : NCBI rank} for every taxid in lineage_df
+    :param genera_filter_list (list): genera to keep species of
+    :param stopwords (list): organism names containing any of these words will be excluded
+    :return entries (DataFrame): columns key, taxid, rank, order, see build_taxid_dict
+    """
+    import pandas as pd
+
+    lineage_df = lineage_df.reset_index(drop=True)
+    ranks = lineage_df['tax_id'].map(taxid_ranks)
+
+    mask = (ranks == 'species') & lineage_df['genus'].isin(genera_filter_list) & \
+        get_legitimate_name_mask(lineage_df['species'], stopwords)
+
+    return pd.DataFrame({
+        'key': lineage_df['species'][mask],
+        'taxid': lineage_df['tax_id'][mask],
+        'rank': ranks[mask],
+        'order': pd.Series(range(len(lineage_df)))[mask]
+    })
+
+def generate_truncated_taxid_dict(lineage_df, taxid_ranks, genera_filter_list, stopwords):
+    """
+    Vectorized equivalent of applying generate_truncated_dict_entry to every lineage in a dataframe.
+
+    :param lineage_df (DataFrame): lineages with columns tax_id, genus, species
+    :param taxid_ranks (dict): {taxid : NCBI rank} for every taxid in lineage_df
+    :param genera_filter_list (list): genera to keep species of
+    :param stopwords (list): organism names containing any of these words will be excluded
+    :return microorganism_taxid_dict (dict): {species name : {'taxid', 'rank'}}
+    """
+    return build_taxid_dict(get_truncated_taxid_dict_entries(lineage_df, taxid_ranks, genera_filter_list, stopwords))
+
+# Lineage names kept in snapshots, after the rank
+SNAPSHOT_LINEAGE_COLUMNS = ['genus', 'species', 'subspecies', 'varietas']
+
+def get_lineage_rows(lineage_df, taxid_ranks):
+    """
+    :param lineage_df (DataFrame): lineages with columns tax_id, genus, species, subspecies, varietas
+    :param taxid_ranks (dict): {taxid : NCBI rank} for every taxid in lineage_df
+    :return lineage_rows (dict): {taxid : [rank, genus, species, subspecies, varietas]} in lineage_df order, with
+                                 missing names as None
+    """
+    columns = [lineage_df[column].astype(object).where(lineage_df[column].notna(), None).tolist()
+               for column in SNAPSHOT_LINEAGE_COLUMNS]
+    return {taxid: [taxid_ranks.get(taxid)] + list(names)
+            for taxid, names in zip(lineage_df['tax_id'].tolist(), zip(*columns))}
+
+def get_lineage_df(lineage_rows):
+    """
+    :param lineage_rows (dict): {taxid : [rank, genus, species, subspecies, varietas]}, ex: from get_lineage_rows
+    :return (tuple): (DataFrame of lineages, {taxid : NCBI rank})
+    """
+    import pandas as pd
+
+    lineage_df = pd.DataFrame([[taxid] + row[1:] for taxid, row in lineage_rows.items()],
+                              columns=['tax_id'] + SNAPSHOT_LINEAGE_COLUMNS)
+    return lineage_df, {taxid: row[0] for taxid, row in lineage_rows.items()}
+
+def update_taxid_dict(snapshot, lineage_df, lineage_rows, taxid_ranks, generate_entries):
+    """
+    Bring the dict of a snapshot up to date with new lineages and ranks, rebuilding only affected entries.
+
+    Entries are rebuilt for every name that added, removed or changed lineages (a changed name or rank) produced before
+    or produce now, from the last lineage producing it, as in a full build.  Other entries are kept from the snapshot.
+    Names are ordered by the first lineage producing them, so the dict and the json written from it are the same as
+    those of a full build.
+
+    :param snapshot (dict): from load_taxid_snapshot
+    :param lineage_df (DataFrame): new lineages with columns tax_id, genus, species, subspecies, varietas
+    :param lineage_rows (dict): from get_lineage_rows(lineage_df, taxid_ranks)
+    :param taxid_ranks (dict): {taxid : NCBI rank} for every taxid in lineage_df
+    :param generate_entries (function): builds dict entries from a lineage DataFrame and its taxid ranks, ex:
+                                        get_taxid_dict_entries with its stopwords bound
+    :return (tuple): (updated microorganism taxid dict, changelog dict)
+    """
+    old_rows = {row[0]: row[1:] for row in snapshot['lineages']}
+    old_dict = snapshot['dict']
+
+    added = [taxid for taxid in lineage_rows if taxid not in old_rows]
+    removed = [taxid for taxid in old_rows if taxid not in lineage_rows]
+    changed = [taxid for taxid, row in lineage_rows.items() if taxid in old_rows and old_rows[taxid] != row]
+
+    # Names whose entries may have changed
+    touched_keys = set()
+    for rows, taxids in [(old_rows, removed + changed), (lineage_rows, added + changed)]:
+        if taxids:
+            touched_keys.update(generate_entries(*get_lineage_df({taxid: rows[taxid] for taxid in taxids}))['key'])
+
+    # Entry generation is vectorized; assembling entries into a dict is the per-entry work that is skipped
+    entries = generate_entries(lineage_df, taxid_ranks).sort_values('order', kind='stable')
+    key_order = entries['key'].drop_duplicates().tolist()
+    touched_entries = entries[entries['key'].isin(touched_keys)].drop_duplicates('key', keep='last')
+    regenerated_dict = build_taxid_dict(touched_entries)
+
+    microorganism_taxid_dict = {key: regenerated_dict[key] if key in touched_keys else old_dict[key]
+                                for key in key_order}
+
+    lineage_fields = ['rank'] + SNAPSHOT_LINEAGE_COLUMNS
+    changelog = {
+        'lineages_added': added,
+        'lineages_removed': removed,
+        'lineages_changed': [{'taxid': taxid,
+                              'old': dict(zip(lineage_fields, old_rows[taxid])),
+                              'new': dict(zip(lineage_fields, lineage_rows[taxid]))} for taxid in changed],
+        'entries_added': sorted(set(microorganism_taxid_dict).difference(old_dict)),
+        'entries_removed': sorted(set(old_dict).difference(microorganism_taxid_dict)),
+        'entries_changed': sorted(key for key in touched_keys if key in old_dict and key in microorganism_taxid_dict
+                                  and old_dict[key] != microorganism_taxid_dict[key])
+    }
+
+    return microorganism_taxid_dict, changelog
+
+def save_taxid_snapshot(snapshot_path, snapshot_inputs, lineage_rows, microorganism_taxid_dict):
+    """
+    :param snapshot_path (string): path of json file to write
+    :param snapshot_inputs (dict): dict type, stopwords and genera filter the dict was generated with
+    :param lineage_rows (dict): from get_lineage_rows
+    :param microorganism_taxid_dict (dict): generated dict, without manual additions
+    """
+    snapshot = {
+        'inputs': snapshot_inputs,
+        'lineages': [[taxid] + row for taxid, row in lineage_rows.items()],
+        'dict': microorganism_taxid_dict
+    }
+    # json.dumps encodes in C, json.dump to a file object does not
+    with open(snapshot_path, 'w') as f:
+        f.write(json.dumps(snapshot))
+
+def load_taxid_snapshot(snapshot_path, snapshot_inputs):
+    """
+    :param snapshot_path (string): path of json file written by save_taxid_snapshot
+    :param snapshot_inputs (dict): dict type, stopwords and genera filter of this run
+    :return snapshot (dict): {'inputs', 'lineages', 'dict'}, or None if missing or generated with other inputs
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+
+    with open(snapshot_path) as f:
+        snapshot = json.load(f)
+
+    if snapshot['inputs'] != snapshot_inputs:
+        return None
+    return snapshot
+
+def add_manual_entries(microorganism_taxid_dict):
     """
     Manual additions:
 
         These are included in the task specifications.
 
         “low G+C gram-positive bacteria”, synonym of Firmicutes
-        “high G+C gram-positive bacteria”, synonym of Actinobacteria 
+        “high G+C gram-positive bacteria”, synonym of Actinobacteria
+
+    :param microorganism_taxid_dict (dict): dict to add entries to
     """
+    phylum_taxids = get_taxonomy_lookup().get_name_translator(['Firmicutes', 'Actinobacteria'])
     microorganism_taxid_dict['low G+C gram-positive bacteria'] = {
 
-        'taxid': ncbi.get_name_translator(['Firmicutes']).get('Firmicutes'),
+        'taxid': phylum_taxids.get('Firmicutes'),
         'corrected_name': 'Firmicutes',
         'rank': 'phylum'
     }
     microorganism_taxid_dict['high G+C gram-positive bacteria'] = {
-        'taxid': ncbi.get_name_translator(['Actinobacteria']).get('Actinobacteria'),
+        'taxid': phylum_taxids.get('Actinobacteria'),
         'corrected_name': 'Actinobacteria',
         'rank': 'phylum'
     }
 
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract all terms linked to specified concept in obo format file and dump them to a json file.")
+    parser.add_argument('ncbi_lineage_file',
+                        help='Path to ncbi taxdump lineage file.  Each line is a taxonomic lineage.  Ex: ')
+    parser.add_argument('out_file', help='Path to json to dump microorganism taxid dict')
+    parser.add_argument('--compact_out_file',
+                        help='Path to also write the dict to in the memory-mappable format of compact_dictionary.py.')
+    parser.add_argument('--valid_taxids_file', default='./resources/BioNLP-OST-2019_BB-norm_Microorganism-ids.txt',
+                        help='List of BioNLP-BB-norm microorganism taxids, one per line.  Lineages of other taxids are skipped.')
+    parser.add_argument('--stopwords_file',
+                        help='Stopwords from bioNLP task description.  Species containing any of these words will be filtered out.')
+    parser.add_argument('--genera_filter_file',
+                        help='List of genera to filter to.  If present, output dict will only contain species of these genera.')
+    parser.add_argument('--chunksize', type=int, default=500000,
+                        help='Number of lineage file lines to read and filter at a time.')
+    parser.add_argument('--taxa_sqlite',
+                        help='Path to ete3 taxa.sqlite database.  Defaults to ~/.etetoolkit/taxa.sqlite, built by ete3 if missing.')
+    parser.add_argument('--taxdump_dir',
+                        help='Directory containing NCBI taxdump nodes.dmp and names.dmp.  If present, used instead of the ete3 database.')
+    parser.add_argument('--snapshot_file',
+                        help='Path to json snapshot of the previous run.  If it exists, only dict entries affected by lineage changes since that run are regenerated.  Rewritten after every run.')
+    parser.add_argument('--changelog_file',
+                        help='Path to json file to write the lineage and dict entry changes since the snapshot to.')
+    pipeline_metrics.add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profiler = pipeline_metrics.start_run(args)
+
+    """
+    Read NCBI lineages from file and filter them to bacterial lineages with taxids belonging to the BioNLP-BB-norm specified list
+    of usable taxids.
+    """
+    from ncbi_taxonomy import NCBITaxonomyLookup
+
+    global taxonomy_lookup
+    taxonomy_lookup = NCBITaxonomyLookup(taxa_sqlite_path=args.taxa_sqlite, taxdump_dir=args.taxdump_dir)
+
+    print("Generating dataframe of bacterial candidates from NCBI lineages and BioNLP taxids...")
+    valid_taxids = set(int(line) for line in open(args.valid_taxids_file) if line.strip())
+
+    with pipeline_metrics.stage('load_bacteria_lineages') as timer:
+        valid_bacteria_df, lineage_counts = load_bacteria_lineages(args.ncbi_lineage_file, valid_taxids,
+                                                                   chunksize=args.chunksize)
+    elapsed = timer.seconds
+    pipeline_metrics.count('lineages_read', lineage_counts['total'])
+    pipeline_metrics.count('lineages_valid', lineage_counts['valid'])
+    pipeline_metrics.count('lineages_bacteria', lineage_counts['bacteria'])
+
+    print("Total number of NCBI lineages = %d" % lineage_counts['total'])
+    print("Lineages with valid microorganism taxids = %d" % lineage_counts['valid'])
+    print("Lineages with superkingdom bacteria and valid microorganism taxids = %d" % lineage_counts['bacteria'])
+    print("Read lineages in %.1fs (%.0f rows/sec), peak RSS %.1f MB" % (
+        elapsed, lineage_counts['total'] / elapsed if elapsed else 0, pipeline_metrics.get_peak_rss_mb()))
+
+    # If a stopwords file has been specified, read stopwords into list
+    stopwords = []
+    if args.stopwords_file:
+        stopwords = [line.rstrip('\n') for line in open(args.stopwords_file)]
+    """
+    Look up the ranks of all lineage taxids in one batch.
+    
+    If a list of genera to filter to is specified, generate only species-level entries for lineages in one of these genera.
+
+    Otherwise, for each lineage, add an entry for the rightmost, usable name (of genus, species, subspecies, varietas).  
+    """
+    with pipeline_metrics.stage('get_rank'):
+        taxid_ranks = taxonomy_lookup.get_rank([int(taxid) for taxid in valid_bacteria_df['tax_id'].unique()])
+    pipeline_metrics.count('ranks_looked_up', len(taxid_ranks))
+
+    filter_genera = []
+    if args.genera_filter_file:
+
+        dict_type = 'truncated'
+        filter_genera = [line.rstrip('\n') for line in open(args.genera_filter_file)]
+        generate_entries = lambda lineage_df, ranks: get_truncated_taxid_dict_entries(lineage_df, ranks, filter_genera,
+                                                                                      stopwords)
+    else:
+        dict_type = 'full'
+        generate_entries = lambda lineage_df, ranks: get_taxid_dict_entries(lineage_df, ranks, stopwords)
+
+    # A snapshot is only reusable for the same kind of dict.  Changes to the valid taxids show up as lineage changes.
+    snapshot_inputs = {'dict_type': dict_type, 'stopwords': stopwords, 'genera_filter': filter_genera}
+    snapshot = None
+    lineage_rows = None
+    if args.snapshot_file:
+        with pipeline_metrics.stage('load_snapshot'):
+            snapshot = load_taxid_snapshot(args.snapshot_file, snapshot_inputs)
+        if snapshot is None:
+            print("No snapshot of a %s dict with these stopwords and genera in %s, generating all entries." % (
+                dict_type, args.snapshot_file))
+        lineage_rows = get_lineage_rows(valid_bacteria_df, taxid_ranks)
+
+    changelog = {'lineage_file': os.path.abspath(args.ncbi_lineage_file), 'incremental': snapshot is not None}
+    if snapshot is not None:
+        print("Updating %s microorganism taxid dict from snapshot %s..." % (dict_type, args.snapshot_file))
+        with pipeline_metrics.stage('update_taxid_dict') as timer:
+            microorganism_taxid_dict, dict_changelog = update_taxid_dict(snapshot, valid_bacteria_df, lineage_rows,
+                                                                         taxid_ranks, generate_entries)
+        changelog.update(dict_changelog)
+        print("Lineages: %d added, %d removed, %d changed.  Entries: %d added, %d removed, %d changed.  Updated in %.2fs." % (
+            len(dict_changelog['lineages_added']), len(dict_changelog['lineages_removed']),
+            len(dict_changelog['lineages_changed']), len(dict_changelog['entries_added']),
+            len(dict_changelog['entries_removed']), len(dict_changelog['entries_changed']), timer.seconds))
+    else:
+        with pipeline_metrics.stage('generate_taxid_dict'):
+            microorganism_taxid_dict = build_taxid_dict(generate_entries(valid_bacteria_df, taxid_ranks))
+
+    if args.snapshot_file:
+        print("Writing snapshot to %s..." % args.snapshot_file)
+        with pipeline_metrics.stage('save_snapshot'):
+            save_taxid_snapshot(args.snapshot_file, snapshot_inputs, lineage_rows, microorganism_taxid_dict)
+
+    if args.changelog_file:
+        print("Writing changelog to %s..." % args.changelog_file)
+        with open(args.changelog_file, 'w') as f:
+            json.dump(changelog, f, indent=1)
+
+    add_manual_entries(microorganism_taxid_dict)
+
     print("Number of entries in %s microorganism taxid dict: %d" % (dict_type, len(microorganism_taxid_dict)))
+    pipeline_metrics.count('dict_entries', len(microorganism_taxid_dict))
     print("Writing microorganism taxid dict to %s..." % args.out_file)
-    with open(args.out_file, 'w') as f:
+    with pipeline_metrics.stage('write_json'), open(args.out_file, 'w') as f:
         json.dump(microorganism_taxid_dict, f)
+
+    if args.compact_out_file:
+        from compact_dictionary import write_compact_dictionary
+
+        print("Writing compact microorganism taxid dict to %s..." % args.compact_out_file)
+        with pipeline_metrics.stage('write_compact_dictionary'):
+            write_compact_dictionary(microorganism_taxid_dict, args.compact_out_file)
+
+    pipeline_metrics.finish_run(args, profiler)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import collections
+import os
+import sqlite3
+
+import numpy as np
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It provides batched, cached NCBI taxonomy lookups (taxid -> rank, name <-> taxid) for generate_bacteria_taxid_dict.py,
+in place of per-taxid ete3 NCBITaxa queries.  Nothing is loaded until the first lookup.
+
+Two sources are supported:
+    -The SQLite database built by ete3 (~/.etetoolkit/taxa.sqlite by default).  If it does not exist, ete3 is imported
+     and NCBITaxa() is constructed once to build it.
+    -A local NCBI taxdump directory containing nodes.dmp and names.dmp (ftp://ftp.ncbi.nih.gov/pub/taxonomy/taxdump.tar.gz).
+
+Ranks are held in a compact numpy array indexed by taxid (one int16 rank code per taxid).  Name lookups are kept in an
+LRU cache.
+"""
+
+ETE3_TAXA_SQLITE_PATH = os.path.join(os.path.expanduser('~'), '.etetoolkit', 'taxa.sqlite')
+
+# SQLite's default limit on the number of ? parameters in one query
+SQLITE_MAX_VARIABLES = 999
+
+# Above this many unknown taxids, a single scan of the species table is faster than batched IN (...) queries
+FULL_RANK_LOAD_THRESHOLD = 200000
+
+RANK_NOT_LOADED = -1
+RANK_MISSING = -2
+
+class LRUCache(object):
+    """
+    Minimal least-recently-used mapping with a fixed number of entries.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+def iter_dmp_rows(dmp_path):
+    """
+    :param dmp_path (string): path to an NCBI taxdump .dmp file
+    :return: generator of field lists, ex: ['2', '131567', 'superkingdom', ...] for a nodes.dmp line
+    """
+    with open(dmp_path) as f:
+        for line in f:
+            yield line.rstrip('\t|\n').split('\t|\t')
+
+class NCBITaxonomyLookup(object):
+    """
+    Batched NCBI taxonomy lookups from ete3's SQLite database or a local taxdump.
+
+    get_rank, get_name_translator and get_taxid_translator return the same structures as the ete3 NCBITaxa methods of
+    the same names, so either can be used by callers.
+    """
+
+    def __init__(self, taxa_sqlite_path=None, taxdump_dir=None, name_cache_size=100000):
+        """
+        :param taxa_sqlite_path (string): path to ete3 taxa.sqlite.  Defaults to ete3's location.
+        :param taxdump_dir (string): directory containing nodes.dmp and names.dmp.  Used instead of SQLite if given.
+        :param name_cache_size (int): number of name -> taxids and taxid -> name lookups to keep cached
+        """
+        self.taxa_sqlite_path = taxa_sqlite_path
+        self.taxdump_dir = taxdump_dir
+        self._connection = None
+
+        self.rank_names = []
+        self.rank_codes = {}
+        self.taxid_rank_codes = np.full(0, RANK_NOT_LOADED, dtype=np.int16)
+        self.all_ranks_loaded = False
+
+        self.name_taxids_cache = LRUCache(name_cache_size)
+        self.taxid_name_cache = LRUCache(name_cache_size)
+
+    def _get_connection(self):
+        if self._connection is None:
+            sqlite_path = self.taxa_sqlite_path or ETE3_TAXA_SQLITE_PATH
+            if not os.path.exists(sqlite_path):
+                # Let ete3 download the taxdump and build its database
+                from ete3 import NCBITaxa
+                sqlite_path = NCBITaxa(dbfile=self.taxa_sqlite_path).dbfile
+            self._connection = sqlite3.connect(sqlite_path)
+        return self._connection
+
+    def _query_in_batches(self, query, values):
+        """
+        Run a query of the form '... IN (%s)' over values, at most SQLITE_MAX_VARIABLES at a time.
+
+        :return: generator of result rows
+        """
+        connection = self._get_connection()
+        for i in range(0, len(values), SQLITE_MAX_VARIABLES):
+            batch = values[i:i + SQLITE_MAX_VARIABLES]
+            for row in connection.execute(query % ','.join('?' * len(batch)), batch):
+                yield row
+
+    def _get_rank_code(self, rank):
+        rank_code = self.rank_codes.get(rank)
+        if rank_code is None:
+            rank_code = len(self.rank_names)
+            self.rank_codes[rank] = rank_code
+            self.rank_names.append(rank)
+        return rank_code
+
+    def _ensure_capacity(self, max_taxid):
+        if max_taxid >= len(self.taxid_rank_codes):
+            fill_value = RANK_MISSING if self.all_ranks_loaded else RANK_NOT_LOADED
+            rank_codes = np.full(max(max_taxid + 1, 2 * len(self.taxid_rank_codes)), fill_value, dtype=np.int16)
+            rank_codes[:len(self.taxid_rank_codes)] = self.taxid_rank_codes
+            self.taxid_rank_codes = rank_codes
+
+    def _store_ranks(self, taxid_rank_pairs):
+        for taxid, rank in taxid_rank_pairs:
+            taxid = int(taxid)
+            self._ensure_capacity(taxid)
+            self.taxid_rank_codes[taxid] = self._get_rank_code(rank)
+
+    def load_all_ranks(self):
+        """
+        Load the rank of every taxid in a single pass over nodes.dmp or the species table.
+        """
+        if self.all_ranks_loaded:
+            return
+
+        if self.taxdump_dir:
+            self._store_ranks((row[0], row[2]) for row in iter_dmp_rows(os.path.join(self.taxdump_dir, 'nodes.dmp')))
+        else:
+            self._store_ranks(self._get_connection().execute('SELECT taxid, rank FROM species'))
+
+        self.taxid_rank_codes[self.taxid_rank_codes == RANK_NOT_LOADED] = RANK_MISSING
+        self.all_ranks_loaded = True
+
+    def _load_ranks(self, taxids):
+        """
+        Load ranks of taxids that have not been looked up yet.
+
+        :param taxids (ndarray): int64 taxids
+        """
+        if self.all_ranks_loaded or not len(taxids):
+            return
+
+        self._ensure_capacity(int(taxids.max()))
+        unknown_taxids = np.unique(taxids[self.taxid_rank_codes[taxids] == RANK_NOT_LOADED])
+
+        # nodes.dmp has no index, and very large batches are faster to load in one scan
+        if self.taxdump_dir or len(unknown_taxids) > FULL_RANK_LOAD_THRESHOLD:
+            self.load_all_ranks()
+            return
+
+        self._store_ranks(self._query_in_batches('SELECT taxid, rank FROM species WHERE taxid IN (%s)',
+                                                 unknown_taxids.tolist()))
+        still_unknown = unknown_taxids[self.taxid_rank_codes[unknown_taxids] == RANK_NOT_LOADED]
+        self.taxid_rank_codes[still_unknown] = RANK_MISSING
+
+    def get_ranks(self, taxids):
+        """
+        :param taxids (list): NCBI taxonomic identifiers
+        :return ranks (list): rank of each taxid, or None if the taxid is not in the taxonomy
+        """
+        taxids = np.asarray(taxids, dtype=np.int64)
+        self._load_ranks(taxids)
+        self._ensure_capacity(int(taxids.max()) if len(taxids) else 0)
+
+        # RANK_NOT_LOADED (-1) and RANK_MISSING (-2) index the two trailing Nones
+        rank_lookup = self.rank_names + [None, None]
+        return [rank_lookup[rank_code] for rank_code in self.taxid_rank_codes[taxids].tolist()]
+
+    def get_rank(self, taxids):
+        """
+        :param taxids (list): NCBI taxonomic identifiers
+        :return (dict): {taxid : rank} for taxids present in the taxonomy, as returned by ete3 NCBITaxa.get_rank
+        """
+        return {int(taxid): rank for taxid, rank in zip(taxids, self.get_ranks(taxids)) if rank is not None}
+
+    def _scan_names_dmp(self, names=None, taxids=None):
+        """
+        Look up names and/or taxids with one scan of names.dmp.  Scientific names are preferred; other name classes are
+        only used for names without a scientific match.
+
+        :return (tuple): ({name : [taxids]}, {taxid : scientific name})
+        """
+        names = set(names or ())
+        taxids = set(taxids or ())
+        scientific_matches = {}
+        other_matches = {}
+        taxid_names = {}
+
+        for taxid, name, _, name_class in iter_dmp_rows(os.path.join(self.taxdump_dir, 'names.dmp')):
+            taxid = int(taxid)
+            if name_class == 'scientific name' and taxid in taxids:
+                taxid_names[taxid] = name
+            if name in names:
+                matches = scientific_matches if name_class == 'scientific name' else other_matches
+                matches.setdefault(name, []).append(taxid)
+
+        for name, name_taxids in other_matches.items():
+            scientific_matches.setdefault(name, sorted(set(name_taxids)))
+
+        return scientific_matches, taxid_names
+
+    def get_name_translator(self, names):
+        """
+        :param names (list): organism names
+        :return (dict): {name : [taxids]} for names found in the taxonomy, as returned by ete3 NCBITaxa.get_name_translator
+        """
+        name_translator = {}
+        missing_names = []
+        for name in names:
+            name_taxids = self.name_taxids_cache.get(name)
+            if name_taxids is None and name not in self.name_taxids_cache:
+                missing_names.append(name)
+            elif name_taxids is not None:
+                name_translator[name] = name_taxids
+
+        if missing_names:
+            if self.taxdump_dir:
+                found, _ = self._scan_names_dmp(names=missing_names)
+            else:
+                # Names are matched case-insensitively by the database collation, so map results back via lower case
+                requested = {name.lower(): name for name in missing_names}
+                found = {}
+                for query in ['SELECT spname, taxid FROM species WHERE spname IN (%s)',
+                              'SELECT spname, taxid FROM synonym WHERE spname IN (%s)']:
+                    unmatched = [name for name in missing_names if name not in found]
+                    for spname, taxid in self._query_in_batches(query, unmatched):
+                        name = requested.get(spname.lower())
+                        if name is not None:
+                            found.setdefault(name, []).append(int(taxid))
+
+            for name in missing_names:
+                name_taxids = found.get(name)
+                self.name_taxids_cache.put(name, name_taxids)
+                if name_taxids is not None:
+                    name_translator[name] = name_taxids
+
+        return name_translator
+
+    def get_taxid_translator(self, taxids):
+        """
+        :param taxids (list): NCBI taxonomic identifiers
+        :return (dict): {taxid : scientific name}, as returned by ete3 NCBITaxa.get_taxid_translator
+        """
+        taxid_translator = {}
+        missing_taxids = []
+        for taxid in taxids:
+            taxid = int(taxid)
+            name = self.taxid_name_cache.get(taxid)
+            if name is None and taxid not in self.taxid_name_cache:
+                missing_taxids.append(taxid)
+            elif name is not None:
+                taxid_translator[taxid] = name
+
+        if missing_taxids:
+            if self.taxdump_dir:
+                _, found = self._scan_names_dmp(taxids=missing_taxids)
+            else:
+                found = {int(taxid): spname for taxid, spname in
+                         self._query_in_batches('SELECT taxid, spname FROM species WHERE taxid IN (%s)', missing_taxids)}
+
+            for taxid in missing_taxids:
+                self.taxid_name_cache.put(taxid, found.get(taxid))
+                if taxid in found:
+                    taxid_translator[taxid] = found[taxid]
+
+        return taxid_translator
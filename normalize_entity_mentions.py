@@ -0,0 +1,444 @@
+import argparse
+import array
+import collections
+import re
+import time
+
+from annotate_texts_with_entity_dictionaries import (MULTIPLE_SPACES_PATTERN, iter_dictionary_entries,
+                                                     iter_dictionary_file_entries, normalize_key, parse_dictionary_spec)
+
+"""
+This module/script is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It normalizes entity mentions (ex: 'S. aureus', 'soil, garden', 'Staphylococus aureus') to the taxids and OntoBiotope
+IDs of the dictionaries written by generate_bacteria_taxid_dict.py and extract_obo_category_nodes.py.  Dictionary keys
+are the names and EXACT synonyms of each entity.
+
+Names and mentions are folded before matching: lower-cased, whitespace collapsed as the annotator does, and hyphens,
+underscores, slashes, commas and semicolons read as spaces (convert_node_list_to_dict already reads hyphens in synonyms
+as spaces).  A mention is then matched by the first of these stages that finds a name:
+    -exact: the folded mention is a folded name
+    -abbreviation: the first word is an abbreviated genus, ex: 'S aureus', 'Staph. aureus' -> Staphylococcus aureus
+    -reordered: the folded mention has the words of a name in another order, ex: 'soil, garden' -> garden soil
+    -fuzzy: names within a few character edits (Levenshtein distance), see EntityNormalizer.get_max_edits.  Candidates
+     are names sharing enough of the rarest character trigrams of the mention, which every name within the edit bound
+     does, and are then compared with a bounded edit distance (rapidfuzz's if installed: pip install rapidfuzz).
+
+Mentions are looked up in batches with EntityNormalizer.lookup_batch, which looks each distinct mention up once.
+
+    python normalize_entity_mentions.py mentions.txt normalized.tsv \
+        --dictionary Microorganism=microorganism_taxid_dict.json --dictionary Habitat=microbial_habitat.json
+
+mentions.txt has one 'LABEL<tab>mention' per line, or one mention per line if a single label is given.
+"""
+
+# Read as spaces when folding names, in addition to whitespace
+FOLDED_PUNCTUATION_TRANSLATION = str.maketrans('-_/,;', '     ')
+
+# Mentions shorter than this are only matched exactly
+MIN_FUZZY_LENGTH = 4
+
+# Mentions shorter than this are matched within 1 edit, longer ones within max_edits
+MIN_MAX_EDITS_LENGTH = 10
+
+TRIGRAM_PADDING = '  '
+
+NormalizationMatch = collections.namedtuple('NormalizationMatch', ['referent', 'normalization_type', 'name',
+                                                                   'match_type', 'distance'])
+NormalizationMatch.__doc__ = """
+    A dictionary entry a mention was normalized to.
+
+    referent (str): taxid or OntoBiotope ID, or None for dictionary entries without one
+    normalization_type (str): 'NCBI_Taxonomy' or 'OntoBiotope'
+    name (str): dictionary name or synonym that matched
+    match_type (str): 'exact', 'abbreviation', 'reordered' or 'fuzzy'
+    distance (int): edit distance between the folded mention and name, 0 unless match_type is 'fuzzy'
+"""
+
+def fold_name(name):
+    """
+    :param name (str): dictionary name or mention
+    :return (str): folded name, ex: 'Soil-borne  Bacteria;' -> 'soil borne bacteria'
+    """
+    folded = normalize_key(name).translate(FOLDED_PUNCTUATION_TRANSLATION)
+    return MULTIPLE_SPACES_PATTERN.sub(' ', folded).strip(' .')
+
+def get_trigrams(folded_name):
+    """
+    :param folded_name (str): folded name
+    :return (set): distinct character trigrams of the name padded with 2 spaces on each side
+    """
+    padded = '%s%s%s' % (TRIGRAM_PADDING, folded_name, TRIGRAM_PADDING)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def bounded_levenshtein(a, b, max_distance):
+    """
+    Levenshtein distance computed only within max_distance of the diagonal, stopping as soon as it exceeds max_distance.
+
+    :param a (str): string
+    :param b (str): string
+    :param max_distance (int): largest distance of interest
+    :return (int): edit distance of a and b, or max_distance + 1 if it is larger than max_distance
+    """
+    too_far = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return too_far
+
+    previous = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        current[0] = i if i <= max_distance else too_far
+        row_min = current[0]
+        char_a = a[i - 1]
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            distance = previous[j - 1] + (char_a != b[j - 1])
+            if previous[j] + 1 < distance:
+                distance = previous[j] + 1
+            if current[j - 1] + 1 < distance:
+                distance = current[j - 1] + 1
+            current[j] = distance
+            if distance < row_min:
+                row_min = distance
+        if row_min > max_distance:
+            return too_far
+        previous = current
+
+    return min(previous[-1], too_far)
+
+def get_edit_distance_function():
+    """
+    :return (function): (a, b, max_distance) -> bounded edit distance, rapidfuzz's Levenshtein distance if rapidfuzz is
+                        installed, otherwise bounded_levenshtein
+    """
+    try:
+        from rapidfuzz.distance import Levenshtein
+    except ImportError:
+        return bounded_levenshtein
+    return lambda a, b, max_distance: Levenshtein.distance(a, b, score_cutoff=max_distance)
+
+class EntityNormalizer(object):
+    """
+    Index of the names of one or more entity dictionaries.  Dictionaries are added with add_dictionary or add_entries, and
+    mentions are then normalized with lookup or lookup_batch.
+    """
+
+    def __init__(self, max_edits=2):
+        """
+        :param max_edits (int): largest edit distance of fuzzy matches of long mentions (see get_max_edits)
+        """
+        self.max_edits = max_edits
+        self.edit_distance = get_edit_distance_function()
+        # Folded names, indexed by name id
+        self.folded_names = []
+        # [(dictionary name, normalization type, referent ID or None)] of each name id
+        self.name_entries = []
+        self.name_ids = {}
+        # {sorted words : [name id]}
+        self.word_set_ids = {}
+        # {(first letter, other words) : [name id]} of names of several words, other than abbreviated names
+        self.abbreviation_ids = {}
+        # Lengths of the folded names, indexed by name id
+        self.name_lengths = array.array('i')
+        # {trigram : array of name ids}
+        self.trigram_postings = {}
+
+    def __len__(self):
+        return len(self.folded_names)
+
+    def add_dictionary(self, entity_dict):
+        """
+        :param entity_dict (dict): taxid dict or obo category dict (see iter_dictionary_entries)
+        """
+        self.add_entries(iter_dictionary_entries(entity_dict))
+
+    def add_entries(self, entries):
+        """
+        :param entries (iterable): (name, normalization type, list of referent IDs) tuples, ex: from iter_dictionary_entries
+        """
+        for name, normalization_type, referents in entries:
+            folded_name = fold_name(name)
+            if not folded_name:
+                continue
+
+            name_id = self.name_ids.get(folded_name)
+            if name_id is None:
+                name_id = self._add_folded_name(folded_name)
+
+            name_entries = self.name_entries[name_id]
+            for referent in referents or [None]:
+                entry = (name, normalization_type, referent)
+                if entry not in name_entries:
+                    name_entries.append(entry)
+
+    def _add_folded_name(self, folded_name):
+        name_id = len(self.folded_names)
+        self.folded_names.append(folded_name)
+        self.name_lengths.append(len(folded_name))
+        self.name_entries.append([])
+        self.name_ids[folded_name] = name_id
+
+        words = folded_name.split(' ')
+        self.word_set_ids.setdefault(' '.join(sorted(words)), []).append(name_id)
+        if len(words) > 1 and len(words[0]) > 1 and not words[0].endswith('.'):
+            self.abbreviation_ids.setdefault((words[0][0], ' '.join(words[1:])), []).append(name_id)
+
+        for trigram in get_trigrams(folded_name):
+            postings = self.trigram_postings.get(trigram)
+            if postings is None:
+                postings = self.trigram_postings[trigram] = array.array('i')
+            postings.append(name_id)
+
+        return name_id
+
+    def get_max_edits(self, length):
+        """
+        :param length (int): length of a folded mention
+        :return (int): largest edit distance of fuzzy matches of the mention: 0 below MIN_FUZZY_LENGTH characters, 1
+                       below MIN_MAX_EDITS_LENGTH, max_edits otherwise
+        """
+        if length < MIN_FUZZY_LENGTH:
+            return 0
+        if length < MIN_MAX_EDITS_LENGTH:
+            return min(1, self.max_edits)
+        return self.max_edits
+
+    def _get_matches(self, name_ids, match_type, distance=0):
+        return [NormalizationMatch(referent, normalization_type, name, match_type, distance)
+                for name_id in sorted(name_ids) for name, normalization_type, referent in self.name_entries[name_id]]
+
+    def _find_abbreviations(self, words):
+        # 'S. aureus', 'S aureus' and 'Staph. aureus' all abbreviate Staphylococcus aureus
+        first_word = words[0]
+        if len(words) < 2 or not (first_word.endswith('.') or len(first_word) == 1):
+            return []
+
+        prefix = first_word.rstrip('.')
+        if not prefix:
+            return []
+
+        other_words = ' '.join(words[1:])
+        name_ids = [name_id for name_id in self.abbreviation_ids.get((prefix[0], other_words), [])
+                    if self.folded_names[name_id].startswith(prefix)]
+
+        # Abbreviated dictionary names, ex: 'E coli' -> E. coli
+        abbreviated_name_id = self.name_ids.get('%s. %s' % (prefix, other_words))
+        if abbreviated_name_id is not None and abbreviated_name_id not in name_ids:
+            name_ids.append(abbreviated_name_id)
+        return name_ids
+
+    def _find_fuzzy(self, folded_mention):
+        import numpy as np
+
+        max_edits = self.get_max_edits(len(folded_mention))
+        if not max_edits:
+            return [], None
+
+        # An edit changes at most 3 trigrams, so a name within d edits shares at least n - 3 * d of the n trigrams of the
+        # mention, and at least one of any 3 * d + 1 of them.  Candidates come from the shortest posting lists, and are
+        # then counted in the longer ones.
+        trigrams = get_trigrams(folded_mention)
+        n_candidate_trigrams = 3 * max_edits + 1
+        min_count = len(trigrams) - 3 * max_edits
+        if min_count < 1:
+            return [], None
+
+        postings = sorted((self.trigram_postings.get(trigram, ()) for trigram in trigrams), key=len)
+        candidate_postings = [np.frombuffer(name_ids, dtype=np.intc) for name_ids in postings[:n_candidate_trigrams]
+                              if name_ids]
+        if not candidate_postings:
+            return [], None
+
+        candidate_ids, counts = np.unique(np.concatenate(candidate_postings), return_counts=True)
+        for i, name_ids in enumerate(postings[n_candidate_trigrams:]):
+            # Drop candidates that would fall short of min_count even if they were in every remaining list
+            keep = counts + (len(postings) - n_candidate_trigrams - i) >= min_count
+            candidate_ids, counts = candidate_ids[keep], counts[keep]
+            if not len(candidate_ids):
+                return [], None
+
+            # Posting lists are sorted, since name ids are added in increasing order
+            name_ids = np.frombuffer(name_ids, dtype=np.intc)
+            positions = np.minimum(np.searchsorted(name_ids, candidate_ids), len(name_ids) - 1)
+            counts = counts + (name_ids[positions] == candidate_ids)
+
+        mention_length = len(folded_mention)
+        name_lengths = np.frombuffer(self.name_lengths, dtype=np.intc)
+        keep = (counts >= min_count) & (np.abs(name_lengths[candidate_ids] - mention_length) <= max_edits)
+        candidate_ids, counts = candidate_ids[keep], counts[keep]
+
+        # Candidates sharing the most trigrams are compared first, so the edit bound tightens early
+        order = np.argsort(-counts, kind='stable')
+        best_distance = max_edits
+        best_ids = []
+        for name_id, count in zip(candidate_ids[order].tolist(), counts[order].tolist()):
+            if count < len(trigrams) - 3 * best_distance:
+                break
+
+            folded_name = self.folded_names[name_id]
+            if abs(len(folded_name) - mention_length) > best_distance:
+                continue
+
+            distance = self.edit_distance(folded_mention, folded_name, best_distance)
+            if distance < best_distance:
+                best_distance = distance
+                best_ids = [name_id]
+            elif distance == best_distance:
+                best_ids.append(name_id)
+
+        return best_ids, best_distance
+
+    def lookup(self, mention):
+        """
+        :param mention (str): entity mention, ex: 'S. aureus'
+        :return matches (list): NormalizationMatch tuples of the first matching stage (see module docstring), empty if
+                                no name matched
+        """
+        folded_mention = fold_name(mention)
+        if not folded_mention:
+            return []
+
+        name_id = self.name_ids.get(folded_mention)
+        if name_id is not None:
+            return self._get_matches([name_id], 'exact')
+
+        words = folded_mention.split(' ')
+        name_ids = self._find_abbreviations(words)
+        if name_ids:
+            return self._get_matches(name_ids, 'abbreviation')
+
+        name_ids = self.word_set_ids.get(' '.join(sorted(words)))
+        if name_ids:
+            return self._get_matches(name_ids, 'reordered')
+
+        name_ids, distance = self._find_fuzzy(folded_mention)
+        return self._get_matches(name_ids, 'fuzzy', distance)
+
+    def lookup_batch(self, mentions):
+        """
+        :param mentions (iterable): entity mentions
+        :return (list): list of NormalizationMatch tuples (see lookup) for each mention, in order.  Repeated mentions are
+                        looked up once and share their list.
+        """
+        mention_matches = {}
+        batch_matches = []
+        for mention in mentions:
+            matches = mention_matches.get(mention)
+            if matches is None:
+                matches = mention_matches[mention] = self.lookup(mention)
+            batch_matches.append(matches)
+        return batch_matches
+
+def load_normalizers(dictionary_specs, max_edits=2):
+    """
+    :param dictionary_specs (list): (label, path to dictionary json or compact dictionary) tuples.  Dictionaries with the
+                                    same label are indexed together.
+    :param max_edits (int): see EntityNormalizer
+    :return normalizers (dict): {label : EntityNormalizer}
+    """
+    normalizers = collections.OrderedDict()
+    for label, dictionary_path in dictionary_specs:
+        if label not in normalizers:
+            normalizers[label] = EntityNormalizer(max_edits=max_edits)
+        normalizers[label].add_entries(iter_dictionary_file_entries(dictionary_path))
+    return normalizers
+
+# BioNLP text-bound and normalization annotation lines, ex:
+#   T3	Microorganism 0 21	Staphylococcus aureus
+#   N1	NCBI_Taxonomy Annotation:T3 Referent:1280
+BIONLP_NORMALIZATION_PATTERN = re.compile(r'^N\d+\t\S+ Annotation:(?P<t_id>T\d+) Referent:(?P<referent>\S+)')
+
+def read_document_mentions(document, labels=None):
+    """
+    Read the entity mentions of a BioNLP document with their reference normalizations, ex: to evaluate a normalizer on
+    BB-norm.
+
+    :param document (BioNLPDocument): from bionlp_corpus_index.load_corpus_manifest
+    :param labels (collection): entity labels to keep, or None for every label other than Title and Paragraph
+    :return mentions (list): (entity label, mention text, set of reference referent IDs) tuples
+    """
+    lines = []
+    for path in [document.text_file, document.ann_file]:
+        with open(path) as f:
+            lines += f.read().splitlines()
+
+    entities = collections.OrderedDict()
+    referents = collections.defaultdict(set)
+    for line in lines:
+        fields = line.split('\t')
+        if line.startswith('T') and len(fields) >= 3:
+            label = fields[1].split(' ', 1)[0]
+            if label not in ('Title', 'Paragraph') and (labels is None or label in labels):
+                entities[fields[0]] = (label, fields[2])
+        else:
+            normalization_match = BIONLP_NORMALIZATION_PATTERN.match(line)
+            if normalization_match:
+                referents[normalization_match.group('t_id')].add(normalization_match.group('referent'))
+
+    return [(label, text, referents[t_id]) for t_id, (label, text) in entities.items()]
+
+def read_mentions_file(mentions_path, labels):
+    """
+    :param mentions_path (str): file of 'LABEL<tab>mention' lines, or of mention lines if there is a single label
+    :param labels (list): labels of the loaded dictionaries
+    :return mentions (list): (label, mention) tuples
+    """
+    mentions = []
+    with open(mentions_path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+
+            label, separator, mention = line.partition('\t')
+            if not separator:
+                if len(labels) > 1:
+                    raise ValueError("Mention without a label in %s: '%s'.  Expected LABEL<tab>mention lines." % (
+                        mentions_path, line))
+                label, mention = labels[0], line
+            mentions.append((label, mention))
+    return mentions
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Normalize entity mentions to the taxids and OntoBiotope IDs of entity dictionaries.")
+    parser.add_argument('mentions_file',
+                        help="File of 'LABEL<tab>mention' lines, or of mention lines if a single --dictionary label is given.")
+    parser.add_argument('out_file',
+                        help='Path to write tab-separated label, mention, match type, edit distance, referent, normalization type and matched name lines to.')
+    parser.add_argument('--dictionary', type=parse_dictionary_spec, action='append', required=True,
+                        help='LABEL=PATH of an entity dictionary json or compact dictionary, ex: Microorganism=taxid_dict.json.  Repeat for each dictionary.')
+    parser.add_argument('--max_edits', type=int, default=2, help='Largest edit distance of fuzzy matches.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    normalizers = load_normalizers(args.dictionary, max_edits=args.max_edits)
+    print("Indexed %s in %.1fs." % (', '.join('%d %s names' % (len(normalizer), label)
+                                              for label, normalizer in normalizers.items()), time.perf_counter() - start))
+
+    mentions = read_mentions_file(args.mentions_file, list(normalizers))
+    unknown_labels = set(label for label, _ in mentions).difference(normalizers)
+    if unknown_labels:
+        parser.error('No --dictionary for labels: %s' % ', '.join(sorted(unknown_labels)))
+
+    start = time.perf_counter()
+    label_mentions = collections.defaultdict(list)
+    for label, mention in mentions:
+        label_mentions[label].append(mention)
+    label_matches = {label: iter(normalizers[label].lookup_batch(label_mentions[label])) for label in label_mentions}
+    elapsed = time.perf_counter() - start
+
+    n_normalized = 0
+    with open(args.out_file, 'w') as f:
+        for label, mention in mentions:
+            matches = next(label_matches[label])
+            n_normalized += bool(matches)
+            for match in matches or [NormalizationMatch(None, None, None, None, None)]:
+                f.write('\t'.join('' if i is None else str(i) for i in
+                                  [label, mention, match.match_type, match.distance, match.referent,
+                                   match.normalization_type, match.name]) + '\n')
+
+    print("Normalized %d of %d mentions in %.2fs (%.1f us/mention) -> %s" % (
+        n_normalized, len(mentions), elapsed, elapsed / len(mentions) * 1e6 if mentions else 0, args.out_file))
+
+if __name__ == "__main__":
+    main()
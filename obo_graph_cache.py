@@ -0,0 +1,201 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from compact_obo_graph import CompactOboGraph, CompactAncestorIndex
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It caches parsed .obo files on disk so that repeated extractions from the same ontology skip parsing and the is_a
+closure computation.  A cache entry holds a CompactOboGraph and its ancestor closure as .npy arrays (memory-mapped when
+loaded) plus a UTF-8 string table of term ids, names and synonyms.
+
+Entries are named after the sha1 of the .obo file's contents.  An index.json in the cache directory maps each .obo path
+to its last seen size, mtime and sha1, so a warm lookup only needs a stat() of the file; the file is re-hashed only if
+its size or mtime changed, and a new entry is built only if its contents changed.
+
+Cache layout:
+    <cache_dir>/index.json
+    <cache_dir>/<sha1>-v<CACHE_FORMAT_VERSION>/strings.bin, string_offsets.npy, term_ids.npy, names.npy, ...
+"""
+
+CACHE_FORMAT_VERSION = 1
+
+ARRAY_NAMES = ['string_offsets', 'term_ids', 'names', 'synonym_indptr', 'synonyms', 'parent_indptr', 'parent_indices',
+               'ancestor_indptr', 'ancestor_indices']
+
+class StringTable(object):
+    """
+    Read-only sequence of strings stored in a UTF-8 blob.  Item i is decoded on access from
+    blob[offsets[indices[i]]:offsets[indices[i] + 1]], or is None if indices[i] is -1.
+    """
+
+    def __init__(self, blob, offsets, indices):
+        self.blob = blob
+        # Plain ndarray views of memory-mapped arrays avoid np.memmap's per-item indexing overhead
+        self.offsets = np.asarray(offsets)
+        self.indices = np.asarray(indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _decode(self, string_idx):
+        if string_idx < 0:
+            return None
+        return self.blob[self.offsets[string_idx]:self.offsets[string_idx + 1]].decode('utf-8')
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._decode(string_idx) for string_idx in self.indices[i]]
+        return self._decode(self.indices[i])
+
+    def __iter__(self):
+        return (self._decode(string_idx) for string_idx in self.indices)
+
+def hash_file(path, block_size=1 << 20):
+    """
+    :param path (string): path to file
+    :param block_size (int): bytes read at a time
+    :return (string): hex sha1 of the file's contents
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def read_cache_index(cache_dir):
+    index_path = os.path.join(cache_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as f:
+        return json.load(f)
+
+def write_cache_index(cache_dir, cache_index):
+    # Write to a temporary file first so concurrent readers never see a partial index
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cache_index, f, indent=1)
+    os.replace(tmp_path, os.path.join(cache_dir, 'index.json'))
+
+def get_cache_entry_dir(obo_path, cache_dir):
+    """
+    Find the cache entry directory for an obo file, re-hashing the file only if its size or mtime changed.
+
+    :param obo_path (string): path to .obo file
+    :param cache_dir (string): cache directory
+    :return (tuple): (entry directory path, whether the entry exists)
+    """
+    obo_stat = os.stat(obo_path)
+    obo_key = os.path.abspath(obo_path)
+    cache_index = read_cache_index(cache_dir)
+    index_entry = cache_index.get(obo_key)
+
+    if not (index_entry and index_entry['size'] == obo_stat.st_size and index_entry['mtime_ns'] == obo_stat.st_mtime_ns):
+        index_entry = {
+            'size': obo_stat.st_size,
+            'mtime_ns': obo_stat.st_mtime_ns,
+            'sha1': hash_file(obo_path)
+        }
+        cache_index[obo_key] = index_entry
+        write_cache_index(cache_dir, cache_index)
+
+    entry_dir = os.path.join(cache_dir, '%s-v%d' % (index_entry['sha1'], CACHE_FORMAT_VERSION))
+    return entry_dir, os.path.isdir(entry_dir)
+
+def save_cached_graph(graph, ancestor_index, entry_dir):
+    """
+    Write a compact graph and its ancestor closure to a cache entry directory.
+
+    :param graph (CompactOboGraph): parsed ontology
+    :param ancestor_index (CompactAncestorIndex): ancestor closure of graph
+    :param entry_dir (string): cache entry directory to create
+    """
+    string_ids = {}
+
+    def intern_string(string):
+        if string is None:
+            return -1
+        return string_ids.setdefault(string, len(string_ids))
+
+    arrays = {
+        'term_ids': np.array([intern_string(i) for i in graph.term_ids], dtype=np.int32),
+        'names': np.array([intern_string(i) for i in graph.names], dtype=np.int32),
+        'synonym_indptr': graph.synonym_indptr,
+        'synonyms': np.array([intern_string(i) for i in graph.synonyms], dtype=np.int32),
+        'parent_indptr': graph.parent_indptr,
+        'parent_indices': graph.parent_indices,
+        'ancestor_indptr': ancestor_index.ancestor_indptr,
+        'ancestor_indices': ancestor_index.ancestor_indices
+    }
+
+    encoded_strings = [string.encode('utf-8') for string in string_ids]
+    string_offsets = np.zeros(len(encoded_strings) + 1, dtype=np.int64)
+    np.cumsum([len(i) for i in encoded_strings], out=string_offsets[1:])
+    arrays['string_offsets'] = string_offsets
+
+    # Build the entry in a temporary directory and rename it into place, so a partially written entry is never used
+    cache_dir = os.path.dirname(entry_dir)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+    with open(os.path.join(tmp_dir, 'strings.bin'), 'wb') as f:
+        f.write(b''.join(encoded_strings))
+    for array_name in ARRAY_NAMES:
+        np.save(os.path.join(tmp_dir, '%s.npy' % array_name), arrays[array_name])
+
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process wrote the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def load_cached_graph(entry_dir):
+    """
+    Load a compact graph and its ancestor closure from a cache entry directory.  Arrays are memory-mapped.
+
+    :param entry_dir (string): cache entry directory written by save_cached_graph
+    :return (tuple): (CompactOboGraph, CompactAncestorIndex)
+    """
+    arrays = {array_name: np.load(os.path.join(entry_dir, '%s.npy' % array_name), mmap_mode='r')
+              for array_name in ARRAY_NAMES}
+    with open(os.path.join(entry_dir, 'strings.bin'), 'rb') as f:
+        blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+    string_offsets = arrays['string_offsets']
+    term_ids = list(StringTable(blob, string_offsets, arrays['term_ids']))
+    names = StringTable(blob, string_offsets, arrays['names'])
+    synonyms = StringTable(blob, string_offsets, arrays['synonyms'])
+
+    graph = CompactOboGraph(term_ids, names, arrays['synonym_indptr'], synonyms, arrays['parent_indptr'],
+                            arrays['parent_indices'])
+    ancestor_index = CompactAncestorIndex(graph, arrays['ancestor_indptr'], arrays['ancestor_indices'])
+
+    return graph, ancestor_index
+
+def load_or_build_cached_graph(obo_path, cache_dir, parse_function, build_ancestor_index_function):
+    """
+    Return the compact graph and ancestor closure of an obo file from the cache, parsing and caching them on a miss.
+
+    :param obo_path (string): path to .obo file
+    :param cache_dir (string): cache directory, created if missing
+    :param parse_function (function): obo path -> CompactOboGraph, ex: parse_obo_file_to_compact_graph
+    :param build_ancestor_index_function (function): graph -> {node id : ancestor ids}, ex: build_ancestor_index
+    :return (tuple): (CompactOboGraph, CompactAncestorIndex, cache hit bool)
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    entry_dir, cache_hit = get_cache_entry_dir(obo_path, cache_dir)
+    if not cache_hit:
+        graph = parse_function(obo_path)
+        ancestor_index = CompactAncestorIndex.from_ancestor_index(graph, build_ancestor_index_function(graph))
+        save_cached_graph(graph, ancestor_index, entry_dir)
+
+    graph, ancestor_index = load_cached_graph(entry_dir)
+
+    return graph, ancestor_index, cache_hit
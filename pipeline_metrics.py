@@ -0,0 +1,206 @@
+import collections
+import datetime
+import json
+import os
+import resource
+import sys
+import time
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It records where a pipeline script run spends its time and memory: per-stage wall time, counters (ex: stanzas parsed,
+lineages filtered, tokens emitted, cache hits) and the peak RSS of the process at the end of each stage.  Functions of
+the scripts record into the module-level metrics of the current run:
+
+    with pipeline_metrics.stage('parse_obo'):
+        graph = parse_obo_file_to_graph(obo_path)
+    pipeline_metrics.count('obo_stanzas', n_stanzas)
+
+Stages can be entered many times (their time and calls add up), and iter_timed times the items of a lazy iterator,
+ex: nlp.pipe batches.  Recording costs two perf_counter calls and a getrusage call per stage, so it is always on.
+
+Scripts add --profile and --profile_stats_file with add_profile_arguments, and call start_run and finish_run around
+main.  --profile writes the metrics as json:
+
+    {"script": "extract_obo_category_nodes.py", "argv": [...], "started": "2024-01-01T00:00:00", "seconds": 12.3,
+     "peak_rss_mb": 512.0, "stages": {"parse_obo": {"seconds": 8.1, "calls": 1, "peak_rss_mb": 480.2}, ...},
+     "counters": {"obo_stanzas": 3621, ...}}
+
+--profile_stats_file also runs the script under cProfile, writes the stats for python -m pstats or snakeviz, and prints
+the hottest functions.  Only the main process is profiled; worker processes are not.
+"""
+
+N_PROFILE_FUNCTIONS = 25
+
+def get_peak_rss_mb():
+    """
+    :return (float): peak resident set size of this process in MB
+    """
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / 1e6
+
+class StageTimer(object):
+    """
+    Context manager adding the time spent in its block to a stage of a PipelineMetrics.
+    """
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+        self.seconds = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        self.metrics.add_time(self.name, self.seconds)
+
+class PipelineMetrics(object):
+    """
+    Stage timings, counters and peak memory of one script run.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # {stage : {'seconds', 'calls', 'peak_rss_mb'}} in order of first use
+        self.stages = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.start = time.perf_counter()
+
+    def stage(self, name):
+        """
+        :param name (str): stage name, ex: 'parse_obo'
+        :return (StageTimer): context manager timing its block.  Its seconds attribute is set on exit.
+        """
+        return StageTimer(self, name)
+
+    def add_time(self, name, seconds, calls=1):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {'seconds': 0.0, 'calls': 0, 'peak_rss_mb': 0.0}
+        stage['seconds'] += seconds
+        stage['calls'] += calls
+        stage['peak_rss_mb'] = get_peak_rss_mb()
+
+    def count(self, name, n=1):
+        """
+        :param name (str): counter name, ex: 'lineages_filtered'
+        :param n (int): amount to add
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def iter_timed(self, name, iterable):
+        """
+        Yield the items of iterable, adding the time spent producing each of them to a stage.  The time the caller
+        spends on an item is not included.
+
+        :param name (str): stage name, ex: 'segment_sentences'
+        :param iterable (iterable): ex: a lazy nlp.pipe generator
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start, calls=0)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def to_dict(self, script=None, argv=None):
+        """
+        :return (dict): json-serializable metrics, see the module docstring
+        """
+        return {
+            'script': script,
+            'argv': argv,
+            'started': self.started,
+            'seconds': time.perf_counter() - self.start,
+            'peak_rss_mb': get_peak_rss_mb(),
+            'stages': self.stages,
+            'counters': self.counters
+        }
+
+# Metrics of the current script run
+metrics = PipelineMetrics()
+
+def stage(name):
+    return metrics.stage(name)
+
+def count(name, n=1):
+    metrics.count(name, n)
+
+def iter_timed(name, iterable):
+    return metrics.iter_timed(name, iterable)
+
+def add_profile_arguments(parser):
+    """
+    :param parser (ArgumentParser): script argument parser to add --profile and --profile_stats_file to
+    """
+    parser.add_argument('--profile', metavar='METRICS_FILE',
+                        help='Path to write a json of stage timings, counters and peak memory of the run to.')
+    parser.add_argument('--profile_stats_file',
+                        help='Path to write cProfile stats of the run to (read with python -m pstats).  The hottest functions are also printed.')
+
+def start_run(args):
+    """
+    Reset the metrics, and start profiling if --profile_stats_file is given.
+
+    :param args (Namespace): parsed arguments, from a parser passed to add_profile_arguments
+    :return profiler (cProfile.Profile): running profiler, or None
+    """
+    metrics.reset()
+    if not args.profile_stats_file:
+        return None
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def format_stages(run_metrics):
+    """
+    :param run_metrics (dict): from PipelineMetrics.to_dict
+    :return (str): table of stage times, their share of the run and peak RSS, followed by the counters
+    """
+    lines = ['%-32s %10s %7s %8s %12s' % ('stage', 'seconds', '%', 'calls', 'peak RSS MB')]
+    for name, stage_metrics in run_metrics['stages'].items():
+        lines.append('%-32s %10.2f %6.1f%% %8d %12.1f' % (
+            name, stage_metrics['seconds'], 100 * stage_metrics['seconds'] / run_metrics['seconds'],
+            stage_metrics['calls'], stage_metrics['peak_rss_mb']))
+    lines.append('%-32s %10.2f %7s %8s %12.1f' % ('total', run_metrics['seconds'], '', '', run_metrics['peak_rss_mb']))
+    for name, value in run_metrics['counters'].items():
+        lines.append('%-32s %10d' % (name, value))
+    return '\n'.join(lines)
+
+def finish_run(args, profiler=None):
+    """
+    Write the metrics to --profile and the profile to --profile_stats_file, if given.
+
+    :param args (Namespace): parsed arguments, from a parser passed to add_profile_arguments
+    :param profiler (cProfile.Profile): from start_run
+    """
+    if profiler is not None:
+        import pstats
+
+        profiler.disable()
+        profiler.dump_stats(args.profile_stats_file)
+        print("Wrote cProfile stats to %s.  Hottest functions:" % args.profile_stats_file)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(N_PROFILE_FUNCTIONS)
+
+    if args.profile:
+        run_metrics = metrics.to_dict(script=os.path.basename(sys.argv[0]), argv=sys.argv[1:])
+        print(format_stages(run_metrics))
+        with open(args.profile, 'w') as f:
+            json.dump(run_metrics, f, indent=1)
+        print("Wrote metrics to %s." % args.profile)
@@ -0,0 +1,455 @@
+import argparse
+import asyncio
+import datetime
+import glob
+import json
+import os
+import random
+import re
+import sys
+
+"""
+This script is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It downloads the PubMed records matching a query in batch files, like easy_pubmed_batch_downloads.R, from the same
+config file, without an R runtime:
+    my_query_string - Pubmed-generated string to search for.
+    batch_size - Number of entries to store in each output file.
+    output_format - Format to write output in (xml, medline, abstract, uilist or asn.1).
+    my_dest_dir_prefix - output destination directory prefix.
+    query_terms - summary of query terms, used in the destination directory name.  Ex: bacteria_habitat.
+    query_notes, site_hits - printed for the record.
+    api_key - optional NCBI API key, raising the E-utilities rate limit from 3 to 10 requests/sec.
+
+The query is run once with E-utilities esearch on the history server, then batches are fetched with efetch
+concurrently over one pooled HTTP session.  Requests are spaced by a token bucket to stay under the E-utilities rate
+limit, and failed requests (connection errors, timeouts, HTTP 429/5xx, error or truncated responses) are retried with
+exponential backoff, honoring Retry-After.
+
+Batches are written as <my_dest_dir_prefix>/<query_terms>_<yymmdd>/easyPubMed_data_<batch number>.txt, as easyPubMed
+names them, so pubmed_xml_reader.py and annotate_texts_with_entity_dictionaries.py --pubmed_xml read them unchanged.
+Each batch is written to a temporary file and renamed, then recorded in download_manifest.json.  A rerun with the same
+config resumes the latest unfinished download of the query (on a later day too) at the first missing batch.  PubMed
+results change over time, so a warning is printed if the query matches a different number of records on resume.
+
+--base_url points the downloader at another E-utilities server, ex: benchmarks/mock_eutilities_server.py.
+
+Usage:
+    python pubmed_batch_download/download_pubmed_batches.py bacteria_habitat_config.R --concurrency 3
+"""
+
+DEFAULT_BASE_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+
+# efetch formats supported by easyPubMed.  xml is fetched with retmode=xml, others with rettype=<format>&retmode=text.
+OUTPUT_FORMATS = ('xml', 'medline', 'abstract', 'uilist', 'asn.1')
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+DEST_FILE_PREFIX = 'easyPubMed_data_'
+MANIFEST_NAME = 'download_manifest.json'
+
+TOOL_NAME = 'bionlp_bb_pipeline'
+
+R_ASSIGNMENT_PATTERN = re.compile(r'^\s*([A-Za-z.][\w.]*)\s*(?:<-|=)\s*(.*)$')
+R_STRING_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '\\': '\\', '"': '"', "'": "'"}
+
+def parse_r_value(value_text):
+    """
+    :param value_text (str): right-hand side of an R assignment, ex: '"bacteria[MeSH Terms]"  # comment'
+    :return: str, int, float, bool or None value of an R string, number, TRUE/FALSE or NULL literal
+    """
+    value_text = value_text.strip()
+    if value_text[:1] in ('"', "'"):
+        quote = value_text[0]
+        chars = []
+        i = 1
+        while i < len(value_text):
+            char = value_text[i]
+            if char == '\\' and i + 1 < len(value_text):
+                chars.append(R_STRING_ESCAPES.get(value_text[i + 1], value_text[i + 1]))
+                i += 2
+                continue
+            if char == quote:
+                return ''.join(chars)
+            chars.append(char)
+            i += 1
+        raise ValueError("Unterminated string: %s" % value_text)
+
+    value_text = value_text.split('#', 1)[0].strip()
+    if value_text in ('TRUE', 'T'):
+        return True
+    if value_text in ('FALSE', 'F'):
+        return False
+    if value_text == 'NULL':
+        return None
+    try:
+        return int(value_text.rstrip('L'))
+    except ValueError:
+        pass
+    try:
+        return float(value_text)
+    except ValueError:
+        raise ValueError("Unsupported R value: %s" % value_text)
+
+def read_r_config(config_path):
+    """
+    Read the variables of an easy_pubmed_batch_downloads.R config file: one 'name <- value' or 'name = value'
+    assignment of a literal per line, with # comments.
+
+    :param config_path (str): path to R config file
+    :return config (dict): {variable name : value}
+    """
+    config = {}
+    with open(config_path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            match = R_ASSIGNMENT_PATTERN.match(line)
+            if not match:
+                raise ValueError("%s line %d is not an assignment: %s" % (config_path, line_number, line.strip()))
+            try:
+                config[match.group(1)] = parse_r_value(match.group(2))
+            except ValueError as e:
+                raise ValueError("%s line %d: %s" % (config_path, line_number, e))
+    return config
+
+class TokenBucket(object):
+    """
+    asyncio rate limiter: acquire waits for a token.  Tokens are added at rate per second, up to capacity, so at most
+    capacity requests go out in a burst and rate per second after that.
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate (float): tokens added per second
+        :param capacity (int): most tokens held
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self.updated is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class EutilsClient(object):
+    """
+    E-utilities requests over a pooled aiohttp session, rate limited and retried.
+    """
+
+    def __init__(self, session, rate_limiter, base_url=DEFAULT_BASE_URL, api_key=None, email=None, max_retries=5,
+                 backoff_seconds=1.0, max_backoff_seconds=60.0):
+        """
+        :param session (aiohttp.ClientSession): pooled HTTP session
+        :param rate_limiter (TokenBucket): acquired before every request, retries included
+        :param base_url (str): E-utilities base URL
+        :param api_key (str): NCBI API key, or None
+        :param email (str): contact email sent with requests, as NCBI asks of tools, or None
+        :param max_retries (int): retries of a failed request before giving up
+        :param backoff_seconds (float): wait before the first retry, doubled for each later one
+        :param max_backoff_seconds (float): longest wait between retries
+        """
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.base_url = base_url.rstrip('/') + '/'
+        self.common_params = {'tool': TOOL_NAME}
+        if api_key:
+            self.common_params['api_key'] = api_key
+        if email:
+            self.common_params['email'] = email
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.n_requests = 0
+        self.n_retries = 0
+
+    async def request(self, method, utility, params, out_path=None, expected_end=None):
+        """
+        :param method (str): 'GET' or 'POST' (form-encoded params, for long queries)
+        :param utility (str): ex: 'efetch.fcgi'
+        :param params (dict): request parameters, besides tool, email and api_key
+        :param out_path (str): file to stream the response body to, or None to return it
+        :param expected_end (bytes): the stripped body must end with this, ex: b'</PubmedArticleSet>', else it is
+                                     taken as truncated and retried
+        :return: response body bytes, or the number of bytes written to out_path
+        """
+        import aiohttp
+
+        params = dict(self.common_params, **params)
+        request_kwargs = {'data': params} if method == 'POST' else {'params': params}
+        url = self.base_url + utility
+
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            self.n_requests += 1
+            retry_after = None
+            try:
+                async with self.session.request(method, url, **request_kwargs) as response:
+                    retry_after = response.headers.get('Retry-After')
+                    if response.status == 200:
+                        head, tail, body = await read_response(response, out_path)
+                        # E-utilities reports some errors (ex: rate limit, expired history) in 200 responses
+                        if b'<ERROR>' in head or head.lstrip().startswith(b'{"error"'):
+                            error = 'error response: %s' % head[:200].decode('utf-8', 'replace')
+                        elif expected_end is not None and not tail.rstrip().endswith(expected_end):
+                            error = 'truncated response'
+                        else:
+                            return body
+                    elif response.status in RETRY_STATUSES:
+                        error = 'HTTP %d' % response.status
+                    else:
+                        raise RuntimeError("%s returned HTTP %d: %s" % (
+                            utility, response.status, (await response.text())[:200]))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = '%s %s' % (type(e).__name__, e)
+
+            if attempt == self.max_retries:
+                raise RuntimeError("%s failed after %d attempts: %s" % (utility, attempt + 1, error))
+
+            delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt) * (0.5 + random.random() / 2)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            self.n_retries += 1
+            print("%s %s, retrying in %.1fs..." % (utility, error, delay))
+            await asyncio.sleep(delay)
+
+    async def search(self, query):
+        """
+        Run a PubMed query on the history server.
+
+        :param query (str): PubMed query string
+        :return (tuple): (number of matching records, WebEnv, query_key)
+        """
+        body = await self.request('POST', 'esearch.fcgi', {'db': 'pubmed', 'term': query, 'usehistory': 'y',
+                                                           'retmax': 0, 'retmode': 'json'})
+        result = json.loads(body.decode('utf-8'))['esearchresult']
+        if 'ERROR' in result:
+            raise RuntimeError("esearch failed: %s" % result['ERROR'])
+        return int(result['count']), result['webenv'], result['querykey']
+
+    async def fetch_batch(self, webenv, query_key, retstart, retmax, output_format, out_path):
+        """
+        Stream a batch of records of a history server query to a file.
+
+        :return (int): number of bytes written
+        """
+        params = {'db': 'pubmed', 'WebEnv': webenv, 'query_key': query_key, 'retstart': retstart, 'retmax': retmax}
+        if output_format == 'xml':
+            params['retmode'] = 'xml'
+        else:
+            params.update({'rettype': output_format, 'retmode': 'text'})
+        expected_end = b'</PubmedArticleSet>' if output_format == 'xml' else None
+        return await self.request('GET', 'efetch.fcgi', params, out_path=out_path, expected_end=expected_end)
+
+async def read_response(response, out_path=None, chunk_size=1 << 16):
+    """
+    :param response (aiohttp.ClientResponse): response to read
+    :param out_path (str): file to stream the body to, or None to read it into memory
+    :return (tuple): (first KB of the body, last 64 bytes, body bytes or number of bytes written to out_path)
+    """
+    if out_path is None:
+        body = await response.read()
+        return body[:1024], body[-64:], body
+
+    head = b''
+    tail = b''
+    n_bytes = 0
+    with open(out_path, 'wb') as f:
+        async for chunk in response.content.iter_chunked(chunk_size):
+            if len(head) < 1024:
+                head += chunk[:1024 - len(head)]
+            tail = (tail + chunk)[-64:]
+            f.write(chunk)
+            n_bytes += len(chunk)
+    return head, tail, n_bytes
+
+def get_batch_file_name(batch_number, n_batches):
+    # easyPubMed pads batch numbers to the same width
+    return '%s%0*d.txt' % (DEST_FILE_PREFIX, max(2, len(str(n_batches))), batch_number)
+
+def read_manifest(dest_dir):
+    manifest_path = os.path.join(dest_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def write_manifest(dest_dir, manifest):
+    # Written to a temporary file and renamed, so an interruption never leaves a partial manifest
+    manifest_path = os.path.join(dest_dir, MANIFEST_NAME)
+    tmp_path = '%s.tmp' % manifest_path
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def is_batch_downloaded(dest_dir, manifest, batch_number):
+    """
+    :return (bool): True if the manifest records the batch and its file is there with the recorded size
+    """
+    batch = manifest['batches'].get(str(batch_number))
+    if batch is None:
+        return False
+    batch_path = os.path.join(dest_dir, batch['file'])
+    return os.path.exists(batch_path) and os.path.getsize(batch_path) == batch['bytes']
+
+def find_dest_dir(config):
+    """
+    :param config (dict): download config, from read_r_config
+    :return (str): latest <my_dest_dir_prefix>/<query_terms>_<yymmdd> directory with an unfinished download of the same
+                   query, batch size and format, else the directory of today's date
+    """
+    dir_prefix = os.path.join(config['my_dest_dir_prefix'], config.get('query_terms', 'pubmed'))
+    for dest_dir in sorted(glob.glob('%s_[0-9]*' % glob.escape(dir_prefix)), reverse=True):
+        manifest = read_manifest(dest_dir)
+        if manifest and not manifest['complete'] and get_download_settings(manifest) == get_download_settings(config):
+            return dest_dir
+    return '%s_%s' % (dir_prefix, datetime.date.today().strftime('%y%m%d'))
+
+def get_download_settings(config):
+    """
+    :return (tuple): (query, batch size, output format) of a config or manifest, which must match to resume
+    """
+    return config['my_query_string'], int(config['batch_size']), config['output_format']
+
+async def download_batches(config, dest_dir, base_url=DEFAULT_BASE_URL, concurrency=3, requests_per_second=3.0,
+                           max_retries=5, backoff_seconds=1.0, timeout_seconds=300, api_key=None, email=None):
+    """
+    Download the batches of a query missing from dest_dir, concurrently, and record them in its manifest.
+
+    :param config (dict): download config, from read_r_config
+    :param dest_dir (str): directory to write batch files and the manifest to
+    :param base_url (str): E-utilities base URL
+    :param concurrency (int): most batches downloaded at a time, and HTTP connections kept open
+    :param requests_per_second (float): rate limit of E-utilities requests, retries included
+    :param max_retries (int): retries of a failed request
+    :param backoff_seconds (float): wait before the first retry of a request, doubled for each later one
+    :param timeout_seconds (float): longest time a request, body included, may take
+    :param api_key (str): NCBI API key, or None
+    :param email (str): contact email sent with requests, or None
+    :return manifest (dict): download manifest, with 'complete' False if batches failed
+    """
+    import aiohttp
+
+    query, batch_size, output_format = get_download_settings(config)
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+
+    manifest = read_manifest(dest_dir)
+    if manifest is not None and get_download_settings(manifest) != get_download_settings(config):
+        raise ValueError("%s holds a download of another query, batch size or format, see %s." % (
+            dest_dir, os.path.join(dest_dir, MANIFEST_NAME)))
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=timeout_seconds)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        client = EutilsClient(session, TokenBucket(requests_per_second), base_url=base_url, api_key=api_key,
+                              email=email, max_retries=max_retries, backoff_seconds=backoff_seconds)
+
+        # The history server entry of an earlier run may have expired, so the query is always run again
+        count, webenv, query_key = await client.search(query)
+        if manifest is None:
+            manifest = {'my_query_string': query, 'batch_size': batch_size, 'output_format': output_format,
+                        'count': count, 'started': datetime.datetime.now().isoformat(timespec='seconds'),
+                        'complete': False, 'batches': {}}
+        elif manifest['count'] != count:
+            print("Warning: the query now matches %d records, %d when the download started.  Batches already "
+                  "downloaded are kept, records may be missing or repeated at batch boundaries." % (
+                      count, manifest['count']))
+            manifest['count'] = count
+
+        n_batches = (count + batch_size - 1) // batch_size
+        missing_batches = [batch_number for batch_number in range(1, n_batches + 1)
+                           if not is_batch_downloaded(dest_dir, manifest, batch_number)]
+        print("%d records in %d batches of %d, %d to download%s." % (
+            count, n_batches, batch_size, len(missing_batches),
+            ', resuming at batch %d' % missing_batches[0] if missing_batches and manifest['batches'] else ''))
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def download_batch(batch_number):
+            async with semaphore:
+                retstart = (batch_number - 1) * batch_size
+                file_name = get_batch_file_name(batch_number, n_batches)
+                tmp_path = os.path.join(dest_dir, '%s.part' % file_name)
+                n_bytes = await client.fetch_batch(webenv, query_key, retstart, batch_size, output_format, tmp_path)
+                os.replace(tmp_path, os.path.join(dest_dir, file_name))
+
+                manifest['batches'][str(batch_number)] = {'file': file_name, 'retstart': retstart, 'bytes': n_bytes}
+                write_manifest(dest_dir, manifest)
+                print("Batch %d/%d: %s (%d bytes)" % (batch_number, n_batches, file_name, n_bytes))
+
+        results = await asyncio.gather(*[download_batch(batch_number) for batch_number in missing_batches],
+                                       return_exceptions=True)
+
+    failed_batches = []
+    for batch_number, result in zip(missing_batches, results):
+        if isinstance(result, Exception):
+            failed_batches.append(batch_number)
+            print("Batch %d failed: %s" % (batch_number, result))
+
+    manifest['complete'] = not failed_batches
+    if manifest['complete']:
+        manifest['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+    write_manifest(dest_dir, manifest)
+    print("%d requests, %d retries." % (client.n_requests, client.n_retries))
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description="Download PubMed query results in batch files with E-utilities.")
+    parser.add_argument('config_file', help='easy_pubmed_batch_downloads.R config file.')
+    parser.add_argument('--dest_dir',
+                        help='Directory to download to.  Defaults to <my_dest_dir_prefix>/<query_terms>_<yymmdd>, or the latest unfinished download of the query.')
+    parser.add_argument('--base_url', default=DEFAULT_BASE_URL, help='E-utilities base URL.')
+    parser.add_argument('--concurrency', type=int, default=3, help='Number of batches downloaded at a time.')
+    parser.add_argument('--requests_per_second', type=float,
+                        help='E-utilities request rate limit.  Defaults to 3, or 10 with an API key, the NCBI limits.')
+    parser.add_argument('--max_retries', type=int, default=5, help='Number of retries of a failed request.')
+    parser.add_argument('--backoff_seconds', type=float, default=1.0,
+                        help='Wait before the first retry of a request, doubled for each later one.')
+    parser.add_argument('--timeout_seconds', type=float, default=300, help='Longest time a request may take.')
+    parser.add_argument('--api_key', help='NCBI API key.  Defaults to api_key of the config file or $NCBI_API_KEY.')
+    parser.add_argument('--email', help='Contact email sent with requests, as NCBI asks of E-utilities tools.')
+    args = parser.parse_args()
+
+    config = read_r_config(args.config_file)
+    # The R script reads output_format, its comments call it format
+    if 'output_format' not in config and 'format' in config:
+        config['output_format'] = config['format']
+    missing_fields = [field for field in ['my_query_string', 'batch_size', 'output_format', 'my_dest_dir_prefix']
+                      if config.get(field) is None]
+    if missing_fields:
+        parser.error("%s does not set %s." % (args.config_file, ', '.join(missing_fields)))
+    config['output_format'] = config['output_format'].lower()
+    if config['output_format'] not in OUTPUT_FORMATS:
+        parser.error("output_format %s is not one of %s." % (config['output_format'], ', '.join(OUTPUT_FORMATS)))
+
+    api_key = args.api_key or config.get('api_key') or os.environ.get('NCBI_API_KEY')
+    requests_per_second = args.requests_per_second or (10.0 if api_key else 3.0)
+    dest_dir = args.dest_dir or find_dest_dir(config)
+
+    print("Output destination directory: %s" % dest_dir)
+    for field in ['query_notes', 'site_hits']:
+        if config.get(field) is not None:
+            print("%s: %s" % (field, config[field]))
+
+    manifest = asyncio.run(download_batches(config, dest_dir, base_url=args.base_url, concurrency=args.concurrency,
+                                            requests_per_second=requests_per_second, max_retries=args.max_retries,
+                                            backoff_seconds=args.backoff_seconds, timeout_seconds=args.timeout_seconds,
+                                            api_key=api_key, email=args.email))
+    if not manifest['complete']:
+        print("Download incomplete.  Run again to resume.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import collections
+import gzip
+import os
+import xml.etree.ElementTree as ET
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It streams PubMed XML batch files, as written by pubmed_batch_download/easy_pubmed_batch_downloads.R with
+format "xml", into (PMID, title, abstract) records.
+
+Files are parsed incrementally with ElementTree.iterparse, and every PubmedArticle element is cleared from the tree once
+its record has been read, so memory per file stays constant whatever the number of articles in the batch.  gzip
+compressed batches are detected by their magic bytes and decompressed on the fly.
+
+iter_pubmed_articles yields (source id, passage text, annotation lines) tuples, the form consumed by
+convert_bionlp_ner_train_to_bert_ner_train.iter_article_train_lines/generate_article_train_lines, with annotation lines
+optionally produced by an annotate_texts_with_entity_dictionaries.EntityDictionaryAnnotator.
+"""
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# easyPubMed writes XML batches with a .txt extension
+PUBMED_BATCH_EXTENSIONS = ('.xml', '.txt', '.xml.gz', '.txt.gz')
+
+PubMedRecord = collections.namedtuple('PubMedRecord', ['pmid', 'title', 'abstract'])
+
+def open_batch_file(batch_path):
+    """
+    :param batch_path (str): path to a PubMed XML batch file, gzip compressed or not
+    :return: binary file object of the decompressed XML
+    """
+    with open(batch_path, 'rb') as f:
+        is_gzip = f.read(2) == GZIP_MAGIC
+
+    if is_gzip:
+        return gzip.open(batch_path, 'rb')
+    return open(batch_path, 'rb')
+
+def get_element_text(element):
+    """
+    :param element (Element): XML element, or None
+    :return (str): text of the element and its inline children (ex: <i>, <sup>), with whitespace runs collapsed
+    """
+    if element is None:
+        return ''
+    return ' '.join(''.join(element.itertext()).split())
+
+def iter_pubmed_records(batch_path):
+    """
+    Lazily read the articles of a PubMed XML batch file.
+
+    :param batch_path (str): path to a PubMed XML batch file, gzip compressed or not
+    :return: generator of PubMedRecord tuples.  Abstract sections (BACKGROUND, METHODS, ...) are joined with spaces.
+    """
+    with open_batch_file(batch_path) as f:
+        root = None
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            if root is None:
+                root = element
+
+            if event != 'end' or element.tag != 'PubmedArticle':
+                continue
+
+            citation = element.find('MedlineCitation')
+            if citation is not None:
+                article = citation.find('Article')
+                title = get_element_text(article.find('ArticleTitle')) if article is not None else ''
+                abstract_texts = article.findall('Abstract/AbstractText') if article is not None else []
+
+                abstract = ' '.join(text for text in (get_element_text(i) for i in abstract_texts) if text)
+
+                yield PubMedRecord(get_element_text(citation.find('PMID')), title, abstract)
+
+            # Drop every article read so far from the tree
+            root.clear()
+
+def get_record_passage(record):
+    """
+    Merge the title and abstract of an article, as extract_and_merge_title_and_abstract does for BioNLP .a1 files.
+
+    :param record (PubMedRecord): article
+    :return (str): title (if present) and abstract (if present) separated by a space
+    """
+    return ' '.join(part for part in [record.title, record.abstract] if part)
+
+def list_pubmed_batch_files(batch_dir):
+    """
+    :param batch_dir (str): directory of PubMed XML batch files
+    :return (list): paths of batch files in the directory, in file name order
+    """
+    return sorted(dir_entry.path for dir_entry in os.scandir(batch_dir)
+                  if dir_entry.is_file() and dir_entry.name.endswith(PUBMED_BATCH_EXTENSIONS))
+
+def iter_pubmed_articles(batch_paths, annotator=None, skip_empty=True):
+    """
+    Stream PubMed batch files as documents for the converter or annotator, one article at a time.
+
+    :param batch_paths (iterable): paths of PubMed XML batch files, ex: from list_pubmed_batch_files
+    :param annotator (EntityDictionaryAnnotator): compiled annotator to label entities with, or None for no annotation lines
+    :param skip_empty (bool): skip articles without a title or abstract
+    :return: generator of (PMID, passage text, annotation lines) tuples
+    """
+    for batch_path in batch_paths:
+        for record in iter_pubmed_records(batch_path):
+            passage_text = get_record_passage(record)
+            if skip_empty and not passage_text:
+                continue
+
+            bionlp_lines = annotator.annotate(passage_text) if annotator is not None else []
+            yield record.pmid, passage_text, bionlp_lines
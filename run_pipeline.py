@@ -0,0 +1,575 @@
+import argparse
+import ast
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+"""
+This script is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It runs the pipeline scripts as a DAG of stages, rebuilding only the stages whose inputs changed since an earlier run:
+
+    category_dicts (extract_obo_category_nodes.py) ---+
+                                                      +--> annotations (annotate_texts_with_entity_dictionaries.py)
+    taxid_dict (generate_bacteria_taxid_dict.py) -----+
+
+    bert_train (convert_bionlp_ner_train_to_bert_ner_train.py)
+
+Stages whose inputs are not given are left out, ex: annotations without --text_dir.  A stage starts as soon as the
+stages it depends on are done, up to --jobs stages at a time, so the dicts and the BERT train file are built
+concurrently.
+
+Each stage is keyed by the sha1 of its script and the repository modules it imports, its arguments, the contents of its
+input files and the output digests of the stages it depends on.  The stage writes its outputs to a temporary directory
+under <cache_dir>/artifacts, which is renamed to <stage>-<key> once the script succeeds.  A stage whose key already has
+an artifact is not run again, and a stage that is rebuilt with the same outputs does not cause its dependents to be
+rebuilt.  Input file hashes are remembered by path, size and mtime in <cache_dir>/file_hashes.json, so unchanged inputs
+are not read again.
+
+The artifact of each stage is copied to <out_dir>/<stage>/, with the log of the run that built it, its --profile metrics
+(see pipeline_metrics.py) and, for the dict stages, the changelog since the previous build.  Dict stages are rebuilt
+from the snapshot of their latest artifact (see --snapshot_file of their scripts), so a new ontology or taxdump release
+only regenerates the affected entries.
+
+Usage:
+    python run_pipeline.py pipeline_out --obo_file OntoBiotope_BioNLP-OST-2019.obo \
+        --ncbi_lineage_file ncbi_lineages.csv --taxdump_dir taxdump --text_dir pubmed_batches --pubmed_xml \
+        --bionlp_train_dir BioNLP-OST-2019_BB-norm+ner_train
+"""
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Changing how artifacts are built or laid out invalidates all of them
+CACHE_FORMAT_VERSION = 1
+
+# Annotation labels of the category dicts
+CATEGORY_LABELS = {
+    'microbial_habitat': 'Habitat',
+    'phenotype': 'Phenotype'
+}
+
+SNAPSHOT_NAME = 'snapshot.json'
+MANIFEST_NAME = 'manifest.json'
+
+class Stage(object):
+    """
+    A pipeline script run, with the inputs and arguments that determine its outputs.
+
+    Arguments are templates formatted with the paths of the stage: {out} is the artifact directory the stage writes its
+    outputs to, {<input name>} the path of an input and {<stage name>} the artifact directory of a dependency.  The
+    unformatted templates are part of the stage key, so moving an input or the cache does not invalidate artifacts.
+    """
+
+    def __init__(self, name, script, arguments, outputs, inputs=None, deps=(), params=None, performance_arguments=(),
+                 incremental=False, profile=True):
+        """
+        :param name (str): stage name, ex: 'taxid_dict'
+        :param script (str): pipeline script in the repository directory, ex: 'generate_bacteria_taxid_dict.py'
+        :param arguments (list): script argument templates
+        :param outputs (list): files or directories the stage writes to {out}, digested for its dependents
+        :param inputs (dict): {input name : absolute path of an input file or directory}
+        :param deps (tuple): names of the stages whose outputs this stage reads
+        :param params (dict): anything else the outputs depend on, ex: the version of an installed model
+        :param performance_arguments (list): arguments that do not change the outputs (ex: --workers), left out of the key
+        :param incremental (bool): the script accepts --snapshot_file and --changelog_file
+        :param profile (bool): the script accepts --profile
+        """
+        self.name = name
+        self.script = script
+        self.arguments = list(arguments)
+        self.outputs = list(outputs)
+        self.inputs = inputs or {}
+        self.deps = tuple(deps)
+        self.params = params or {}
+        self.performance_arguments = list(performance_arguments)
+        self.incremental = incremental
+        self.profile = profile
+
+def hash_file(path, block_size=1 << 20):
+    """
+    :param path (string): path to file
+    :param block_size (int): bytes read at a time
+    :return (string): hex sha1 of the file's contents
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def hash_path(path, hash_file_function=hash_file):
+    """
+    :param path (string): path to a file or directory
+    :param hash_file_function (function): path -> hex sha1 of the file's contents
+    :return (string): hex sha1 of a file, or of the relative path and sha1 of every file under a directory
+    """
+    if not os.path.isdir(path):
+        return hash_file_function(path)
+
+    sha1 = hashlib.sha1()
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            sha1.update(('%s\t%s\n' % (os.path.relpath(file_path, path), hash_file_function(file_path))).encode('utf-8'))
+    return sha1.hexdigest()
+
+class FileHashIndex(object):
+    """
+    sha1 of input files, remembered by path, size and mtime so a file is only read again after it changed.  Only the
+    files hashed during a run are kept when the index is saved.  Safe to use from several threads.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.used = set()
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.entries = json.load(f)
+
+    def hash_file(self, path):
+        path = os.path.abspath(path)
+        file_stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            self.used.add(path)
+        if entry and entry['size'] == file_stat.st_size and entry['mtime_ns'] == file_stat.st_mtime_ns:
+            return entry['sha1']
+
+        entry = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'sha1': hash_file(path)}
+        with self.lock:
+            self.entries[path] = entry
+        return entry['sha1']
+
+    def save(self):
+        with self.lock:
+            entries = {path: entry for path, entry in self.entries.items() if path in self.used}
+        write_json(self.index_path, entries)
+
+def write_json(path, value):
+    # Write to a temporary file first so an interrupted run never leaves a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(value, f, indent=1)
+    os.replace(tmp_path, path)
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def get_code_digest(script):
+    """
+    :param script (str): pipeline script in the repository directory
+    :return (str): hex sha1 of the script and of the repository modules it imports, directly or through other modules
+    """
+    module_files = set()
+    pending = [script]
+    while pending:
+        module_file = pending.pop()
+        if module_file in module_files:
+            continue
+        module_files.add(module_file)
+
+        with open(os.path.join(REPO_DIR, module_file), 'rb') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                module_names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                module_names = [node.module]
+            else:
+                continue
+            for module_name in module_names:
+                imported_file = '%s.py' % module_name.split('.')[0]
+                if os.path.exists(os.path.join(REPO_DIR, imported_file)):
+                    pending.append(imported_file)
+
+    sha1 = hashlib.sha1()
+    for module_file in sorted(module_files):
+        sha1.update(('%s\t%s\n' % (module_file, hash_file(os.path.join(REPO_DIR, module_file)))).encode('utf-8'))
+    return sha1.hexdigest()
+
+def get_stage_key(stage, file_index, dep_digests):
+    """
+    :param stage (Stage): stage to key
+    :param file_index (FileHashIndex): hashes of input files
+    :param dep_digests (dict): {dependency stage name : output digest}
+    :return (str): hex sha1 of everything the outputs of the stage depend on
+    """
+    key_material = {
+        'cache_format_version': CACHE_FORMAT_VERSION,
+        'script': stage.script,
+        'code': get_code_digest(stage.script),
+        'arguments': stage.arguments,
+        'params': stage.params,
+        'inputs': {name: hash_path(path, file_index.hash_file) for name, path in stage.inputs.items()},
+        'deps': dep_digests
+    }
+    return hashlib.sha1(json.dumps(key_material, sort_keys=True).encode('utf-8')).hexdigest()
+
+def build_artifact(stage, key, dep_dirs, cache_dir, previous_artifact_dir=None):
+    """
+    Run the script of a stage into a new artifact directory.
+
+    :param stage (Stage): stage to run
+    :param key (str): stage key, from get_stage_key
+    :param dep_dirs (dict): {dependency stage name : artifact directory}
+    :param cache_dir (str): pipeline cache directory
+    :param previous_artifact_dir (str): latest artifact of the stage, whose snapshot an incremental stage starts from
+    :return manifest (dict): {'stage', 'key', 'outputs', 'outputs_digest', 'command', 'built', 'seconds'}
+    """
+    artifacts_dir = os.path.join(cache_dir, 'artifacts')
+    tmp_dir = tempfile.mkdtemp(prefix='%s-' % stage.name, suffix='.tmp', dir=artifacts_dir)
+
+    paths = dict(stage.inputs, out=tmp_dir)
+    paths.update(dep_dirs)
+    command = [sys.executable, os.path.join(REPO_DIR, stage.script)]
+    command += [argument.format(**paths) for argument in stage.arguments] + stage.performance_arguments
+    if stage.profile:
+        command += ['--profile', os.path.join(tmp_dir, 'metrics.json')]
+    if stage.incremental:
+        snapshot_path = os.path.join(tmp_dir, SNAPSHOT_NAME)
+        if previous_artifact_dir and os.path.exists(os.path.join(previous_artifact_dir, SNAPSHOT_NAME)):
+            shutil.copyfile(os.path.join(previous_artifact_dir, SNAPSHOT_NAME), snapshot_path)
+        command += ['--snapshot_file', snapshot_path, '--changelog_file', os.path.join(tmp_dir, 'changelog.json')]
+
+    built = datetime.datetime.now().isoformat(timespec='seconds')
+    start = time.perf_counter()
+    log_path = os.path.join(tmp_dir, 'log.txt')
+    with open(log_path, 'w') as log_file:
+        returncode = subprocess.call(command, stdout=log_file, stderr=subprocess.STDOUT, cwd=tmp_dir)
+    seconds = time.perf_counter() - start
+
+    missing_outputs = [output for output in stage.outputs if not os.path.exists(os.path.join(tmp_dir, output))]
+    if returncode != 0 or missing_outputs:
+        # Keep the log of the failed run, drop its partial outputs
+        failed_log_path = os.path.join(cache_dir, 'logs', '%s.failed.log' % stage.name)
+        shutil.move(log_path, failed_log_path)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if returncode != 0:
+            raise RuntimeError("%s exited with status %d, see %s" % (stage.script, returncode, failed_log_path))
+        raise RuntimeError("%s did not write %s, see %s" % (stage.script, ', '.join(missing_outputs), failed_log_path))
+
+    outputs_digest = hashlib.sha1()
+    for output in sorted(stage.outputs):
+        outputs_digest.update(('%s\t%s\n' % (output, hash_path(os.path.join(tmp_dir, output)))).encode('utf-8'))
+
+    manifest = {
+        'stage': stage.name,
+        'key': key,
+        'outputs': stage.outputs,
+        'outputs_digest': outputs_digest.hexdigest(),
+        'command': command,
+        'built': built,
+        'seconds': seconds
+    }
+    write_json(os.path.join(tmp_dir, MANIFEST_NAME), manifest)
+
+    # Rename into place, so a partially built artifact is never used
+    artifact_dir = os.path.join(artifacts_dir, '%s-%s' % (stage.name, key))
+    if os.path.isdir(artifact_dir):
+        shutil.rmtree(artifact_dir)
+    os.rename(tmp_dir, artifact_dir)
+    return manifest
+
+def copy_artifact(artifact_dir, stage_out_dir):
+    """
+    Replace the outputs of a stage in the output directory with a copy of its artifact, unless they already are one.
+    """
+    manifest = read_json(os.path.join(artifact_dir, MANIFEST_NAME))
+    out_manifest = read_json(os.path.join(stage_out_dir, MANIFEST_NAME), {})
+    if out_manifest.get('key') == manifest['key'] and out_manifest.get('built') == manifest['built']:
+        return
+
+    tmp_dir = '%s.tmp%d' % (stage_out_dir, os.getpid())
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    shutil.copytree(artifact_dir, tmp_dir, ignore=shutil.ignore_patterns(SNAPSHOT_NAME))
+    if os.path.isdir(stage_out_dir):
+        shutil.rmtree(stage_out_dir)
+    os.rename(tmp_dir, stage_out_dir)
+
+def update_stage(stage, dep_manifests, file_index, cache_dir, out_dir, latest_keys, force=False, dry_run=False):
+    """
+    Bring the artifact of a stage up to date, and copy it to the output directory.
+
+    :param dep_manifests (dict): {dependency stage name : artifact manifest, or None if it is out of date in a dry run}
+    :param latest_keys (dict): {stage name : key of its latest artifact}
+    :param force (bool): rebuild the artifact even if it is up to date
+    :param dry_run (bool): only report whether the stage is up to date
+    :return (tuple): (artifact manifest, or None if the stage would be rebuilt in a dry run, status)
+    """
+    if any(manifest is None for manifest in dep_manifests.values()):
+        return None, 'out of date (dependency out of date)'
+
+    dep_digests = {dep: manifest['outputs_digest'] for dep, manifest in dep_manifests.items()}
+    key = get_stage_key(stage, file_index, dep_digests)
+    artifacts_dir = os.path.join(cache_dir, 'artifacts')
+    artifact_dir = os.path.join(artifacts_dir, '%s-%s' % (stage.name, key))
+
+    if os.path.isdir(artifact_dir) and not force:
+        manifest = read_json(os.path.join(artifact_dir, MANIFEST_NAME))
+        status = 'up to date'
+    elif dry_run:
+        return None, 'out of date'
+    else:
+        print("Building %s..." % stage.name)
+        previous_artifact_dir = None
+        if stage.name in latest_keys:
+            previous_artifact_dir = os.path.join(artifacts_dir, '%s-%s' % (stage.name, latest_keys[stage.name]))
+        dep_dirs = {dep: os.path.join(artifacts_dir, '%s-%s' % (dep, manifest['key']))
+                    for dep, manifest in dep_manifests.items()}
+        manifest = build_artifact(stage, key, dep_dirs, cache_dir, previous_artifact_dir)
+        status = 'built in %.1fs' % manifest['seconds']
+
+    if not dry_run:
+        copy_artifact(artifact_dir, os.path.join(out_dir, stage.name))
+    return manifest, status
+
+def run_stages(stages, cache_dir, out_dir, jobs, force_stages=(), dry_run=False):
+    """
+    Update the stages in dependency order, running up to jobs of them at a time.
+
+    :param stages (OrderedDict): {stage name : Stage}, with the dependencies of each stage
+    :param cache_dir (str): pipeline cache directory
+    :param out_dir (str): directory to copy the artifacts of the stages to
+    :param jobs (int): number of stages run concurrently
+    :param force_stages (iterable): names of stages to rebuild even if they are up to date
+    :param dry_run (bool): only report which stages are out of date
+    :return statuses (OrderedDict): {stage name : status}
+    """
+    file_index = FileHashIndex(os.path.join(cache_dir, 'file_hashes.json'))
+    latest_path = os.path.join(cache_dir, 'latest.json')
+    latest_keys = read_json(latest_path, {})
+
+    manifests = {}
+    statuses = collections.OrderedDict((name, None) for name in stages)
+    pending = list(stages)
+    futures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or futures:
+            for name in list(pending):
+                stage = stages[name]
+                failed_deps = [dep for dep in stage.deps if dep not in manifests and statuses[dep] is not None]
+                if failed_deps:
+                    pending.remove(name)
+                    statuses[name] = 'skipped (%s failed)' % ', '.join(failed_deps)
+                elif all(dep in manifests for dep in stage.deps):
+                    pending.remove(name)
+                    dep_manifests = {dep: manifests[dep] for dep in stage.deps}
+                    futures[executor.submit(update_stage, stage, dep_manifests, file_index, cache_dir, out_dir,
+                                            latest_keys, name in force_stages, dry_run)] = name
+
+            if not futures:
+                break
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    manifest, statuses[name] = future.result()
+                except (RuntimeError, OSError) as e:
+                    statuses[name] = 'FAILED: %s' % e
+                    print("%s failed: %s" % (name, e))
+                    continue
+                manifests[name] = manifest
+                print("%s: %s" % (name, statuses[name]))
+
+    file_index.save()
+    if not dry_run:
+        latest_keys.update((name, manifest['key']) for name, manifest in manifests.items())
+        write_json(latest_path, latest_keys)
+    return statuses
+
+def prune_artifacts(cache_dir, stage_names, latest_keys, keep):
+    """
+    Delete all but the keep most recently built artifacts of each stage.  The latest artifact of a stage is always kept.
+    """
+    artifacts_dir = os.path.join(cache_dir, 'artifacts')
+    stage_artifacts = collections.defaultdict(list)
+    for dir_name in os.listdir(artifacts_dir):
+        stage_name, _, key = dir_name.rpartition('-')
+        if stage_name in stage_names and os.path.exists(os.path.join(artifacts_dir, dir_name, MANIFEST_NAME)):
+            stage_artifacts[stage_name].append((os.path.getmtime(os.path.join(artifacts_dir, dir_name)), key))
+
+    for stage_name, artifacts in stage_artifacts.items():
+        for _, key in sorted(artifacts, reverse=True)[keep:]:
+            if key != latest_keys.get(stage_name):
+                shutil.rmtree(os.path.join(artifacts_dir, '%s-%s' % (stage_name, key)), ignore_errors=True)
+
+def get_stages(args):
+    """
+    :param args (Namespace): parsed arguments of main, with absolute input paths
+    :return stages (OrderedDict): {stage name : Stage} of the stages whose inputs are given, in dependency order
+    """
+    stages = collections.OrderedDict()
+
+    if args.obo_file:
+        stages['category_dicts'] = Stage(
+            'category_dicts', 'extract_obo_category_nodes.py',
+            ['{obo_file}', '--categories'] + args.categories + ['--out_dir', '{out}/category_dicts'],
+            ['category_dicts'], inputs={'obo_file': args.obo_file}, incremental=True)
+
+    if args.ncbi_lineage_file:
+        inputs = {'ncbi_lineage_file': args.ncbi_lineage_file, 'valid_taxids_file': args.valid_taxids_file}
+        arguments = ['{ncbi_lineage_file}', '{out}/microorganism_taxid_dict.json',
+                     '--valid_taxids_file', '{valid_taxids_file}']
+        for name in ['stopwords_file', 'genera_filter_file', 'taxdump_dir', 'taxa_sqlite']:
+            if getattr(args, name):
+                inputs[name] = getattr(args, name)
+                arguments += ['--%s' % name, '{%s}' % name]
+        if not args.taxdump_dir and not args.taxa_sqlite:
+            from ncbi_taxonomy import ETE3_TAXA_SQLITE_PATH
+
+            # Ranks come from the ete3 database, which ete3 builds if it is missing
+            if os.path.exists(ETE3_TAXA_SQLITE_PATH):
+                inputs['taxa_sqlite'] = ETE3_TAXA_SQLITE_PATH
+        stages['taxid_dict'] = Stage('taxid_dict', 'generate_bacteria_taxid_dict.py', arguments,
+                                     ['microorganism_taxid_dict.json'], inputs=inputs, incremental=True)
+
+    if args.text_dir:
+        arguments = ['{text_dir}', '{out}/annotations',
+                     '--dictionary', 'Microorganism={taxid_dict}/microorganism_taxid_dict.json']
+        for category in args.categories:
+            arguments += ['--dictionary', '%s={category_dicts}/category_dicts/%s.json' % (
+                CATEGORY_LABELS.get(category, category), category)]
+        if args.pubmed_xml:
+            arguments.append('--pubmed_xml')
+        stages['annotations'] = Stage('annotations', 'annotate_texts_with_entity_dictionaries.py', arguments,
+                                      ['annotations'], inputs={'text_dir': args.text_dir},
+                                      deps=('category_dicts', 'taxid_dict'),
+                                      performance_arguments=['--workers', str(args.workers)], profile=False)
+
+    if args.bionlp_train_dir:
+        from convert_bionlp_ner_train_to_bert_ner_train import get_sentence_model_key
+
+        inputs = {'bionlp_train_dir': args.bionlp_train_dir}
+        arguments = ['{bionlp_train_dir}', '{out}/bert_train.txt', '--spacy_model', args.spacy_model]
+        outputs = ['bert_train.txt']
+        if args.vocab_file:
+            inputs['vocab_file'] = args.vocab_file
+            arguments += ['--vocab_file', '{vocab_file}', '--shard_dir', '{out}/bert_train_shards',
+                          '--max_seq_length', str(args.max_seq_length)]
+            if args.do_lower_case:
+                arguments.append('--do_lower_case')
+            outputs.append('bert_train_shards')
+
+        stages['bert_train'] = Stage(
+            'bert_train', 'convert_bionlp_ner_train_to_bert_ner_train.py', arguments, outputs, inputs=inputs,
+            params={'sentence_model': get_sentence_model_key(args.spacy_model)},
+            performance_arguments=['--workers', str(args.workers),
+                                   '--sentence_cache', os.path.join(args.cache_dir, 'sentence_breaks.db')])
+
+    return stages
+
+def select_stages(stages, targets):
+    """
+    :param targets (list): names of stages to update
+    :return (OrderedDict): the target stages and the stages they depend on, in dependency order
+    """
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(stages[name].deps)
+    return collections.OrderedDict((name, stage) for name, stage in stages.items() if name in selected)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline scripts as a DAG of stages, rebuilding only stages whose inputs changed.")
+    parser.add_argument('out_dir', help='Directory to copy the outputs of each stage to, in a subdirectory per stage.')
+    parser.add_argument('--cache_dir',
+                        help='Directory of stage artifacts and input hashes, kept between runs.  Defaults to <out_dir>/.pipeline_cache.')
+    parser.add_argument('--obo_file', help='OntoBiotope .obo file to extract category dicts from.')
+    parser.add_argument('--categories', nargs='+', default=['microbial_habitat', 'phenotype'],
+                        help='Ontology categories to extract dicts of.')
+    parser.add_argument('--ncbi_lineage_file', help='ncbi taxdump lineage file to build the microorganism taxid dict from.')
+    parser.add_argument('--valid_taxids_file',
+                        default=os.path.join(REPO_DIR, 'resources', 'BioNLP-OST-2019_BB-norm_Microorganism-ids.txt'),
+                        help='List of BioNLP-BB-norm microorganism taxids, one per line.')
+    parser.add_argument('--stopwords_file', default=os.path.join(REPO_DIR, 'resources', 'bionlp_bb_stopwords.txt'),
+                        help='Stopwords filtered out of the taxid dict.')
+    parser.add_argument('--genera_filter_file', help='List of genera to truncate the taxid dict to.')
+    parser.add_argument('--taxdump_dir', help='Directory containing NCBI taxdump nodes.dmp and names.dmp.')
+    parser.add_argument('--taxa_sqlite', help='Path to ete3 taxa.sqlite database.  Defaults to ~/.etetoolkit/taxa.sqlite.')
+    parser.add_argument('--text_dir', help='Directory of .txt files (or, with --pubmed_xml, PubMed XML batches) to annotate with the dicts.')
+    parser.add_argument('--pubmed_xml', action='store_true', help='--text_dir holds PubMed XML batch files.')
+    parser.add_argument('--bionlp_train_dir', help='Directory containing BioNLP NER train files to convert to BERT format.')
+    parser.add_argument('--spacy_model', default='en_core_sci_md', help='scispacy model to segment sentences with.')
+    parser.add_argument('--vocab_file', help='BERT vocab file.  If present, the BERT train file is also written as pre-tokenized shards.')
+    parser.add_argument('--max_seq_length', type=int, default=128, help='Most tokens per pre-tokenized example.')
+    parser.add_argument('--do_lower_case', action='store_true', help='Lower-case words when tokenizing, for uncased vocabs.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes of the annotation and BERT conversion stages.')
+    parser.add_argument('--jobs', type=int, default=3, help='Number of stages run concurrently.')
+    parser.add_argument('--stages', nargs='+', help='Stages to update, with the stages they depend on.  Defaults to all.')
+    parser.add_argument('--force', nargs='+', default=[], help='Stages to rebuild even if they are up to date.')
+    parser.add_argument('--keep_artifacts', type=int, default=3, help='Number of artifacts kept per stage.')
+    parser.add_argument('--dry_run', action='store_true', help='Only report which stages are out of date.')
+    args = parser.parse_args()
+
+    args.cache_dir = os.path.abspath(args.cache_dir or os.path.join(args.out_dir, '.pipeline_cache'))
+    input_names = ['obo_file', 'ncbi_lineage_file', 'genera_filter_file', 'taxdump_dir', 'taxa_sqlite', 'text_dir',
+                   'bionlp_train_dir', 'vocab_file']
+    if args.ncbi_lineage_file:
+        # The default taxid list comes with the shared task data, it is only needed to build the taxid dict
+        input_names += ['valid_taxids_file', 'stopwords_file']
+    for name in input_names:
+        path = getattr(args, name)
+        if path:
+            if not os.path.exists(path):
+                parser.error("--%s %s does not exist." % (name, path))
+            setattr(args, name, os.path.abspath(path))
+    if args.text_dir and not (args.obo_file and args.ncbi_lineage_file):
+        parser.error("--text_dir is annotated with the dicts of --obo_file and --ncbi_lineage_file, specify both.")
+
+    try:
+        stages = get_stages(args)
+    except OSError as e:
+        # Ex: the --spacy_model the BERT train stage is keyed by is not installed
+        parser.error(str(e))
+    if not stages:
+        parser.error("Specify the inputs of at least one stage: --obo_file, --ncbi_lineage_file, --text_dir or --bionlp_train_dir.")
+    unknown_stages = [name for name in (args.stages or []) + args.force if name not in stages]
+    if unknown_stages:
+        parser.error("Unknown stages %s.  Stages with inputs: %s." % (', '.join(unknown_stages), ', '.join(stages)))
+    if args.stages:
+        stages = select_stages(stages, args.stages)
+
+    for directory in [args.out_dir, os.path.join(args.cache_dir, 'artifacts'), os.path.join(args.cache_dir, 'logs')]:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    start = time.perf_counter()
+    statuses = run_stages(stages, args.cache_dir, args.out_dir, args.jobs, force_stages=args.force,
+                          dry_run=args.dry_run)
+    elapsed = time.perf_counter() - start
+
+    if not args.dry_run:
+        prune_artifacts(args.cache_dir, set(stages), read_json(os.path.join(args.cache_dir, 'latest.json'), {}),
+                        args.keep_artifacts)
+
+    print("%-16s %s" % ('stage', 'status'))
+    for name, status in statuses.items():
+        print("%-16s %s" % (name, status))
+    print("Finished in %.1fs." % elapsed)
+
+    if any(status.startswith(('FAILED', 'skipped')) for status in statuses.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import array
+import hashlib
+import sqlite3
+import time
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It provides a persistent SQLite cache of sentence break indices for convert_bionlp_ner_train_to_bert_ner_train.py, so
+passages that were already segmented are not run through the spacy model again.
+
+Entries are keyed by a hash of the sentence model name/version and the passage text, so a different model (or model
+version) never reuses another's segmentation.  Sentence breaks are stored as int32 arrays.  Once the cache holds more
+than max_entries passages, the least recently used entries are evicted.
+
+New entries and last-used times are written in batches of flush_every, and the database is in WAL mode, so worker
+processes can read the cache while the main process writes to it.
+"""
+
+class SentenceBreakCache(object):
+    """
+    SQLite-backed {passage key : sentence break indices} mapping with least-recently-used eviction.
+    """
+
+    def __init__(self, cache_path, model_key, max_entries=1000000, flush_every=1000):
+        """
+        :param cache_path (str): path to SQLite cache file, created if it does not exist
+        :param model_key (str): name and version of the sentence model, ex: from get_sentence_model_key
+        :param max_entries (int): number of passages to keep
+        :param flush_every (int): number of new or used entries to buffer before writing them
+        """
+        self.cache_path = cache_path
+        self.model_key = model_key
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+
+        self._new_entries = {}
+        self._used_keys = set()
+
+        self._connection = sqlite3.connect(cache_path, timeout=60)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS sentence_breaks '
+                                 '(key TEXT PRIMARY KEY, breaks BLOB NOT NULL, last_used REAL NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS sentence_breaks_last_used ON sentence_breaks (last_used)')
+        self._connection.commit()
+
+    def get_key(self, doc_text):
+        """
+        :param doc_text (str): biomedical text passage
+        :return key (str): hex digest of the model key and passage text
+        """
+        text_hash = hashlib.sha1(self.model_key.encode('utf-8'))
+        text_hash.update(b'\0')
+        text_hash.update(doc_text.encode('utf-8'))
+        return text_hash.hexdigest()
+
+    def get(self, key, mark_used=True):
+        """
+        :param key (str): passage key, from get_key
+        :param mark_used (bool): record the lookup for eviction.  Worker processes pass False and leave it to the main process.
+        :return sentence_break_indices (list): cached sentence breaks of the passage, or None if it is not cached
+        """
+        sentence_break_indices = self._new_entries.get(key)
+        if sentence_break_indices is None:
+            row = self._connection.execute('SELECT breaks FROM sentence_breaks WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                sentence_break_indices = array.array('i', row[0]).tolist()
+
+        if sentence_break_indices is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if mark_used:
+                self.mark_used(key)
+
+        return sentence_break_indices
+
+    def mark_used(self, key):
+        """
+        Record that a cached passage was used, so it is evicted after passages that were not.
+
+        :param key (str): passage key, from get_key
+        """
+        self._used_keys.add(key)
+        self._maybe_flush()
+
+    def put(self, key, sentence_break_indices):
+        """
+        :param key (str): passage key, from get_key
+        :param sentence_break_indices (list): sentence breaks of the passage
+        """
+        self._new_entries[key] = list(sentence_break_indices)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._new_entries) + len(self._used_keys) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Write buffered entries and last-used times, then evict the least recently used entries above max_entries.
+        """
+        if not self._new_entries and not self._used_keys:
+            return
+
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO sentence_breaks (key, breaks, last_used) VALUES (?, ?, ?)',
+                [(key, array.array('i', breaks).tobytes(), now) for key, breaks in self._new_entries.items()])
+            self._connection.executemany('UPDATE sentence_breaks SET last_used = ? WHERE key = ?',
+                                         [(now, key) for key in self._used_keys])
+
+            n_entries = self._connection.execute('SELECT COUNT(*) FROM sentence_breaks').fetchone()[0]
+            if n_entries > self.max_entries:
+                self._connection.execute('DELETE FROM sentence_breaks WHERE key IN '
+                                         '(SELECT key FROM sentence_breaks ORDER BY last_used LIMIT ?)',
+                                         (n_entries - self.max_entries,))
+
+        self._new_entries = {}
+        self._used_keys = set()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
@@ -0,0 +1,158 @@
+import unicodedata
+
+"""
+This module is a component of the BioNLP bacterial biotope named entity recognition/normalization step.
+
+It splits words into BERT WordPiece tokens with the vocab file of a BERT model (ex: BioBERT or NCBI BlueBERT vocab.txt),
+the same way the tokenizer of the original BERT release does, without tensorflow, torch or transformers:
+    -basic tokenization: control characters are dropped, CJK characters and punctuation are split off, and with
+     do_lower_case the text is lower-cased and stripped of accents
+    -WordPiece: each basic token is split greedily into the longest vocab entries, continuation pieces prefixed with
+     '##'.  Tokens that can not be split, or are longer than max_input_chars_per_word, become [UNK].
+
+Words repeat a lot in biomedical text, so the pieces of each word are cached.
+
+Ex:
+    tokenizer = WordpieceTokenizer(load_vocab('biobert_v1.1_pubmed/vocab.txt'))
+    tokenizer.tokenize_word('β-glucan') -> ['β', '-', 'g', '##lu', '##can']
+"""
+
+UNK_TOKEN = '[UNK]'
+CLS_TOKEN = '[CLS]'
+SEP_TOKEN = '[SEP]'
+PAD_TOKEN = '[PAD]'
+
+def load_vocab(vocab_path):
+    """
+    :param vocab_path (str): path to BERT vocab file, one token per line
+    :return vocab (dict): {token : token ID}, IDs are line numbers
+    """
+    vocab = {}
+    with open(vocab_path, encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            vocab[line.strip()] = index
+    return vocab
+
+def is_whitespace(char):
+    if char in ' \t\n\r':
+        return True
+    return unicodedata.category(char) == 'Zs'
+
+def is_control(char):
+    # \t, \n and \r are whitespace, not control characters
+    if char in '\t\n\r':
+        return False
+    return unicodedata.category(char) in ('Cc', 'Cf')
+
+def is_punctuation(char):
+    # All non-letter/number ASCII (ex: $, ^, `) is punctuation, even if unicode does not classify it as such
+    cp = ord(char)
+    if 33 <= cp <= 47 or 58 <= cp <= 64 or 91 <= cp <= 96 or 123 <= cp <= 126:
+        return True
+    return unicodedata.category(char).startswith('P')
+
+def is_cjk_character(cp):
+    return (0x4E00 <= cp <= 0x9FFF or 0x3400 <= cp <= 0x4DBF or 0x20000 <= cp <= 0x2A6DF or 0x2A700 <= cp <= 0x2B73F or
+            0x2B740 <= cp <= 0x2B81F or 0x2B820 <= cp <= 0x2CEAF or 0xF900 <= cp <= 0xFAFF or 0x2F800 <= cp <= 0x2FA1F)
+
+class WordpieceTokenizer(object):
+    """
+    BERT basic + WordPiece tokenization of words, with a cache of the pieces of each word.
+    """
+
+    def __init__(self, vocab, do_lower_case=False, max_input_chars_per_word=100, cache_size=1000000):
+        """
+        :param vocab (dict): {token : token ID}, from load_vocab
+        :param do_lower_case (bool): lower-case and strip accents, for uncased vocabs
+        :param max_input_chars_per_word (int): longer basic tokens become [UNK]
+        :param cache_size (int): number of words whose pieces are cached.  The cache is emptied when full.
+        """
+        self.vocab = vocab
+        self.do_lower_case = do_lower_case
+        self.max_input_chars_per_word = max_input_chars_per_word
+        self.cache_size = cache_size
+        self.cache = {}
+        self.unk_id = vocab[UNK_TOKEN]
+        # {token ID : token}, built on the first tokenize_word
+        self.id_tokens = None
+
+    def basic_tokenize(self, text):
+        """
+        :param text (str): word or text
+        :return (list): basic tokens, split on whitespace and punctuation
+        """
+        chars = []
+        for char in text:
+            cp = ord(char)
+            if cp == 0 or cp == 0xFFFD or is_control(char):
+                continue
+            if is_whitespace(char):
+                chars.append(' ')
+            elif is_cjk_character(cp):
+                chars.extend((' ', char, ' '))
+            else:
+                chars.append(char)
+
+        tokens = []
+        for token in ''.join(chars).split():
+            if self.do_lower_case:
+                token = ''.join(char for char in unicodedata.normalize('NFD', token.lower())
+                                if unicodedata.category(char) != 'Mn')
+
+            start = 0
+            for i, char in enumerate(token):
+                if is_punctuation(char):
+                    if start < i:
+                        tokens.append(token[start:i])
+                    tokens.append(char)
+                    start = i + 1
+            if start < len(token):
+                tokens.append(token[start:])
+        return tokens
+
+    def wordpiece_tokenize(self, token):
+        """
+        :param token (str): basic token
+        :return (list): IDs of the longest vocab entries token splits into, or [UNK ID]
+        """
+        if len(token) > self.max_input_chars_per_word:
+            return [self.unk_id]
+
+        piece_ids = []
+        start = 0
+        while start < len(token):
+            end = len(token)
+            piece_id = None
+            while start < end:
+                piece = token[start:end] if start == 0 else '##' + token[start:end]
+                piece_id = self.vocab.get(piece)
+                if piece_id is not None:
+                    break
+                end -= 1
+            if piece_id is None:
+                return [self.unk_id]
+            piece_ids.append(piece_id)
+            start = end
+        return piece_ids
+
+    def tokenize_word_ids(self, word):
+        """
+        :param word (str): word, ex: a line of a BERT NER train file
+        :return piece_ids (list): token IDs of the word pieces, empty if the word is only control characters
+        """
+        piece_ids = self.cache.get(word)
+        if piece_ids is None:
+            piece_ids = [piece_id for token in self.basic_tokenize(word) for piece_id in self.wordpiece_tokenize(token)]
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[word] = piece_ids
+        return piece_ids
+
+    def tokenize_word(self, word):
+        """
+        :param word (str): word
+        :return (list): word piece strings
+        """
+        if self.id_tokens is None:
+            self.id_tokens = {token_id: token for token, token_id in self.vocab.items()}
+        return [self.id_tokens[piece_id] for piece_id in self.tokenize_word_ids(word)]